@@ -21,6 +21,16 @@ from blueprints.chat.chat_bp import chat_bp
 from blueprints.follow.follow_bp import follow_bp
 from blueprints.registration.registration_bp import registration_bp
 from blueprints.hackathon.models import Hackathon
+from blueprints.feed.models import rebuild_feed_request_counts
+from blueprints.feed.discover import discover_service, DISCOVER_INDEX_REFRESH_MINUTES
+from blueprints.chat.models import backfill_chat_participants, purge_idempotency_keys
+from blueprints.chat.outbox import outbox_dispatcher
+from blueprints.chat.archive import ensure_message_partitions, archive_old_messages, partition_message_table
+from blueprints.chat.presence import presence_store
+from blueprints.chat.retention import retention_purger
+from blueprints.chat.chat_config import PRESENCE_TTL, MESSAGE_RETENTION_INTERVAL_MINUTES
+from rate_limit import rate_limiter
+from migrations import upgrade_schema
 
 
 # Initialize Flask app
@@ -28,7 +38,7 @@ app = Flask(__name__)
 configure_app(app)
 CORS(app, resources={r"/*": {
     "origins": "*",
-    "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    "methods": ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
     "allow_headers": ["Content-Type", "Authorization", "ngrok-skip-browser-warning"]}},
     supports_credentials=True
     )
@@ -47,6 +57,9 @@ app.register_blueprint(feed_bp, url_prefix='/feed')
 app.register_blueprint(chat_bp, url_prefix='/chat')
 app.register_blueprint(registration_bp, url_prefix='/registration')
 
+# Token-bucket throttling for the write endpoints listed in rate_limit.RATE_LIMITS
+rate_limiter.init_app(app)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -87,9 +100,71 @@ def update_hackathon_statuses():
             db.session.rollback()
             logger.error(f"Status update failed: {str(e)}", exc_info=True)
 
+def message_partition_maintenance():
+    """Pre-create upcoming message partitions and archive old months"""
+    with app.app_context():
+        try:
+            created = ensure_message_partitions()
+            if created:
+                logger.info(f"Created message partitions: {', '.join(created)}")
+            archived = archive_old_messages()
+            logger.info(f"Archived {archived} old messages")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Message partition maintenance failed: {str(e)}", exc_info=True)
+
+def purge_message_idempotency_keys():
+    """Drop batch-send idempotency keys past their retry window"""
+    with app.app_context():
+        try:
+            purged = purge_idempotency_keys()
+            logger.info(f"Purged {purged} message idempotency keys")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Idempotency key purge failed: {str(e)}", exc_info=True)
+
+def purge_expired_messages():
+    """Enforce per-room message retention policies"""
+    with app.app_context():
+        try:
+            stats = retention_purger.run()
+            if stats is None:
+                logger.info("Retention purge skipped; another worker is running it")
+                return
+            logger.info(f"Retention purge removed {stats['messages']} messages and {stats['archives']} "
+                        f"archive files from {stats['rooms']} rooms in {stats['duration_seconds']}s"
+                        + ("" if stats['completed'] else " (stopped early, resuming next run)"))
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Message retention purge failed: {str(e)}", exc_info=True)
+
+def refresh_discover_index():
+    """Rebuild the discover feed index if projects, people or hackathons changed"""
+    with app.app_context():
+        try:
+            index = discover_service.refresh()
+            if index is not None:
+                logger.info(f"Rebuilt discover index with {len(index)} items in {discover_service.last_build_ms}ms")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Discover index rebuild failed: {str(e)}", exc_info=True)
+
+def sweep_chat_presence():
+    """Announce users whose presence heartbeats have stopped"""
+    try:
+        for room_id, user_id in presence_store.sweep():
+            outbox_dispatcher.publish_ephemeral(room_id, 'presence_left', {'user_id': user_id})
+    except Exception as e:
+        logger.error(f"Presence sweep failed: {str(e)}", exc_info=True)
+
 # Initialize database and scheduler
 with app.app_context():
     db.create_all()
+    # create_all() never alters existing tables; bring older databases up to date
+    applied = upgrade_schema()
+    if applied:
+        logger.info(f"Applied schema migrations: {', '.join(applied)}")
+    ensure_message_partitions()
     # Schedule status updates every minute
     scheduler.add_job(
         id='hackathon_status_updater',
@@ -97,9 +172,68 @@ with app.app_context():
         trigger='interval',
         minutes=20
     )
+    scheduler.add_job(
+        id='message_partition_maintenance',
+        func=message_partition_maintenance,
+        trigger='interval',
+        hours=24
+    )
+    scheduler.add_job(
+        id='message_idempotency_key_purge',
+        func=purge_message_idempotency_keys,
+        trigger='interval',
+        hours=1
+    )
+    scheduler.add_job(
+        id='message_retention_purge',
+        func=purge_expired_messages,
+        trigger='interval',
+        minutes=MESSAGE_RETENTION_INTERVAL_MINUTES,
+        max_instances=1
+    )
+    scheduler.add_job(
+        id='discover_index_refresh',
+        func=refresh_discover_index,
+        trigger='interval',
+        minutes=DISCOVER_INDEX_REFRESH_MINUTES,
+        max_instances=1
+    )
+    scheduler.add_job(
+        id='chat_presence_sweeper',
+        func=sweep_chat_presence,
+        trigger='interval',
+        seconds=max(PRESENCE_TTL / 2, 1)
+    )
     scheduler.init_app(app)
     scheduler.start()
 
+# Publish chat realtime events from the outbox in the background
+outbox_dispatcher.init_app(app)
+
+# Build the first discover index without holding up startup or the first request
+discover_service.init_app(app)
+
+@app.cli.command('backfill-chat-participants')
+def backfill_chat_participants_command():
+    """Copy legacy Chat.participants lists into chat_participants (already done once at startup)"""
+    inserted = backfill_chat_participants()
+    logger.info(f"Backfilled {inserted} chat participants")
+
+@app.cli.command('rebuild-feed-request-counts')
+def rebuild_feed_request_counts_command():
+    """Recompute the feed request badge counters from the request tables"""
+    counters = rebuild_feed_request_counts()
+    logger.info(f"Rebuilt {counters} feed request counters")
+
+@app.cli.command('partition-messages')
+def partition_messages_command():
+    """Convert a message table from before partitioning into monthly partitions (locks message while copying)"""
+    copied = partition_message_table()
+    if copied is None:
+        logger.info("message is already partitioned")
+    else:
+        logger.info(f"Copied {copied} messages into the partitioned message table")
+
 # Default route
 @app.route('/')
 def hello():
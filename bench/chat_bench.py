@@ -0,0 +1,304 @@
+"""Chat throughput benchmark.
+
+Seeds a dedicated Postgres database with rooms, participants and messages,
+then drives /chat/send, /chat/get-messages, /chat/user-chats and
+/chat/join-open-group concurrently through the Flask test client (no
+network, realtime events go to a counting stub instead of Pusher). Reports
+p50/p95/p99 latency, throughput and SQL statements per request for each
+endpoint and can save the numbers as JSON to compare against later runs.
+
+    python bench/chat_bench.py --database-url postgresql://localhost/mm_bench --reset \\
+        --rooms 50 --messages 200 --participants 5 --requests 5000 --concurrency 8 \\
+        --output bench_results.json --compare previous.json
+
+Postgres only: the chat schema relies on JSONB, tsvector columns and table
+partitioning, so there is no SQLite mode. --reset drops every table in the
+target database, so never point it at a database you care about.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Endpoint mix: relative weight of each request type
+WORKLOAD = {
+    'send': 40,
+    'get_messages': 30,
+    'user_chats': 20,
+    'join_open_group': 10
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-url', default=os.getenv('BENCH_DATABASE_URL'),
+                        help='Postgres URL of a throwaway database (default: $BENCH_DATABASE_URL)')
+    parser.add_argument('--reset', action='store_true', help='Drop and recreate all tables before seeding')
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=200, help='Messages seeded per room')
+    parser.add_argument('--participants', type=int, default=5, help='Participants per room')
+    parser.add_argument('--open-groups', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    parser.add_argument('--compare', help='Previous results JSON; exit 1 if p95 regresses past --threshold')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed p95 regression ratio (default 0.2)')
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error('--database-url or BENCH_DATABASE_URL is required')
+    if not args.database_url.startswith('postgresql'):
+        parser.error('the chat schema needs Postgres; SQLite is not supported')
+    return args
+
+
+def load_app(database_url):
+    # Must be set before the app is imported: config and module-level singletons read them
+    os.environ['SQLALCHEMY_DATABASE_URI'] = database_url
+    os.environ['REALTIME_BACKEND'] = 'sse'
+    os.environ['RATE_LIMIT_ENABLED'] = 'false'
+    sys.path.insert(0, ROOT)
+    import app as app_module
+    from blueprints.chat.outbox import outbox_dispatcher
+    outbox_dispatcher.backend = StubBackend()
+    return app_module.app, outbox_dispatcher.backend
+
+
+class StubBackend:
+    """Stands in for Pusher: counts events instead of sending them."""
+    name = 'stub'
+
+    def __init__(self):
+        self.events = 0
+        self._lock = threading.Lock()
+
+    def trigger_batch(self, events):
+        with self._lock:
+            self.events += len(events)
+
+    def stats(self):
+        return {'events': self.events}
+
+
+def seed(app, args):
+    from config import db
+    from blueprints.auth.models import User
+    from blueprints.chat.models import Chat, ChatParticipant, Message, IST_OFFSET
+    from blueprints.chat.archive import ensure_message_partitions
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+            db.create_all()
+            ensure_message_partitions()
+
+        user_count = max(args.participants * 4, args.participants + 1)
+        users = [f'bench-user-{i}' for i in range(user_count)]
+        db.session.execute(db.insert(User.__table__), [
+            {'clerkId': user, 'name': user.upper(), 'email': f'{user}@bench.local', 'role': 'user'}
+            for user in users
+        ])
+
+        rooms = [f'bench-room-{i}' for i in range(args.rooms)]
+        groups = [f'open-bench-{i}' for i in range(args.open_groups)]
+        chat_ids = db.session.execute(db.insert(Chat.__table__).returning(Chat.__table__.c.id), [
+            {'room_id': room, 'is_group': True, 'is_open_group': False, 'topic': None,
+             'participant_count': args.participants}
+            for room in rooms
+        ] + [
+            {'room_id': group, 'is_group': True, 'is_open_group': True, 'topic': group, 'participant_count': 0}
+            for group in groups
+        ]).scalars().all()
+
+        members = {}
+        participant_rows = []
+        for room, chat_id in zip(rooms, chat_ids):
+            members[room] = rng.sample(users, args.participants)
+            participant_rows += [{'chat_id': chat_id, 'clerk_id': user, 'role': 'member'} for user in members[room]]
+        db.session.execute(db.insert(ChatParticipant.__table__), participant_rows)
+
+        now = datetime.now() + IST_OFFSET
+        batch = []
+        for room in rooms:
+            for i in range(args.messages):
+                batch.append({
+                    'room_id': room,
+                    'sender_id': rng.choice(members[room]),
+                    'content': f'bench message {i} ' + 'lorem ipsum ' * rng.randint(1, 20),
+                    'created_at': now - timedelta(minutes=args.messages - i)
+                })
+                if len(batch) >= 5000:
+                    db.session.execute(db.insert(Message.__table__), batch)
+                    batch = []
+        if batch:
+            db.session.execute(db.insert(Message.__table__), batch)
+        db.session.commit()
+    return users, members, groups
+
+
+class QueryCounter:
+    """Counts SQL statements per thread, so dispatcher queries are not attributed to requests."""
+
+    def __init__(self, engine):
+        self._local = threading.local()
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+def build_requests(args, users, members, groups):
+    rng = random.Random(args.seed + 1)
+    names = list(WORKLOAD)
+    weights = [WORKLOAD[name] for name in names]
+    rooms = list(members)
+    plan = []
+    for kind in rng.choices(names, weights, k=args.requests):
+        room = rng.choice(rooms)
+        user = rng.choice(members[room])
+        if kind == 'send':
+            plan.append((kind, 'POST', '/chat/send',
+                         {'room_id': room, 'sender_id': user, 'content': f'bench {rng.random()}'}))
+        elif kind == 'get_messages':
+            plan.append((kind, 'GET', f'/chat/get-messages/{room}?user_id={user}&limit=50', None))
+        elif kind == 'user_chats':
+            plan.append((kind, 'GET', f'/chat/user-chats?clerkId={user}', None))
+        else:
+            group = rng.choice(groups)
+            plan.append((kind, 'POST', '/chat/join-open-group',
+                         {'user_id': rng.choice(users), 'topic_slug': group[len('open-'):]}))
+    return plan
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run(app, plan, concurrency, counter):
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    local = threading.local()
+
+    def execute(item):
+        kind, method, url, body = item
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        counter.reset()
+        started = time.perf_counter()
+        response = client.open(url, method=method, json=body)
+        elapsed = time.perf_counter() - started
+        with lock:
+            samples[kind].append((elapsed, response.status_code, counter.count))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(execute, plan))
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples, duration):
+    endpoints = {}
+    for kind, rows in sorted(samples.items()):
+        latencies = sorted(row[0] * 1000 for row in rows)
+        endpoints[kind] = {
+            'requests': len(rows),
+            'errors': sum(1 for row in rows if row[1] >= 400),
+            'throughput_rps': round(len(rows) / duration, 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'queries_per_request': round(sum(row[2] for row in rows) / len(rows), 2)
+        }
+    total = sum(endpoint['requests'] for endpoint in endpoints.values())
+    return {'duration_seconds': round(duration, 3), 'throughput_rps': round(total / duration, 2), 'endpoints': endpoints}
+
+
+def print_report(summary):
+    print(f"{'endpoint':<18}{'reqs':>7}{'errs':>6}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}")
+    for kind, stats in summary['endpoints'].items():
+        print(f"{kind:<18}{stats['requests']:>7}{stats['errors']:>6}{stats['throughput_rps']:>9}"
+              f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}{stats['queries_per_request']:>9}")
+    print(f"total {summary['throughput_rps']} req/s over {summary['duration_seconds']}s")
+
+
+def compare(summary, previous, threshold):
+    """Print p95 changes against a previous run; returns the endpoints that regressed."""
+    regressions = []
+    for kind, stats in summary['endpoints'].items():
+        before = previous.get('endpoints', {}).get(kind)
+        if not before or not before.get('p95_ms'):
+            continue
+        change = stats['p95_ms'] / before['p95_ms'] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(kind)
+            flag = '  REGRESSION'
+        print(f"{kind:<18}p95 {before['p95_ms']} -> {stats['p95_ms']} ms ({change:+.1%}){flag}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    app, backend = load_app(args.database_url)
+    from config import db
+
+    print(f"Seeding {args.rooms} rooms x {args.messages} messages x {args.participants} participants...")
+    users, members, groups = seed(app, args)
+    plan = build_requests(args, users, members, groups)
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+
+    print(f"Running {len(plan)} requests with concurrency {args.concurrency}...")
+    samples, duration = run(app, plan, args.concurrency, counter)
+    summary = summarize(samples, duration)
+    summary['realtime_events'] = backend.events
+    summary['parameters'] = {key: value for key, value in vars(args).items()
+                             if key not in ('database_url', 'output', 'compare')}
+    summary['revision'] = git_revision()
+    summary['recorded_at'] = datetime.utcnow().isoformat()
+    print_report(summary)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare(summary, previous, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,10 @@ from config import db
 from blueprints.auth.models import User
 from flasgger import swag_from
 from blueprints.hackathon.models import Hackathon
-from blueprints.chat.models import Chat
+from blueprints.chat.models import Chat, ChatParticipant, Message
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, parse_limit
 
 
 auth_bp = Blueprint('auth_bp', __name__)
@@ -240,8 +243,7 @@ def create_open_group():
         is_open_group=True,
         topic=data['topic'],
         description=data.get('description'),
-        created_by=data['clerkId'],
-        participants=[]
+        created_by=data['clerkId']
     )
     db.session.add(new_group)
     db.session.commit()
@@ -253,37 +255,113 @@ def create_open_group():
     }), 201
 
 # Get All Open Groups
+OPEN_GROUP_SORTS = ('members', 'recent', 'activity')
+
 @auth_bp.route('/open-groups', methods=['GET'])
 @swag_from({
     'tags': ['Auth'],
-    'summary': 'Get list of all open groups',
+    'summary': 'Get a page of the open group directory',
+    'parameters': [
+        {'name': 'sort', 'in': 'query', 'type': 'string', 'enum': list(OPEN_GROUP_SORTS), 'default': 'members',
+         'description': 'members (largest first), recent (newest group first) or activity (latest message first)'},
+        {'name': 'limit', 'in': 'query', 'type': 'integer',
+         'description': f'Page size (default {DEFAULT_PAGE_SIZE}, max {MAX_PAGE_SIZE})'},
+        {'name': 'offset', 'in': 'query', 'type': 'integer', 'default': 0},
+        {'name': 'include_members', 'in': 'query', 'type': 'boolean', 'default': False,
+         'description': 'Also return each group\'s participant ids'},
+        {'name': 'If-None-Match', 'in': 'header', 'type': 'string', 'required': False}
+    ],
     'responses': {
         200: {
-            'description': 'List of open groups',
+            'description': 'Page of open groups; carries an ETag',
             'schema': {
-                'type': 'array',
-                'items': {
-                    'type': 'object',
-                    'properties': {
-                        'room_id': {'type': 'string'},
-                        'topic': {'type': 'string'},
-                        'description': {'type': 'string'},
-                        'participant_count': {'type': 'integer'}
-                    }
+                'type': 'object',
+                'properties': {
+                    'groups': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'room_id': {'type': 'string'},
+                                'topic': {'type': 'string'},
+                                'description': {'type': 'string'},
+                                'participant_count': {'type': 'integer'},
+                                'created_at': {'type': 'string'},
+                                'last_activity_at': {'type': 'string'},
+                                'participants': {'type': 'array', 'items': {'type': 'string'}}
+                            }
+                        }
+                    },
+                    'total': {'type': 'integer'},
+                    'next_offset': {'type': 'integer'}
                 }
             }
-        }
+        },
+        304: {'description': 'Directory unchanged since the ETag in If-None-Match'},
+        400: {'description': 'Invalid sort'}
     }
 })
 def get_open_groups():
-    groups = Chat.query.filter_by(is_open_group=True).all()
-    return jsonify([{
-        'room_id': g.room_id,
-        'topic': g.topic,
-        'description': g.description,
-        'participant_count': len(g.participants),
-        'participants': g.participants
-    } for g in groups])
+    sort = request.args.get('sort', 'members')
+    if sort not in OPEN_GROUP_SORTS:
+        return jsonify({"error": f"sort must be one of {', '.join(OPEN_GROUP_SORTS)}"}), 400
+    limit = parse_limit(request.args.get('limit', type=int))
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    include_members = request.args.get('include_members', 'false').lower() == 'true'
+
+    # Deleted messages are not activity; the predicate also matches the partial history index
+    last_activity = select(func.max(Message.created_at))\
+        .where(Message.room_id == Chat.room_id, Message.deleted_at.is_(None))\
+        .correlate(Chat)\
+        .scalar_subquery()
+    order = {
+        'members': Chat.participant_count.desc(),
+        'recent': Chat.created_at.desc(),
+        'activity': last_activity.desc().nulls_last()
+    }[sort]
+
+    query = db.session.query(Chat, last_activity, func.count().over())\
+        .filter(Chat.is_open_group == True)
+    rows = query.order_by(order, Chat.id).limit(limit + 1).offset(offset).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        total = rows[0][2]
+    else:
+        total = db.session.query(func.count(Chat.id)).filter(Chat.is_open_group == True).scalar()
+
+    members = {}
+    if include_members and rows:
+        members = dict(db.session.query(
+                ChatParticipant.chat_id,
+                func.array_agg(aggregate_order_by(ChatParticipant.clerk_id, ChatParticipant.joined_at))
+            )
+            .filter(ChatParticipant.chat_id.in_([g.id for g, _, _ in rows]))
+            .group_by(ChatParticipant.chat_id))
+
+    directory = []
+    for g, last_activity_at, _ in rows:
+        entry = {
+            'room_id': g.room_id,
+            'topic': g.topic,
+            'description': g.description,
+            'participant_count': g.participant_count,
+            'created_at': g.created_at.isoformat() if g.created_at else None,
+            'last_activity_at': last_activity_at.isoformat() if last_activity_at else None
+        }
+        if include_members:
+            entry['participants'] = members.get(g.id, [])
+        directory.append(entry)
+
+    response = jsonify({
+        'groups': directory,
+        'total': total,
+        'next_offset': offset + limit if has_more else None
+    })
+    # Lets clients revalidate with If-None-Match and get a 304 when nothing changed
+    response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 # Get Group Details
 @auth_bp.route('/open-group/<topic_slug>', methods=['GET'])
@@ -310,7 +388,8 @@ def get_open_group_details(topic_slug):
         'room_id': group.room_id,
         'topic': group.topic,
         'description': group.description,
-        'participants': group.participants,
+        'participant_count': group.participant_count,
+        'participants': group.participant_ids,
         'created_at': group.created_at.isoformat()
     })
 
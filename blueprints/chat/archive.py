@@ -0,0 +1,391 @@
+"""Monthly message partitions and the cold archive of old months.
+
+Months older than MESSAGE_ARCHIVE_AFTER_MONTHS are compacted into one zstd
+JSONL file per room and month and removed from the message table. From then
+on they are only reachable through history paging (read_archived_messages):
+full-text search, /chat/sync, edits, deletes and /chat/message-changes only
+see the live table.
+
+db.create_all() only creates message partitioned on a fresh database. A
+message table from before partitioning stays a plain table, and partition
+maintenance and archiving stay off (with a warning at every run) until it is
+converted once with `flask partition-messages` (partition_message_table()).
+"""
+import json
+import logging
+import os
+import re
+from datetime import date, datetime
+from urllib.parse import quote
+import zstandard
+from sqlalchemy import tuple_
+from config import db
+from cache import TTLCache
+from blueprints.auth.models import User
+from blueprints.chat.models import Message, MessageArchive, IST_OFFSET
+from blueprints.chat.chat_config import (
+    MESSAGE_PARTITIONS_AHEAD,
+    MESSAGE_ARCHIVE_AFTER_MONTHS,
+    MESSAGE_ARCHIVE_DIR,
+    MESSAGE_ARCHIVE_CACHE_SIZE,
+    MESSAGE_ARCHIVE_CACHE_TTL
+)
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r'^message_y(\d{4})m(\d{2})$')
+DEFAULT_PARTITION = 'message_default'
+DELETE_BATCH_SIZE = 5000
+EXPORT_BATCH_SIZE = 1000
+ARCHIVE_LOCK_KEY = 741201  # advisory lock key; one partition maintainer or archiver across all workers
+
+# Decoded archive files by MessageArchive.id; history pages of one room-month share a decode
+_archive_cache = TTLCache(MESSAGE_ARCHIVE_CACHE_SIZE, MESSAGE_ARCHIVE_CACHE_TTL)
+
+
+def _current_month():
+    # Message.created_at is stored in IST
+    now = datetime.now() + IST_OFFSET
+    return date(now.year, now.month, 1)
+
+
+def _add_months(month, count):
+    years, index = divmod(month.month - 1 + count, 12)
+    return date(month.year + years, index + 1, 1)
+
+
+def _partition_name(month):
+    return f"message_y{month.year:04d}m{month.month:02d}"
+
+
+def is_partitioned():
+    return db.session.execute(db.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('message'))"
+    )).scalar()
+
+
+def _partitions():
+    """({month: partition_name}, has_default_partition) for the message table."""
+    names = db.session.execute(db.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('message')"
+    )).scalars().all()
+    months = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return months, DEFAULT_PARTITION in names
+
+
+def ensure_message_partitions(months_ahead=MESSAGE_PARTITIONS_AHEAD):
+    """Create monthly partitions from the current month up to months_ahead.
+
+    A DEFAULT partition catches anything outside them so inserts never fail.
+    Every worker runs this at startup and from the scheduler, so it shares the
+    archiver's advisory lock and returns at once while another worker holds it.
+    Only warns when message is a plain (legacy, unpartitioned) table.
+    Returns the names of the partitions created.
+    """
+    if not is_partitioned():
+        logger.warning("message is not partitioned, so partition maintenance and archiving are off; "
+                       "convert it once with `flask partition-messages`")
+        db.session.commit()
+        return []
+    if not db.session.execute(db.text("SELECT pg_try_advisory_xact_lock(:key)"),
+                              {'key': ARCHIVE_LOCK_KEY}).scalar():
+        db.session.commit()
+        return []
+    created = _create_partitions(months_ahead)
+    db.session.commit()
+    return created
+
+
+def _create_partitions(months_ahead):
+    existing, has_default = _partitions()
+    created = []
+    month = _current_month()
+    for _ in range(months_ahead + 1):
+        if month not in existing:
+            name = _partition_name(month)
+            db.session.execute(db.text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF message "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+            ))
+            created.append(name)
+        month = _add_months(month, 1)
+    if not has_default:
+        db.session.execute(db.text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF message DEFAULT"))
+        created.append(DEFAULT_PARTITION)
+    return created
+
+
+def partition_message_table():
+    """Convert a legacy, unpartitioned message table into the partitioned one, in one transaction.
+
+    The old table is renamed away, the partitioned table is created from the
+    model and every row is copied across, so message is locked for the whole
+    copy: run it once, at a quiet time. Months before the current one land in
+    the DEFAULT partition, which archive_old_messages() empties month by month.
+    Returns the number of messages copied, or None if message is already
+    partitioned.
+    """
+    db.session.execute(db.text("SELECT pg_advisory_xact_lock(:key)"), {'key': ARCHIVE_LOCK_KEY})
+    if is_partitioned():
+        db.session.commit()
+        return None
+    db.session.execute(db.text("LOCK TABLE message IN ACCESS EXCLUSIVE MODE"))
+    legacy_columns = set(db.session.execute(db.text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = 'message'"
+    )).scalars())
+
+    # Free the table, index and sequence names the partitioned table is created with
+    db.session.execute(db.text("ALTER TABLE message RENAME TO message_unpartitioned"))
+    indexes = db.session.execute(db.text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = 'message_unpartitioned'"
+    )).scalars().all()
+    for name in indexes:
+        db.session.execute(db.text(f'ALTER INDEX "{name}" RENAME TO "{name[:49]}_unpartitioned"'))
+    sequence = db.session.execute(db.text("SELECT pg_get_serial_sequence('message_unpartitioned', 'id')")).scalar()
+    if sequence:
+        db.session.execute(db.text(f"ALTER SEQUENCE {sequence} RENAME TO message_unpartitioned_id_seq"))
+
+    Message.__table__.create(db.session.connection())
+    _create_partitions(MESSAGE_PARTITIONS_AHEAD)
+    # Generated columns fill themselves in; created_at is part of the new primary key
+    columns = [column.name for column in Message.__table__.columns
+               if column.computed is None and column.name in legacy_columns]
+    selected = ['coalesce(created_at, make_timestamp(1970, 1, 1, 0, 0, 0))' if name == 'created_at' else name
+                for name in columns]
+    copied = db.session.execute(db.text(
+        f"INSERT INTO message ({', '.join(columns)}) SELECT {', '.join(selected)} FROM message_unpartitioned"
+    )).rowcount
+    db.session.execute(db.text(
+        "SELECT setval(pg_get_serial_sequence('message', 'id'), coalesce(max(id), 0) + 1, false) FROM message"
+    ))
+    db.session.execute(db.text("DROP TABLE message_unpartitioned"))
+    db.session.commit()
+    return copied
+
+
+def archive_old_messages(older_than_months=MESSAGE_ARCHIVE_AFTER_MONTHS):
+    """Compact every month older than the cutoff into per-room archive files.
+
+    Opt-in: does nothing unless MESSAGE_ARCHIVE_DIR is set and message is
+    partitioned. Months with their own partition are detached and dropped once
+    archived; rows in the DEFAULT partition are deleted in batches. Every
+    worker schedules this job, so a run that cannot take the advisory lock
+    returns at once. Safe to re-run after a crash. Returns the number of
+    messages archived.
+    """
+    if not MESSAGE_ARCHIVE_DIR or not is_partitioned():
+        db.session.commit()
+        return 0
+    # Session-level lock on a connection of its own, since the run commits as it goes
+    with db.engine.connect() as lock_connection:
+        if not lock_connection.execute(db.text("SELECT pg_try_advisory_lock(:key)"),
+                                       {'key': ARCHIVE_LOCK_KEY}).scalar():
+            db.session.commit()
+            return 0
+        try:
+            return _archive_months(_add_months(_current_month(), -older_than_months))
+        finally:
+            lock_connection.execute(db.text("SELECT pg_advisory_unlock(:key)"), {'key': ARCHIVE_LOCK_KEY})
+            lock_connection.commit()
+
+
+def _archive_months(cutoff):
+    partitions, has_default = _partitions()
+    months = {month: name for month, name in partitions.items() if month < cutoff}
+    if has_default:
+        oldest = db.session.execute(db.text(
+            f"SELECT min(created_at) FROM {DEFAULT_PARTITION} WHERE created_at < :cutoff"
+        ), {'cutoff': cutoff}).scalar()
+        if oldest:
+            month = date(oldest.year, oldest.month, 1)
+            while month < cutoff:
+                months.setdefault(month, None)
+                month = _add_months(month, 1)
+    db.session.commit()
+
+    archived = 0
+    for month in sorted(months):
+        archived += _archive_month(month, months[month])
+    return archived
+
+
+def _archive_path(room_id, month):
+    # Percent-encode room ids (dots included) so they are safe directory names
+    directory = quote(room_id, safe='').replace('.', '%2E')
+    return os.path.join(MESSAGE_ARCHIVE_DIR, directory, f"{month:%Y-%m}.jsonl.zst")
+
+
+def _archive_month(month, partition):
+    start, end = month, _add_months(month, 1)
+    done = {room_id for room_id, in db.session.query(MessageArchive.room_id).filter_by(month=month)}
+
+    rows = db.session.query(
+            Message.id, Message.room_id, Message.sender_id, Message.content, Message.attachments,
+            Message.version, Message.edited_at, Message.created_at
+        )\
+        .filter(Message.created_at >= start, Message.created_at < end, Message.deleted_at.is_(None))\
+        .order_by(Message.room_id, Message.created_at, Message.id)\
+        .yield_per(EXPORT_BATCH_SIZE)
+
+    records = []
+    writer = None
+    for row in rows:
+        if row.room_id in done:
+            continue
+        if writer is None or writer.room_id != row.room_id:
+            if writer:
+                records.append(writer.close())
+            writer = _ArchiveWriter(row.room_id, month, _archive_path(row.room_id, month))
+        writer.write(row)
+    if writer:
+        records.append(writer.close())
+
+    if records:
+        db.session.add_all(records)
+    db.session.commit()
+    count = sum(record.message_count for record in records)
+
+    if partition:
+        db.session.execute(db.text(f"ALTER TABLE message DETACH PARTITION {partition}"))
+        db.session.execute(db.text(f"DROP TABLE {partition}"))
+        db.session.commit()
+    else:
+        _delete_range(start, end)
+    logger.info(f"Archived {count} messages from {month:%Y-%m} into {len(records)} room files")
+    return count
+
+
+def _delete_range(start, end):
+    while True:
+        result = db.session.execute(db.text("""
+            DELETE FROM message WHERE (id, created_at) IN (
+                SELECT id, created_at FROM message
+                WHERE created_at >= :start AND created_at < :end
+                LIMIT :batch
+            )
+        """), {'start': start, 'end': end, 'batch': DELETE_BATCH_SIZE})
+        db.session.commit()
+        if result.rowcount < DELETE_BATCH_SIZE:
+            return
+
+
+class _ArchiveWriter:
+    """Streams one room-month of messages into <path>.tmp, renamed into place on close."""
+
+    def __init__(self, room_id, month, path):
+        self.room_id = room_id
+        self.month = month
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path + '.tmp', 'wb')
+        self._stream = zstandard.ZstdCompressor(level=10).stream_writer(self._file)
+        self.count = 0
+        self.first = None
+        self.last = None
+
+    def write(self, row):
+        self._stream.write((json.dumps({
+            'id': row.id,
+            'sender_id': row.sender_id,
+            'content': row.content,
+            'attachments': row.attachments,
+            'version': row.version,
+            'edited_at': row.edited_at.isoformat() if row.edited_at else None,
+            'created_at': row.created_at.isoformat()
+        }) + '\n').encode())
+        position = (row.created_at, row.id)
+        self.first = self.first or position
+        self.last = position
+        self.count += 1
+
+    def close(self):
+        self._stream.flush(zstandard.FLUSH_FRAME)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._stream.close()
+        os.replace(self.path + '.tmp', self.path)
+        return MessageArchive(
+            room_id=self.room_id,
+            month=self.month,
+            path=self.path,
+            message_count=self.count,
+            first_created_at=self.first[0],
+            first_message_id=self.first[1],
+            last_created_at=self.last[0],
+            last_message_id=self.last[1]
+        )
+
+
+def _decode(path):
+    with open(path, 'rb') as f:
+        with zstandard.ZstdDecompressor().stream_reader(f) as reader:
+            data = reader.read()
+    records = []
+    for line in data.decode().splitlines():
+        record = json.loads(line)
+        record['created_at'] = datetime.fromisoformat(record['created_at'])
+        record['edited_at'] = datetime.fromisoformat(record['edited_at']) if record.get('edited_at') else None
+        records.append(record)
+    return records
+
+
+def _load(archive):
+    records = _archive_cache.get_or_load(archive.id, lambda: _decode(archive.path))
+    for record in records:
+        yield Message(
+            id=record['id'],
+            room_id=archive.room_id,
+            sender_id=record['sender_id'],
+            content=record['content'],
+            attachments=record.get('attachments'),
+            version=record.get('version', 1),
+            edited_at=record['edited_at'],
+            created_at=record['created_at']
+        )
+
+
+def read_archived_messages(room_id, cursor=None, limit=50, after=False):
+    """Archived (Message, sender_name) pairs of a room beyond cursor, oldest first.
+
+    Reads whole room-month files from newest (or oldest, with after=True) until
+    at least limit + 1 messages are collected, so callers can detect has_more.
+    The Message objects are transient and never attached to the session.
+    """
+    archives = MessageArchive.query.filter_by(room_id=room_id)
+    if after:
+        if cursor:
+            archives = archives.filter(
+                tuple_(MessageArchive.last_created_at, MessageArchive.last_message_id) > cursor
+            )
+        archives = archives.order_by(MessageArchive.month.asc())
+    else:
+        if cursor:
+            archives = archives.filter(
+                tuple_(MessageArchive.first_created_at, MessageArchive.first_message_id) < cursor
+            )
+        archives = archives.order_by(MessageArchive.month.desc())
+
+    collected = []
+    for archive in archives:
+        messages = [
+            message for message in _load(archive)
+            if cursor is None
+            or (after and (message.created_at, message.id) > cursor)
+            or (not after and (message.created_at, message.id) < cursor)
+        ]
+        collected = collected + messages if after else messages + collected
+        if len(collected) > limit:
+            break
+    collected = collected[:limit + 1] if after else collected[-(limit + 1):]
+
+    sender_ids = {message.sender_id for message in collected}
+    names = dict(
+        db.session.query(User.clerkId, User.name).filter(User.clerkId.in_(sender_ids))
+    ) if sender_ids else {}
+    return [(message, names.get(message.sender_id)) for message in collected]
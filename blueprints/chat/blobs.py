@@ -0,0 +1,92 @@
+import hashlib
+import os
+import tempfile
+import time
+from blueprints.chat.chat_config import ATTACHMENT_DIR
+
+CHUNK_SIZE = 64 * 1024
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+class BlobStore:
+    """Content-addressed files on local disk: <root>/<aa>/<bb>/<sha256>.
+
+    Identical uploads share one file. Blobs are immutable, so a written
+    path never changes and can be served with long-lived validators.
+    A store without a root (ATTACHMENT_DIR unset) holds nothing.
+    """
+
+    def __init__(self, root=ATTACHMENT_DIR):
+        self.root = root
+
+    @property
+    def configured(self):
+        return bool(self.root)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return self.configured and os.path.exists(self.path(digest))
+
+    def put_stream(self, stream, max_size):
+        """Copy stream into the store in chunks; returns (sha256 hex, size).
+
+        Raises BlobTooLarge once more than max_size bytes have been read.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        sha256 = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_size:
+                        raise BlobTooLarge(f"Attachment exceeds {max_size} bytes")
+                    sha256.update(chunk)
+                    tmp.write(chunk)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            digest = sha256.hexdigest()
+            target = self.path(digest)
+            try:
+                # Already stored: bump its mtime so a concurrent delete() keeps it
+                os.utime(target)
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp_path, target)
+            return digest, size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def delete(self, digest, min_age, in_use):
+        """Remove a blob unless it was stored within min_age seconds or in_use() is true.
+
+        The file is moved aside before in_use() is asked, so an upload racing
+        with the delete either re-creates it or finds it moved back.
+        Returns True if the blob was removed.
+        """
+        path = self.path(digest)
+        doomed = path + '.gc'
+        try:
+            os.replace(path, doomed)
+        except FileNotFoundError:
+            return False
+        if time.time() - os.stat(doomed).st_mtime < min_age or in_use():
+            os.replace(doomed, path)
+            return False
+        os.remove(doomed)
+        return True
+
+
+blob_store = BlobStore()
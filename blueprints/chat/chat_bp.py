@@ -1,16 +1,70 @@
-from flask import Blueprint, request, jsonify
+import os
+from flask import Blueprint, Response, request, jsonify, send_file
 from config import db
 from flasgger import swag_from
-from blueprints.chat.models import Chat, Message
+from blueprints.chat.models import Chat, ChatParticipant, ChatReadCursor, ChatAttachment, Message, MessageIdempotencyKey, SEARCH_CONFIG, membership_cache
 from blueprints.projects.models import Project
-from blueprints.chat.chat_config import pusher_client
+from blueprints.registration.models import Team
+from blueprints.chat import outbox
+from blueprints.chat.outbox import outbox_dispatcher
+from blueprints.chat.realtime import realtime_backend, SSEBroker
+from blueprints.chat.archive import read_archived_messages
+from blueprints.chat.presence import presence_store
+from blueprints.chat.retention import retention_purger
+from blueprints.chat.chat_config import (
+    PRESENCE_TTL,
+    PRESENCE_TYPING_TTL,
+    MAX_MESSAGE_LENGTH,
+    ATTACHMENT_MAX_SIZE,
+    ATTACHMENT_GC_GRACE_HOURS,
+    MAX_ATTACHMENTS_PER_MESSAGE,
+    MESSAGE_CHANGES_SAFETY_WINDOW
+)
+from blueprints.chat.blobs import blob_store, BlobTooLarge
+from blueprints.chat.wire import columnar_messages, payload_response
 from datetime import datetime, timedelta
 from blueprints.auth.models import User
+from sqlalchemy import tuple_, and_, func, select, true, values, column, String, Integer
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert as pg_insert
+from sqlalchemy.orm import aliased
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, parse_limit, encode_cursor, decode_cursor
 
 IST_OFFSET = timedelta(hours=5, minutes=30)
 
 chat_bp = Blueprint('chat_bp', __name__)
 
+def _serialize_message(message, sender_name):
+    return {
+        'id': message.id,
+        'sender_id': message.sender_id,
+        'sender_name': sender_name,
+        'content': message.content,
+        'attachments': message.attachments or [],
+        'version': message.version or 1,
+        'edited_at': message.edited_at.isoformat() if message.edited_at else None,
+        'timestamp': message.created_at.isoformat()
+    }
+
+def _message_attachments(room_id, sender_id, attachment_ids):
+    """Attachment refs for a message, or an error string if any id is unusable.
+
+    Only files the sender uploaded to the same room can be attached.
+    """
+    if not attachment_ids:
+        return None, None
+    if not isinstance(attachment_ids, list) or not all(isinstance(i, int) for i in attachment_ids):
+        return None, "attachment_ids must be a list of integers"
+    if len(attachment_ids) > MAX_ATTACHMENTS_PER_MESSAGE:
+        return None, f"At most {MAX_ATTACHMENTS_PER_MESSAGE} attachments per message"
+    found = {attachment.id: attachment for attachment in ChatAttachment.query.filter(
+        ChatAttachment.id.in_(attachment_ids),
+        ChatAttachment.room_id == room_id,
+        ChatAttachment.uploader_id == sender_id
+    )}
+    if len(found) != len(set(attachment_ids)):
+        return None, "Unknown attachment"
+    return [found[attachment_id].to_ref() for attachment_id in dict.fromkeys(attachment_ids)], None
+
 @swag_from({
     'tags': ['Chat'],
     'summary': 'Create a direct message (DM) room between two users',
@@ -62,11 +116,9 @@ def create_dm():
         return jsonify({"room_id": room_id})
         
     # Create new DM
-    new_chat = Chat(
-        room_id=room_id,
-        participants=[user1, user2]
-    )
-    db.session.add(new_chat)
+    new_chat = Chat(room_id=room_id)
+    new_chat.add_participant(user1)
+    new_chat.add_participant(user2)
     db.session.commit()
     
     return jsonify({"room_id": room_id}), 201
@@ -74,7 +126,7 @@ def create_dm():
 @chat_bp.route('/get-messages/<room_id>', methods=['GET'])
 @swag_from({
     'tags': ['Chat'],
-    'summary': 'Get messages for a chat room',
+    'summary': 'Get a page of messages for a chat room',
     'parameters': [
         {
             'name': 'room_id',
@@ -89,50 +141,264 @@ def create_dm():
             'type': 'string',
             'required': True,
             'description': 'User ID for authorization'
+        },
+        {
+            'name': 'before',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Cursor; return messages older than this position'
+        },
+        {
+            'name': 'after',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Cursor; return messages newer than this position'
+        },
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': f'Page size (default {DEFAULT_PAGE_SIZE}, max {MAX_PAGE_SIZE})'
+        },
+        {
+            'name': 'format',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['rows', 'columnar'],
+            'default': 'rows',
+            'description': 'columnar replaces messages with {senders, columns}: one array per field '
+                           '(id, sender_index, content, timestamp, version, and attachments / edited_at '
+                           'when any message has them) and a sender_index into senders'
         }
     ],
+    'produces': ['application/json', 'application/msgpack'],
     'responses': {
         200: {
-            'description': 'List of messages',
+            'description': 'Page of messages in chronological order. Without a cursor the newest '
+                           'page is returned; next_cursor continues in the requested direction. '
+                           'Sent as MessagePack when Accept asks for application/msgpack, and '
+                           'gzip/br compressed per Accept-Encoding.',
             'schema': {
-                'type': 'array',
-                'items': {
-                    'type': 'object',
-                    'properties': {
-                        'sender_id': {'type': 'string'},
-                        'content': {'type': 'string'},
-                        'timestamp': {'type': 'string'}
-                    }
+                'type': 'object',
+                'properties': {
+                    'messages': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'id': {'type': 'integer'},
+                                'sender_id': {'type': 'string'},
+                                'sender_name': {'type': 'string'},
+                                'content': {'type': 'string'},
+                                'version': {'type': 'integer'},
+                                'edited_at': {'type': 'string'},
+                                'timestamp': {'type': 'string'}
+                            }
+                        }
+                    },
+                    'next_cursor': {'type': 'string'},
+                    'latest_cursor': {'type': 'string'},
+                    'has_more': {'type': 'boolean'}
                 }
             }
         },
+        400: {'description': 'Invalid cursor'},
         403: {'description': 'Unauthorized'},
         404: {'description': 'Room not found'}
     }
 })
 def get_messages(room_id):
     user_id = request.args.get('user_id')
-    chat = Chat.query.filter_by(room_id=room_id).first()
+    before = request.args.get('before')
+    after = request.args.get('after')
+    limit = parse_limit(request.args.get('limit', type=int))
+
+    layout = request.args.get('format', 'rows')
+    if before and after:
+        return jsonify({"error": "Use either before or after, not both"}), 400
+    if layout not in ('rows', 'columnar'):
+        return jsonify({"error": "format must be rows or columnar"}), 400
+    try:
+        cursor = decode_cursor(before or after) if (before or after) else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    membership = Chat.membership(room_id, user_id)
     
-    if not chat:
+    if not membership:
         return jsonify({"error": "Room not found"}), 404
-    if user_id not in chat.participants:
+    if not membership[1]:
         return jsonify({"error": "Unauthorized"}), 403
     
-    # In get_messages route
-    messages = db.session.query(Message, User.name)\
+    # Keyset pagination over the (room_id, created_at, id) index
+    position = tuple_(Message.created_at, Message.id)
+    query = db.session.query(Message, User.name)\
         .join(User, Message.sender_id == User.clerkId)\
-        .filter(Message.room_id == room_id)\
-        .order_by(Message.created_at.asc())\
-        .all()
+        .filter(Message.room_id == room_id, Message.deleted_at.is_(None))
+    if after:
+        query = query.filter(position > cursor)\
+            .order_by(Message.created_at.asc(), Message.id.asc())
+    else:
+        if cursor:
+            query = query.filter(position < cursor)
+        query = query.order_by(Message.created_at.desc(), Message.id.desc())
 
-    # Process results safely
-    return jsonify([{
-        'sender_id': message.sender_id,
-        'sender_name': user_name,
-        'content': message.content,
-        'timestamp': message.created_at.isoformat()
-    } for message, user_name in messages])
+    messages = query.limit(limit + 1).all()
+    if not after:
+        messages.reverse()
+    # Months compacted by archive_old_messages live in per-room files now
+    if after:
+        archived = read_archived_messages(room_id, cursor, limit, after=True)
+        messages = (archived + messages)[:limit + 1]
+    elif len(messages) <= limit:
+        edge = (messages[0][0].created_at, messages[0][0].id) if messages else cursor
+        archived = read_archived_messages(room_id, edge, limit - len(messages))
+        messages = archived + messages
+    has_more = len(messages) > limit
+    messages = messages[:limit] if after else messages[-limit:]
+
+    next_cursor = None
+    if has_more:
+        edge = messages[-1][0] if after else messages[0][0]
+        next_cursor = encode_cursor(edge.created_at, edge.id)
+    latest_cursor = None
+    if messages:
+        newest = messages[-1][0]
+        latest_cursor = encode_cursor(newest.created_at, newest.id)
+
+    page = {
+        'next_cursor': next_cursor,
+        'latest_cursor': latest_cursor,
+        'has_more': has_more
+    }
+    if layout == 'columnar':
+        page['messages'] = columnar_messages(messages)
+    else:
+        page['messages'] = [_serialize_message(message, user_name) for message, user_name in messages]
+    return payload_response(page)
+
+MAX_SYNC_ROOMS = 100
+
+@chat_bp.route('/sync', methods=['POST'])
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'Fetch new messages for many rooms in one round-trip',
+    'description': 'Only covers messages still in the live table; page older history, '
+                   'including archived months, with /chat/get-messages. Messages from the last '
+                   f'{MESSAGE_CHANGES_SAFETY_WINDOW:g} seconds are held back until they can no '
+                   'longer be overtaken by a slower commit; realtime events cover them meanwhile.',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'user_id': {'type': 'string', 'example': 'userA'},
+                    'rooms': {
+                        'type': 'object',
+                        'description': 'Map of room_id to the last message id the client has seen (0 for none)',
+                        'additionalProperties': {'type': 'integer'},
+                        'example': {'dm-userA-userB': 42, 'open-web-development': 0}
+                    },
+                    'limit': {
+                        'type': 'integer',
+                        'description': f'Max messages per room (default {DEFAULT_PAGE_SIZE}, max {MAX_PAGE_SIZE})'
+                    }
+                },
+                'required': ['user_id', 'rooms']
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'New messages per room in chronological order. When has_more is set, '
+                           'sync again with last_id to continue.',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'rooms': {
+                        'type': 'object',
+                        'additionalProperties': {
+                            'type': 'object',
+                            'properties': {
+                                'messages': {'type': 'array', 'items': {'type': 'object'}},
+                                'last_id': {'type': 'integer'},
+                                'has_more': {'type': 'boolean'}
+                            }
+                        }
+                    },
+                    'forbidden': {'type': 'array', 'items': {'type': 'string'}}
+                }
+            }
+        },
+        400: {'description': 'Invalid request'}
+    }
+})
+def sync_messages():
+    data = request.json or {}
+    user_id = data.get('user_id')
+    rooms = data.get('rooms')
+
+    if not user_id or not isinstance(rooms, dict):
+        return jsonify({"error": "user_id and rooms are required"}), 400
+    if len(rooms) > MAX_SYNC_ROOMS:
+        return jsonify({"error": f"At most {MAX_SYNC_ROOMS} rooms per sync"}), 400
+    try:
+        high_water = {room_id: int(last_id or 0) for room_id, last_id in rooms.items()}
+        limit = parse_limit(int(data['limit']) if data.get('limit') is not None else None)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Message ids and limit must be integers"}), 400
+
+    # Authorize every requested room in a single query
+    allowed = {room_id for room_id, in db.session.query(Chat.room_id)
+               .join(ChatParticipant, ChatParticipant.chat_id == Chat.id)
+               .filter(Chat.room_id.in_(list(high_water)), ChatParticipant.clerk_id == user_id)}
+    forbidden = sorted(set(high_water) - allowed)
+
+    result = {
+        room_id: {'messages': [], 'last_id': high_water[room_id], 'has_more': False}
+        for room_id in allowed
+    }
+    if allowed:
+        # Ids are taken before commit, so a message can become visible behind one the client
+        # already synced past; like /chat/message-changes, the newest messages wait out the
+        # safety window (stamped by the app clock, so compared against it)
+        settled = datetime.now() + IST_OFFSET - timedelta(seconds=MESSAGE_CHANGES_SAFETY_WINDOW)
+        requested = values(column('room_id', String), column('last_id', Integer), name='requested')\
+            .data([(room_id, high_water[room_id]) for room_id in allowed])
+        # Each room reads its own range of the (room_id, id) index and stops at limit + 1
+        page = select(Message, User.name.label('sender_name'))\
+            .join(User, Message.sender_id == User.clerkId)\
+            .where(
+                Message.room_id == requested.c.room_id,
+                Message.id > requested.c.last_id,
+                Message.deleted_at.is_(None),
+                Message.created_at < settled
+            )\
+            .order_by(Message.id)\
+            .limit(limit + 1)\
+            .lateral('page')
+        page_message = aliased(Message, page)
+        rows = db.session.query(page_message, page.c.sender_name)\
+            .select_from(requested)\
+            .join(page, true())\
+            .order_by(page_message.room_id, page_message.id)\
+            .all()
+
+        for message, user_name in rows:
+            room = result[message.room_id]
+            if len(room['messages']) == limit:
+                room['has_more'] = True
+                continue
+            room['messages'].append(_serialize_message(message, user_name))
+            room['last_id'] = message.id
+
+    return jsonify({'rooms': result, 'forbidden': forbidden}), 200
 
 @swag_from({
     'tags': ['Chat'],
@@ -147,9 +413,15 @@ def get_messages(room_id):
                 'properties': {
                     'room_id': {'type': 'string', 'example': 'dm-userA-userB'},
                     'sender_id': {'type': 'string', 'example': 'userA'},
-                    'content': {'type': 'string', 'example': 'Hello, want to team up?'}
+                    'content': {'type': 'string', 'example': 'Hello, want to team up?',
+                                'description': f'At most {MAX_MESSAGE_LENGTH} characters'},
+                    'attachment_ids': {
+                        'type': 'array',
+                        'items': {'type': 'integer'},
+                        'description': 'Ids from /chat/attachments uploaded by the sender to this room'
+                    }
                 },
-                'required': ['room_id', 'sender_id', 'content']
+                'required': ['room_id', 'sender_id']
             }
         }
     ],
@@ -163,6 +435,8 @@ def get_messages(room_id):
                 }
             }
         },
+        400: {'description': 'No content or attachments, or an unknown attachment id'},
+        413: {'description': 'Content longer than MAX_MESSAGE_LENGTH'},
         403: {
             'description': 'Unauthorized access',
             'schema': {
@@ -188,37 +462,58 @@ def send_message():
     data = request.json
     room_id = data['room_id']
     sender_id = data['sender_id']
+    content = data.get('content') or ''
+    if not isinstance(content, str):
+        return jsonify({"error": "content must be a string"}), 400
+    
+    if len(content) > MAX_MESSAGE_LENGTH:
+        return jsonify({"error": f"Message is longer than {MAX_MESSAGE_LENGTH} characters; "
+                                 "send large text as an attachment"}), 413
     
     # Verify sender has access to room
-    chat = Chat.query.filter_by(room_id=room_id).first()
-    if not chat:
+    membership = Chat.membership(room_id, sender_id)
+    if not membership:
         return jsonify({"error": "Room not found"}), 404
-    if sender_id not in chat.participants:
+    if not membership[1]:
         return jsonify({"error": "Unauthorized"}), 403
     
-    # Save to DB
+    attachments, error = _message_attachments(room_id, sender_id, data.get('attachment_ids'))
+    if error:
+        return jsonify({"error": error}), 400
+    if not content and not attachments:
+        return jsonify({"error": "Message needs content or attachments"}), 400
+    
+    # Save to DB together with its realtime event (transactional outbox)
     new_message = Message(
         room_id=room_id,
         sender_id=sender_id,
-        content=data['content']
+        content=content,
+        attachments=attachments
     )
     db.session.add(new_message)
-    db.session.commit()
-    
-    # Trigger Pusher event
-    pusher_client.trigger(room_id, 'new_message', {
+    db.session.flush()
+    outbox.enqueue(room_id, 'new_message', {
+        'id': new_message.id,
         'sender': sender_id,
-        'content': data['content'],
+        'content': content,
+        'attachments': attachments or [],
         'timestamp': (datetime.utcnow() + IST_OFFSET).isoformat()
     })
+    db.session.commit()
+    
+    # Realtime delivery happens on the dispatcher thread
+    outbox_dispatcher.notify()
     
     return jsonify({"status": "sent"}), 200
 
-# Join Open Group (Modified)
+MAX_BATCH_MESSAGES = 500
 
+@chat_bp.route('/send-batch', methods=['POST'])
 @swag_from({
     'tags': ['Chat'],
-    'summary': 'Join an open group',
+    'summary': 'Send many messages in one request',
+    'description': 'Messages carrying a client_msg_id are stored at most once per sender, so a failed '
+                   'batch can be retried as-is. Results come back in request order.',
     'parameters': [
         {
             'name': 'body',
@@ -227,134 +522,691 @@ def send_message():
             'schema': {
                 'type': 'object',
                 'properties': {
-                    'user_id': {
-                        'type': 'string',
-                        'example': 'user_123'
-                    },
-                    'topic_slug': {
-                        'type': 'string',
-                        'example': 'web-development'
+                    'messages': {
+                        'type': 'array',
+                        'description': f'Up to {MAX_BATCH_MESSAGES} messages',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'room_id': {'type': 'string', 'example': 'dm-userA-userB'},
+                                'sender_id': {'type': 'string', 'example': 'userA'},
+                                'content': {'type': 'string', 'example': 'Hello'},
+                                'client_msg_id': {'type': 'string', 'example': 'import-0001'}
+                            },
+                            'required': ['room_id', 'sender_id', 'content']
+                        }
                     }
                 },
-                'required': ['user_id', 'topic_slug']
+                'required': ['messages']
             }
         }
     ],
     'responses': {
         200: {
-            'description': 'Successfully joined group',
+            'description': "Per-message results; status is 'sent', 'duplicate' (id of the earlier "
+                           "message), 'not_found' or 'unauthorized'",
             'schema': {
                 'type': 'object',
                 'properties': {
-                    'room_id': {'type': 'string'},
-                    'topic': {'type': 'string'},
-                    'participant_count': {'type': 'integer'},
-                    'participants': {'type': 'array', 'items': {'type': 'string'}}
+                    'results': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'status': {'type': 'string'},
+                                'id': {'type': 'integer'},
+                                'client_msg_id': {'type': 'string'}
+                            }
+                        }
+                    }
                 }
             }
         },
-        400: {
-            'description': 'Invalid request',
-            'schema': {
-                'type': 'object',
-                'properties': {
-                    'error': {'type': 'string'}
-                }
-            }
+        400: {'description': 'Invalid request'}
+    }
+})
+def send_message_batch():
+    data = request.get_json(silent=True) or {}
+    items = data.get('messages')
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "messages must be a non-empty list"}), 400
+    if len(items) > MAX_BATCH_MESSAGES:
+        return jsonify({"error": f"At most {MAX_BATCH_MESSAGES} messages per batch"}), 400
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not all(
+                isinstance(item.get(field), str) and item.get(field) for field in ('room_id', 'sender_id', 'content')):
+            return jsonify({"error": f"messages[{index}] needs room_id, sender_id and content"}), 400
+        if item.get('client_msg_id') is not None and not isinstance(item['client_msg_id'], str):
+            return jsonify({"error": f"messages[{index}].client_msg_id must be a string"}), 400
+        if len(item['content']) > MAX_MESSAGE_LENGTH:
+            return jsonify({"error": f"messages[{index}] is longer than {MAX_MESSAGE_LENGTH} characters"}), 413
+
+    rooms = Chat.members_of_many(item['room_id'] for item in items)
+    results = [None] * len(items)
+    accepted = []
+    seen = {}
+    for index, item in enumerate(items):
+        room = rooms.get(item['room_id'])
+        if room is None:
+            results[index] = {'status': 'not_found'}
+        elif item['sender_id'] not in room[1]:
+            results[index] = {'status': 'unauthorized'}
+        elif item.get('client_msg_id') and (item['sender_id'], item['client_msg_id']) in seen:
+            # Repeated within this batch; resolved to the first copy's id below
+            results[index] = {'status': 'duplicate'}
+        else:
+            if item.get('client_msg_id'):
+                seen[(item['sender_id'], item['client_msg_id'])] = index
+            accepted.append(index)
+
+    if accepted:
+        # Reserve ids up front so idempotency keys can be claimed before the messages exist
+        ids = db.session.execute(
+            select(func.nextval(func.pg_get_serial_sequence('message', 'id')))
+            .select_from(func.generate_series(1, len(accepted)))
+        ).scalars().all()
+        message_ids = dict(zip(accepted, ids))
+
+        keyed = [index for index in accepted if items[index].get('client_msg_id')]
+        claimed = set()
+        if keyed:
+            claimed = set(db.session.execute(
+                pg_insert(MessageIdempotencyKey.__table__)
+                .values([{
+                    'sender_id': items[index]['sender_id'],
+                    'client_msg_id': items[index]['client_msg_id'],
+                    'message_id': message_ids[index]
+                } for index in keyed])
+                .on_conflict_do_nothing(index_elements=['sender_id', 'client_msg_id'])
+                .returning(MessageIdempotencyKey.sender_id, MessageIdempotencyKey.client_msg_id)
+            ).all())
+        duplicates = [index for index in keyed
+                      if (items[index]['sender_id'], items[index]['client_msg_id']) not in claimed]
+        if duplicates:
+            existing = dict(
+                ((sender_id, client_msg_id), message_id) for sender_id, client_msg_id, message_id in
+                db.session.query(MessageIdempotencyKey.sender_id, MessageIdempotencyKey.client_msg_id,
+                                 MessageIdempotencyKey.message_id)
+                .filter(tuple_(MessageIdempotencyKey.sender_id, MessageIdempotencyKey.client_msg_id).in_(
+                    [(items[index]['sender_id'], items[index]['client_msg_id']) for index in duplicates]))
+            )
+            for index in duplicates:
+                key = (items[index]['sender_id'], items[index]['client_msg_id'])
+                results[index] = {'status': 'duplicate', 'id': existing.get(key)}
+
+        created_at = datetime.now() + IST_OFFSET
+        new = [index for index in accepted if results[index] is None]
+        if new:
+            db.session.execute(db.insert(Message.__table__), [{
+                'id': message_ids[index],
+                'room_id': items[index]['room_id'],
+                'sender_id': items[index]['sender_id'],
+                'content': items[index]['content'],
+                'client_msg_id': items[index].get('client_msg_id'),
+                'created_at': created_at
+            } for index in new])
+            outbox.enqueue_many([(items[index]['room_id'], 'new_message', {
+                'id': message_ids[index],
+                'sender': items[index]['sender_id'],
+                'content': items[index]['content'],
+                'client_msg_id': items[index].get('client_msg_id'),
+                'timestamp': created_at.isoformat()
+            }) for index in new])
+            for index in new:
+                results[index] = {'status': 'sent', 'id': message_ids[index]}
+        db.session.commit()
+        if new:
+            outbox_dispatcher.notify()
+
+    for index, item in enumerate(items):
+        if results[index]['status'] == 'duplicate' and 'id' not in results[index]:
+            results[index]['id'] = results[seen[(item['sender_id'], item['client_msg_id'])]]['id']
+        results[index]['client_msg_id'] = item.get('client_msg_id')
+
+    return jsonify({'results': results}), 200
+
+def _database_now(clock=func.statement_timestamp):
+    """The database's clock in the app's IST convention, so every host stamps alike."""
+    return func.timezone('UTC', clock()) + IST_OFFSET
+
+
+def _change_own_message(message_id, user_id, values, expected_version=None):
+    """Apply values to user_id's live message in a single UPDATE ... RETURNING.
+
+    Returns (row, None) on success, otherwise (None, error response). The
+    version check makes concurrent edits from two devices fail with a 409
+    instead of silently overwriting each other.
+    """
+    conditions = [Message.id == message_id, Message.sender_id == user_id, Message.deleted_at.is_(None)]
+    if expected_version is not None:
+        conditions.append(Message.version == expected_version)
+    row = db.session.execute(
+        db.update(Message.__table__)
+        .where(*conditions)
+        .values(version=Message.version + 1, **values)
+        .returning(Message.room_id, Message.content, Message.version, Message.edited_at,
+                   Message.deleted_at, Message.updated_at)
+    ).first()
+    if row is not None:
+        membership = Chat.membership(row.room_id, user_id)
+        if not membership or not membership[1]:
+            db.session.rollback()
+            return None, (jsonify({"error": "Unauthorized"}), 403)
+        return row, None
+
+    # Nothing matched; one lookup tells the caller why
+    current = db.session.query(Message.sender_id, Message.version, Message.deleted_at)\
+        .filter(Message.id == message_id).first()
+    if not current:
+        return None, (jsonify({"error": "Message not found"}), 404)
+    if current.sender_id != user_id:
+        return None, (jsonify({"error": "Unauthorized"}), 403)
+    if current.deleted_at is not None:
+        return None, (jsonify({"error": "Message was deleted"}), 410)
+    return None, (jsonify({"error": "Message was changed by another request",
+                           "version": current.version}), 409)
+
+
+def _message_change(message_id, row):
+    return {
+        'id': message_id,
+        'content': row.content,
+        'version': row.version,
+        'edited_at': row.edited_at.isoformat() if row.edited_at else None,
+        'deleted': row.deleted_at is not None
+    }
+
+
+@chat_bp.route('/messages/<int:message_id>', methods=['PATCH'])
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'Edit one of your messages',
+    'parameters': [
+        {
+            'name': 'message_id',
+            'in': 'path',
+            'type': 'integer',
+            'required': True
         },
-        404: {
-            'description': 'Group not found',
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
             'schema': {
                 'type': 'object',
                 'properties': {
-                    'error': {'type': 'string'}
-                }
+                    'user_id': {'type': 'string'},
+                    'content': {'type': 'string'},
+                    'version': {
+                        'type': 'integer',
+                        'description': 'Version the edit is based on; rejected with 409 if the '
+                                       'message changed since'
+                    }
+                },
+                'required': ['user_id', 'content']
             }
-        },
-        500: {
-            'description': 'Internal server error',
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Edited; a message_updated event is published to the room',
             'schema': {
                 'type': 'object',
                 'properties': {
-                    'error': {'type': 'string'}
+                    'id': {'type': 'integer'},
+                    'content': {'type': 'string'},
+                    'version': {'type': 'integer'},
+                    'edited_at': {'type': 'string'},
+                    'deleted': {'type': 'boolean'}
                 }
             }
-        }
+        },
+        400: {'description': 'Missing or non-string content, or a non-integer version'},
+        403: {'description': 'Not your message or no longer in the room'},
+        404: {'description': 'Message not found (archived messages can no longer be changed)'},
+        409: {'description': 'Version mismatch; body carries the current version'},
+        410: {'description': 'Message was deleted'},
+        413: {'description': 'Content longer than the message length limit'}
     }
 })
-@chat_bp.route('/join-open-group', methods=['POST'])
-def join_open_group():
+def edit_message(message_id):
     data = request.json
     user_id = data.get('user_id')
-    topic_slug = data.get('topic_slug')
-    
-    if not user_id or not topic_slug:
-        return jsonify({"error": "Missing required fields"}), 400
-    
-    try:
-        # Use explicit locking to prevent race conditions
-        group = Chat.query.filter_by(room_id=f"open-{topic_slug}").with_for_update().first()
-        if not group:
-            return jsonify({"error": "Group not found"}), 404
-        
-        # Initialize if null
-        if group.participants is None:
-            group.participants = []
-        
-        # Check if user already in group
-        if user_id not in group.participants:
-            group.add_participant(user_id)
-            db.session.commit()
-        
-        # Refresh the object to get current state
-        db.session.refresh(group)
-        
-        return jsonify({
-            'room_id': group.room_id,
-            'topic': group.topic,
-            'participant_count': len(group.participants),
-            'participants': group.participants
-        }), 200
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({"error": str(e)}), 500
+    content = data.get('content') or ''
+    version = data.get('version')
+    if not user_id or not content:
+        return jsonify({"error": "user_id and content are required"}), 400
+    if not isinstance(content, str):
+        return jsonify({"error": "content must be a string"}), 400
+    if version is not None and (not isinstance(version, int) or isinstance(version, bool)):
+        return jsonify({"error": "version must be an integer"}), 400
+    if len(content) > MAX_MESSAGE_LENGTH:
+        return jsonify({"error": f"Message is longer than {MAX_MESSAGE_LENGTH} characters; "
+                                 "send large text as an attachment"}), 413
 
-# Leave Open Group
-@chat_bp.route('/leave-open-group', methods=['POST'])
+    # Stamped by the database as the UPDATE runs; see MESSAGE_CHANGES_SAFETY_WINDOW
+    now = _database_now()
+    row, error = _change_own_message(message_id, user_id, {
+        'content': content,
+        'edited_at': now,
+        'updated_at': now
+    }, version)
+    if error:
+        return error
+    change = _message_change(message_id, row)
+    outbox.enqueue(row.room_id, 'message_updated', change)
+    db.session.commit()
+    outbox_dispatcher.notify()
+    return jsonify(change), 200
+
+@chat_bp.route('/messages/<int:message_id>', methods=['DELETE'])
 @swag_from({
     'tags': ['Chat'],
-    'summary': 'Leave an open group',
-    'parameters': [{
-        'name': 'body',
-        'in': 'body',
-        'required': True,
-        'schema': {
-            'type': 'object',
-            'properties': {
-                'user_id': {
-                    'type': 'string',
-                    'example': 'user_123'
-                },
-                'topic_slug': {
-                    'type': 'string',
-                    'example': 'web-development'
-                }
-            },
-            'required': ['user_id', 'topic_slug']
+    'summary': 'Delete one of your messages',
+    'description': 'Leaves a tombstone: content and attachments are cleared and the message '
+                   'drops out of history, search and unread counts, while its id and position '
+                   'stay so existing cursors remain valid.',
+    'parameters': [
+        {
+            'name': 'message_id',
+            'in': 'path',
+            'type': 'integer',
+            'required': True
+        },
+        {
+            'name': 'user_id',
+            'in': 'query',
+            'type': 'string',
+            'required': True
+        },
+        {
+            'name': 'version',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': 'Only delete if the message is still at this version'
         }
-    }],
+    ],
+    'responses': {
+        200: {'description': 'Deleted; a message_updated event with deleted=true is published'},
+        400: {'description': 'Missing user_id or invalid version'},
+        403: {'description': 'Not your message or no longer in the room'},
+        404: {'description': 'Message not found (archived messages can no longer be changed)'},
+        409: {'description': 'Version mismatch'},
+        410: {'description': 'Message was already deleted'}
+    }
+})
+def delete_message(message_id):
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({"error": "user_id is required"}), 400
+    version = request.args.get('version')
+    if version is not None:
+        try:
+            version = int(version)
+        except ValueError:
+            return jsonify({"error": "version must be an integer"}), 400
+
+    now = _database_now()
+    row, error = _change_own_message(message_id, user_id, {
+        'content': None,
+        'attachments': None,
+        'deleted_at': now,
+        'updated_at': now
+    }, version)
+    if error:
+        return error
+    change = _message_change(message_id, row)
+    outbox.enqueue(row.room_id, 'message_updated', change)
+    db.session.commit()
+    outbox_dispatcher.notify()
+    return jsonify(change), 200
+
+@chat_bp.route('/message-changes/<room_id>', methods=['GET'])
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'Edits and deletions in a room since a cursor',
+    'description': 'Lets clients that were offline patch their cached history instead of '
+                   'refetching it. Start without a cursor (or with the latest_cursor you stored) '
+                   'and keep following next_cursor while has_more is true. Changes from the last '
+                   f'{MESSAGE_CHANGES_SAFETY_WINDOW:g} seconds are held back until they can no '
+                   'longer be overtaken by a slower commit; realtime events cover them meanwhile. '
+                   'Messages in archived months are not included.',
+    'parameters': [
+        {
+            'name': 'room_id',
+            'in': 'path',
+            'type': 'string',
+            'required': True
+        },
+        {
+            'name': 'user_id',
+            'in': 'query',
+            'type': 'string',
+            'required': True
+        },
+        {
+            'name': 'since',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'next_cursor from a previous call'
+        },
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': f'Page size (default {DEFAULT_PAGE_SIZE}, max {MAX_PAGE_SIZE})'
+        }
+    ],
     'responses': {
         200: {
-            'description': 'Successfully left group',
+            'description': 'Changed messages in the order they changed',
             'schema': {
                 'type': 'object',
                 'properties': {
-                    'status': {'type': 'string'}
+                    'changes': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'id': {'type': 'integer'},
+                                'content': {'type': 'string'},
+                                'version': {'type': 'integer'},
+                                'edited_at': {'type': 'string'},
+                                'deleted': {'type': 'boolean'}
+                            }
+                        }
+                    },
+                    'next_cursor': {'type': 'string'},
+                    'has_more': {'type': 'boolean'}
                 }
             }
         },
-        400: {
+        400: {'description': 'Invalid cursor'},
+        403: {'description': 'Unauthorized'},
+        404: {'description': 'Room not found'}
+    }
+})
+def get_message_changes(room_id):
+    user_id = request.args.get('user_id')
+    since = request.args.get('since')
+    limit = parse_limit(request.args.get('limit', type=int))
+    try:
+        cursor = decode_cursor(since) if since else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    membership = Chat.membership(room_id, user_id)
+    if not membership:
+        return jsonify({"error": "Room not found"}), 404
+    if not membership[1]:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    # Keyset scan of the partial (room_id, updated_at, id) index. A change stamped just now may
+    # commit after a later-stamped one, so the newest changes wait out the safety window
+    settled = _database_now(func.now) - timedelta(seconds=MESSAGE_CHANGES_SAFETY_WINDOW)
+    query = db.session.query(Message.id, Message.content, Message.version, Message.edited_at,
+                             Message.deleted_at, Message.updated_at)\
+        .filter(Message.room_id == room_id, Message.updated_at.isnot(None), Message.updated_at < settled)
+    if cursor:
+        query = query.filter(tuple_(Message.updated_at, Message.id) > cursor)
+    rows = query.order_by(Message.updated_at.asc(), Message.id.asc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = since
+    if rows:
+        next_cursor = encode_cursor(rows[-1].updated_at, rows[-1].id)
+    return jsonify({
+        'changes': [_message_change(row.id, row) for row in rows],
+        'next_cursor': next_cursor,
+        'has_more': has_more
+    }), 200
+
+# Browsers render these inline; anything else is forced to download
+INLINE_ATTACHMENT_TYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'application/pdf'}
+
+@chat_bp.route('/attachments', methods=['POST'])
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'Upload a file to attach to a message',
+    'consumes': ['multipart/form-data'],
+    'parameters': [
+        {'name': 'room_id', 'in': 'formData', 'type': 'string', 'required': True},
+        {'name': 'user_id', 'in': 'formData', 'type': 'string', 'required': True},
+        {'name': 'file', 'in': 'formData', 'type': 'file', 'required': True}
+    ],
+    'responses': {
+        201: {
+            'description': f'Stored; pass the id in attachment_ids when sending the message. '
+                           f'Uploads not attached within {ATTACHMENT_GC_GRACE_HOURS:g} hours are deleted',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'id': {'type': 'integer'},
+                    'name': {'type': 'string'},
+                    'size': {'type': 'integer'},
+                    'content_type': {'type': 'string'},
+                    'sha256': {'type': 'string'}
+                }
+            }
+        },
+        400: {'description': 'Missing room_id, user_id or file'},
+        403: {'description': 'User is not a participant'},
+        404: {'description': 'Room not found'},
+        413: {'description': f'File larger than {ATTACHMENT_MAX_SIZE} bytes'},
+        503: {'description': 'Attachment storage (ATTACHMENT_DIR) is not configured'}
+    }
+})
+def upload_attachment():
+    if not blob_store.configured:
+        return jsonify({"error": "Attachments are not enabled"}), 503
+    if request.content_length and request.content_length > ATTACHMENT_MAX_SIZE + 64 * 1024:
+        return jsonify({"error": f"Attachment exceeds {ATTACHMENT_MAX_SIZE} bytes"}), 413
+    room_id = request.form.get('room_id')
+    user_id = request.form.get('user_id')
+    upload = request.files.get('file')
+    if not room_id or not user_id or not upload:
+        return jsonify({"error": "room_id, user_id and file are required"}), 400
+
+    membership = Chat.membership(room_id, user_id)
+    if not membership:
+        return jsonify({"error": "Room not found"}), 404
+    if not membership[1]:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    try:
+        digest, size = blob_store.put_stream(upload.stream, ATTACHMENT_MAX_SIZE)
+    except BlobTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+
+    attachment = ChatAttachment(
+        room_id=room_id,
+        uploader_id=user_id,
+        sha256=digest,
+        name=os.path.basename(upload.filename or 'attachment')[:255] or 'attachment',
+        size=size,
+        content_type=(upload.mimetype or 'application/octet-stream')[:255]
+    )
+    db.session.add(attachment)
+    db.session.commit()
+    return jsonify({**attachment.to_ref(), 'sha256': digest}), 201
+
+@chat_bp.route('/attachments/<int:attachment_id>', methods=['GET'])
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'Download an attachment',
+    'description': 'Supports Range requests and conditional GET (ETag is the SHA-256 of the file).',
+    'parameters': [
+        {'name': 'attachment_id', 'in': 'path', 'type': 'integer', 'required': True},
+        {'name': 'user_id', 'in': 'query', 'type': 'string', 'required': True,
+         'description': 'Requesting user; must be a participant of the room'}
+    ],
+    'responses': {
+        200: {'description': 'File contents'},
+        206: {'description': 'Requested byte range'},
+        304: {'description': 'Not modified'},
+        403: {'description': 'User is not a participant'},
+        404: {'description': 'Attachment not found'}
+    }
+})
+def download_attachment(attachment_id):
+    attachment = db.session.get(ChatAttachment, attachment_id)
+    if not attachment or not blob_store.exists(attachment.sha256):
+        return jsonify({"error": "Attachment not found"}), 404
+    membership = Chat.membership(attachment.room_id, request.args.get('user_id'))
+    if not membership or not membership[1]:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    inline = attachment.content_type in INLINE_ATTACHMENT_TYPES
+    response = send_file(
+        blob_store.path(attachment.sha256),
+        mimetype=attachment.content_type if inline else 'application/octet-stream',
+        as_attachment=not inline,
+        download_name=attachment.name,
+        conditional=True,
+        etag=attachment.sha256,
+        max_age=86400
+    )
+    # Content never changes for a given id, but access depends on the requesting user
+    response.headers['Cache-Control'] = 'private, max-age=86400, immutable'
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+# Join Open Group (Modified)
+
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'Join an open group',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'user_id': {
+                        'type': 'string',
+                        'example': 'user_123'
+                    },
+                    'topic_slug': {
+                        'type': 'string',
+                        'example': 'web-development'
+                    }
+                },
+                'required': ['user_id', 'topic_slug']
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Successfully joined group',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'room_id': {'type': 'string'},
+                    'topic': {'type': 'string'},
+                    'participant_count': {'type': 'integer'},
+                    'participants': {'type': 'array', 'items': {'type': 'string'}}
+                }
+            }
+        },
+        400: {
+            'description': 'Invalid request',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        },
+        404: {
+            'description': 'Group not found',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        },
+        500: {
+            'description': 'Internal server error',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    }
+})
+@chat_bp.route('/join-open-group', methods=['POST'])
+def join_open_group():
+    data = request.json
+    user_id = data.get('user_id')
+    topic_slug = data.get('topic_slug')
+    
+    if not user_id or not topic_slug:
+        return jsonify({"error": "Missing required fields"}), 400
+    
+    try:
+        # One statement: idempotent insert, counter bump and the updated member list
+        joined = Chat.join(f"open-{topic_slug}", user_id)
+        if not joined:
+            return jsonify({"error": "Group not found"}), 404
+        room_id, topic, participant_count, participants, added = joined
+        if added:
+            db.session.commit()
+        
+        return jsonify({
+            'room_id': room_id,
+            'topic': topic,
+            'participant_count': participant_count,
+            'participants': participants
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+# Leave Open Group
+@chat_bp.route('/leave-open-group', methods=['POST'])
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'Leave an open group',
+    'parameters': [{
+        'name': 'body',
+        'in': 'body',
+        'required': True,
+        'schema': {
+            'type': 'object',
+            'properties': {
+                'user_id': {
+                    'type': 'string',
+                    'example': 'user_123'
+                },
+                'topic_slug': {
+                    'type': 'string',
+                    'example': 'web-development'
+                }
+            },
+            'required': ['user_id', 'topic_slug']
+        }
+    }],
+    'responses': {
+        200: {
+            'description': 'Successfully left group',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'status': {'type': 'string'}
+                }
+            }
+        },
+        400: {
             'description': 'Missing required fields',
             'schema': {
                 'type': 'object',
@@ -382,12 +1234,12 @@ def leave_open_group():
     if not user_id or not topic_slug:
         return jsonify({"error": "Missing required fields"}), 400
     
-    group = Chat.query.filter_by(room_id=f"open-{topic_slug}").first()
+    room_id = f"open-{topic_slug}"
+    group = Chat.members_of(room_id)
     if not group:
         return jsonify({"error": "Group not found"}), 404
     
-    if user_id in group.participants:
-        group.participants.remove(user_id)
+    if Chat.remove_member(group[0], room_id, user_id):
         db.session.commit()
     
     return jsonify({"status": "left"}), 200
@@ -405,10 +1257,9 @@ def create_project_chat(project_id):
     
     new_chat = Chat(
         room_id=project.chat_room_id,
-        is_group=True,
-        participants=[project.clerkId]
+        is_group=True
     )
-    db.session.add(new_chat)
+    new_chat.add_participant(project.clerkId, role='owner')
     db.session.commit()
     
     return jsonify({"room_id": new_chat.room_id}), 201
@@ -480,21 +1331,12 @@ def project_chat_invite():
     if not chat:
         return jsonify({"error": "Chat not found"}), 404
     
-    if target_id not in chat.participants:
-        # Create a new list to ensure SQLAlchemy detects the change
-        participants = list(chat.participants)
-        participants.append(target_id)
-        chat.participants = participants
-        
-        # Mark the field as modified
-        from sqlalchemy.orm.attributes import flag_modified
-        flag_modified(chat, 'participants')
-        
+    if chat.add_participant(target_id):
         db.session.commit()
     
     return jsonify({
         "status": "added",
-        "participants": chat.participants  # Return updated list for debugging
+        "participants": chat.participant_ids  # Return updated list for debugging
     }), 200
 
 @chat_bp.route('/project-chat/auto-create/<int:project_id>', methods=['POST'])
@@ -606,21 +1448,12 @@ def project_chat_kick():
     if not chat:
         return jsonify({"error": "Chat not found"}), 404
     
-    if target_id in chat.participants:
-        # Create a new list to ensure SQLAlchemy detects the change
-        participants = list(chat.participants)
-        participants.remove(target_id)
-        chat.participants = participants
-        
-        # Mark the field as modified
-        from sqlalchemy.orm.attributes import flag_modified
-        flag_modified(chat, 'participants')
-        
+    if chat.remove_participant(target_id):
         db.session.commit()
     
     return jsonify({
         "status": "removed",
-        "participants": chat.participants  # Return updated list for debugging
+        "participants": chat.participant_ids  # Return updated list for debugging
     }), 200
 
 @swag_from({
@@ -647,7 +1480,34 @@ def project_chat_kick():
                         'is_group': {'type': 'boolean'},
                         'is_project_chat': {'type': 'boolean'},
                         'participants': {'type': 'array', 'items': {'type': 'string'}},
-                        'created_at': {'type': 'string'}
+                        'created_at': {'type': 'string'},
+                        'message_count': {'type': 'integer'},
+                        'unread_count': {'type': 'integer'},
+                        'last_read_message_id': {'type': 'integer'},
+                        'last_message': {
+                            'type': 'object',
+                            'properties': {
+                                'sender_id': {'type': 'string'},
+                                'content': {'type': 'string', 'description': 'First 200 characters'},
+                                'timestamp': {'type': 'string'}
+                            }
+                        },
+                        'project': {
+                            'type': 'object',
+                            'properties': {
+                                'id': {'type': 'integer'},
+                                'name': {'type': 'string'},
+                                'title': {'type': 'string'}
+                            }
+                        },
+                        'team': {
+                            'type': 'object',
+                            'properties': {
+                                'id': {'type': 'integer'},
+                                'team_name': {'type': 'string'},
+                                'hackathon_id': {'type': 'integer'}
+                            }
+                        }
                     }
                 }
             }
@@ -669,30 +1529,642 @@ def get_user_chats():
     if not clerkId:
         return jsonify({"error": "clerkId is required"}), 400
     
-    # Query all chats where the user is a participant
-    chats = Chat.query.filter(Chat.participants.contains([clerkId])).all()
+    # Everything the chat sidebar needs, in one round-trip
+    participants = select(func.array_agg(aggregate_order_by(ChatParticipant.clerk_id, ChatParticipant.joined_at)))\
+        .where(ChatParticipant.chat_id == Chat.id)\
+        .correlate(Chat)\
+        .scalar_subquery()
+    message_count = select(func.count(Message.id))\
+        .where(Message.room_id == Chat.room_id, Message.deleted_at.is_(None))\
+        .correlate(Chat)\
+        .scalar_subquery()
+    # Counted over the (room_id, id) index from the user's read cursor onwards
+    unread_count = select(func.count(Message.id))\
+        .where(
+            Message.room_id == Chat.room_id,
+            Message.id > func.coalesce(ChatReadCursor.last_read_message_id, 0),
+            Message.sender_id != clerkId,
+            Message.deleted_at.is_(None)
+        )\
+        .correlate(Chat, ChatReadCursor)\
+        .scalar_subquery()
+    last_message = select(
+            Message.sender_id,
+            func.left(Message.content, 200).label('content'),
+            Message.created_at
+        )\
+        .where(Message.room_id == Chat.room_id, Message.deleted_at.is_(None))\
+        .order_by(Message.created_at.desc(), Message.id.desc())\
+        .limit(1)\
+        .lateral('last_message')
+
+    rows = db.session.query(
+            Chat,
+            participants.label('participants'),
+            message_count.label('message_count'),
+            unread_count.label('unread_count'),
+            ChatReadCursor.last_read_message_id,
+            last_message.c.sender_id,
+            last_message.c.content,
+            last_message.c.created_at,
+            Project.id, Project.name, Project.title,
+            Team.id, Team.team_name, Team.hackathon_id
+        )\
+        .join(ChatParticipant, and_(ChatParticipant.chat_id == Chat.id, ChatParticipant.clerk_id == clerkId))\
+        .outerjoin(ChatReadCursor, and_(ChatReadCursor.chat_id == Chat.id, ChatReadCursor.clerk_id == clerkId))\
+        .outerjoin(last_message, true())\
+        .outerjoin(Project, Project.chat_room_id == Chat.room_id)\
+        .outerjoin(Team, Team.id == Chat.team_id)\
+        .order_by(func.coalesce(last_message.c.created_at, Chat.created_at).desc())\
+        .all()
     
     # Format the response
     chat_list = []
-    for chat in chats:
+    for (chat, participant_ids, count, unread, last_read_id, last_sender, last_content, last_at,
+         project_id, project_name, project_title, team_id, team_name, hackathon_id) in rows:
         chat_data = {
             'room_id': chat.room_id,
             'is_group': chat.is_group,
             'is_project_chat': chat.room_id.startswith('project-'),
-            'participants': chat.participants,
-            'created_at': chat.created_at.isoformat()
+            'participants': participant_ids or [],
+            'created_at': chat.created_at.isoformat(),
+            'message_count': count,
+            'unread_count': unread,
+            'last_read_message_id': last_read_id or 0,
+            'last_message': {
+                'sender_id': last_sender,
+                'content': last_content,
+                'timestamp': last_at.isoformat()
+            } if last_at else None
         }
         
         # Add project details for project chats
-        if chat.room_id.startswith('project-'):
-            project = Project.query.filter_by(chat_room_id=chat.room_id).first()
-            if project:
-                chat_data['project'] = {
-                    'id': project.id,
-                    'name': project.name,
-                    'title': project.title
-                }
+        if project_id is not None:
+            chat_data['project'] = {
+                'id': project_id,
+                'name': project_name,
+                'title': project_title
+            }
+        if team_id is not None:
+            chat_data['team'] = {
+                'id': team_id,
+                'team_name': team_name,
+                'hackathon_id': hackathon_id
+            }
         
         chat_list.append(chat_data)
         
-        return jsonify(chat_list), 200
\ No newline at end of file
+    return jsonify(chat_list), 200
+
+@chat_bp.route('/read', methods=['POST'])
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'Mark a chat room as read up to a message',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'room_id': {'type': 'string', 'example': 'dm-userA-userB'},
+                    'user_id': {'type': 'string', 'example': 'userA'},
+                    'message_id': {
+                        'type': 'integer',
+                        'description': 'Last message read; defaults to the newest message in the room'
+                    }
+                },
+                'required': ['room_id', 'user_id']
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Read cursor advanced (it never moves backwards)',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'last_read_message_id': {'type': 'integer'},
+                    'unread_count': {'type': 'integer'}
+                }
+            }
+        },
+        400: {'description': 'Invalid request'},
+        403: {'description': 'Unauthorized'},
+        404: {'description': 'Room not found'}
+    }
+})
+def mark_read():
+    data = request.json or {}
+    room_id = data.get('room_id')
+    user_id = data.get('user_id')
+    message_id = data.get('message_id')
+
+    if not room_id or not user_id:
+        return jsonify({"error": "Missing required fields"}), 400
+    if message_id is not None and (not isinstance(message_id, int) or isinstance(message_id, bool)):
+        return jsonify({"error": "message_id must be an integer"}), 400
+
+    membership = Chat.membership(room_id, user_id)
+    if not membership:
+        return jsonify({"error": "Room not found"}), 404
+    if not membership[1]:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    # Newest live message in this room at or below the requested id, off the partial (room_id, id) index
+    latest = db.session.query(func.max(Message.id))\
+        .filter(Message.room_id == room_id, Message.deleted_at.is_(None))
+    if message_id is not None:
+        latest = latest.filter(Message.id <= message_id)
+    read_up_to = latest.scalar() or 0
+
+    insert_stmt = pg_insert(ChatReadCursor.__table__).values(
+        chat_id=membership[0],
+        clerk_id=user_id,
+        last_read_message_id=read_up_to
+    )
+    last_read_id = db.session.execute(
+        insert_stmt.on_conflict_do_update(
+            index_elements=['chat_id', 'clerk_id'],
+            set_={
+                'last_read_message_id': func.greatest(
+                    ChatReadCursor.__table__.c.last_read_message_id,
+                    insert_stmt.excluded.last_read_message_id
+                ),
+                'updated_at': datetime.utcnow()
+            }
+        ).returning(ChatReadCursor.__table__.c.last_read_message_id)
+    ).scalar_one()
+    unread = db.session.query(func.count(Message.id))\
+        .filter(Message.room_id == room_id, Message.id > last_read_id, Message.sender_id != user_id,
+                Message.deleted_at.is_(None))\
+        .scalar()
+    db.session.commit()
+
+    return jsonify({'last_read_message_id': last_read_id, 'unread_count': unread}), 200
+
+def _escape_html(column):
+    """SQL-side HTML escaping so ts_headline markup is the only markup in a snippet."""
+    return func.replace(func.replace(func.replace(column, '&', '&amp;'), '<', '&lt;'), '>', '&gt;')
+
+@chat_bp.route('/search', methods=['GET'])
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'Full-text search across the chat rooms a user belongs to',
+    'description': 'Messages moved to the cold archive are not searched.',
+    'parameters': [
+        {
+            'name': 'user_id',
+            'in': 'query',
+            'type': 'string',
+            'required': True,
+            'description': 'User ID; only rooms this user participates in are searched'
+        },
+        {
+            'name': 'q',
+            'in': 'query',
+            'type': 'string',
+            'required': True,
+            'description': 'Search text (web search syntax: "quoted phrases", OR, -excluded)'
+        },
+        {
+            'name': 'room_id',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Restrict the search to one room'
+        },
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': f'Page size (default {DEFAULT_PAGE_SIZE}, max {MAX_PAGE_SIZE})'
+        },
+        {
+            'name': 'offset',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': 'Number of ranked results to skip'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Ranked matches with HTML-escaped snippets; matched terms are wrapped in <mark>',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'results': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'id': {'type': 'integer'},
+                                'room_id': {'type': 'string'},
+                                'sender_id': {'type': 'string'},
+                                'sender_name': {'type': 'string'},
+                                'snippet': {'type': 'string'},
+                                'rank': {'type': 'number'},
+                                'timestamp': {'type': 'string'}
+                            }
+                        }
+                    },
+                    'next_offset': {'type': 'integer'}
+                }
+            }
+        },
+        400: {'description': 'Missing user_id or q'}
+    }
+})
+def search_messages():
+    user_id = request.args.get('user_id')
+    text = (request.args.get('q') or '').strip()
+    room_id = request.args.get('room_id')
+    limit = parse_limit(request.args.get('limit', type=int))
+    offset = max(request.args.get('offset', 0, type=int), 0)
+
+    if not user_id or not text:
+        return jsonify({"error": "user_id and q are required"}), 400
+
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, text)
+    rank = func.ts_rank_cd(Message.search_vector, tsquery)
+
+    # Rank and page on the GIN index first; headline only the page that is returned
+    matches = db.session.query(Message.id.label('id'), rank.label('rank'))\
+        .join(Chat, Chat.room_id == Message.room_id)\
+        .join(ChatParticipant, and_(ChatParticipant.chat_id == Chat.id, ChatParticipant.clerk_id == user_id))\
+        .filter(Message.search_vector.op('@@')(tsquery))
+    if room_id:
+        matches = matches.filter(Message.room_id == room_id)
+    matches = matches\
+        .order_by(rank.desc(), Message.id.desc())\
+        .offset(offset)\
+        .limit(limit + 1)\
+        .subquery()
+
+    snippet = func.ts_headline(
+        SEARCH_CONFIG,
+        _escape_html(Message.content),
+        tsquery,
+        'StartSel=<mark>, StopSel=</mark>, MaxWords=30, MinWords=10, MaxFragments=2'
+    )
+    rows = db.session.query(Message, User.name, matches.c.rank, snippet)\
+        .join(matches, matches.c.id == Message.id)\
+        .outerjoin(User, Message.sender_id == User.clerkId)\
+        .order_by(matches.c.rank.desc(), Message.id.desc())\
+        .all()
+
+    has_more = len(rows) > limit
+    return jsonify({
+        'results': [{
+            'id': message.id,
+            'room_id': message.room_id,
+            'sender_id': message.sender_id,
+            'sender_name': user_name,
+            'snippet': headline,
+            'rank': round(score, 6),
+            'timestamp': message.created_at.isoformat()
+        } for message, user_name, score, headline in rows[:limit]],
+        'next_offset': offset + limit if has_more else None
+    }), 200
+
+@chat_bp.route('/outbox/metrics', methods=['GET'])
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'Realtime outbox dispatcher metrics',
+    'responses': {
+        200: {
+            'description': 'Dispatcher counters and backlog lag',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'pending': {'type': 'integer'},
+                    'oldest_pending_age_seconds': {'type': 'number'},
+                    'dispatched': {'type': 'integer'},
+                    'batches': {'type': 'integer'},
+                    'failed_batches': {'type': 'integer'},
+                    'dropped': {'type': 'integer'},
+                    'last_batch_ms': {'type': 'number'},
+                    'last_lag_seconds': {'type': 'number'},
+                    'last_error': {'type': 'string'},
+                    'last_dispatch_at': {'type': 'string'},
+                    'running': {'type': 'boolean'},
+                    'backend': {'type': 'object'}
+                }
+            }
+        }
+    }
+})
+def get_outbox_metrics():
+    return jsonify(outbox_dispatcher.metrics()), 200
+
+@chat_bp.route('/retention/<room_id>', methods=['PUT'])
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'Set a room\'s message retention policy (room owner or admin)',
+    'description': 'Messages older than max_age_days, or beyond the newest max_messages, are '
+                   'deleted by the background retention purge. null removes a limit.',
+    'parameters': [
+        {
+            'name': 'room_id',
+            'in': 'path',
+            'type': 'string',
+            'required': True
+        },
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'user_id': {'type': 'string'},
+                    'max_age_days': {'type': 'integer', 'minimum': 1},
+                    'max_messages': {'type': 'integer', 'minimum': 1}
+                },
+                'required': ['user_id']
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Policy saved',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'room_id': {'type': 'string'},
+                    'max_age_days': {'type': 'integer'},
+                    'max_messages': {'type': 'integer'}
+                }
+            }
+        },
+        400: {'description': 'Limits must be positive integers'},
+        403: {'description': 'Only room owners and admins can change retention'},
+        404: {'description': 'Room not found'}
+    }
+})
+def set_room_retention(room_id):
+    data = request.json
+    user_id = data.get('user_id')
+    limits = {}
+    for field, column in (('max_age_days', 'retention_days'), ('max_messages', 'retention_max_messages')):
+        if field not in data:
+            continue
+        value = data[field]
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+            return jsonify({"error": f"{field} must be a positive integer or null"}), 400
+        limits[column] = value
+
+    chat = Chat.query.filter_by(room_id=room_id).first()
+    if not chat:
+        return jsonify({"error": "Room not found"}), 404
+    is_owner = ChatParticipant.query.filter_by(chat_id=chat.id, clerk_id=user_id, role='owner').first()
+    if not is_owner and not User.query.filter_by(clerkId=user_id, role='admin').first():
+        return jsonify({"error": "Only room owners and admins can change retention"}), 403
+
+    for column, value in limits.items():
+        setattr(chat, column, value)
+    db.session.commit()
+    return jsonify({
+        'room_id': room_id,
+        'max_age_days': chat.retention_days,
+        'max_messages': chat.retention_max_messages
+    }), 200
+
+@chat_bp.route('/retention/metrics', methods=['GET'])
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'Message retention purge metrics for this worker',
+    'responses': {
+        200: {
+            'description': 'Totals and the most recent purge runs',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'runs': {'type': 'integer'},
+                    'skipped_runs': {'type': 'integer', 'description': 'Runs skipped because another worker held the purge lock'},
+                    'purged_messages': {'type': 'integer'},
+                    'purged_archives': {'type': 'integer'},
+                    'batch_size': {'type': 'integer'},
+                    'recent_runs': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'started_at': {'type': 'string'},
+                                'duration_seconds': {'type': 'number'},
+                                'rooms': {'type': 'integer'},
+                                'messages': {'type': 'integer'},
+                                'archives': {'type': 'integer'},
+                                'batches': {'type': 'integer'},
+                                'completed': {'type': 'boolean'}
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+})
+def get_retention_metrics():
+    return jsonify(retention_purger.metrics()), 200
+
+@chat_bp.route('/membership-cache/metrics', methods=['GET'])
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'Chat membership cache metrics for this worker',
+    'responses': {
+        200: {
+            'description': 'Cache size and hit/miss counters',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'size': {'type': 'integer'},
+                    'maxsize': {'type': 'integer'},
+                    'ttl_seconds': {'type': 'number'},
+                    'hits': {'type': 'integer'},
+                    'misses': {'type': 'integer'},
+                    'evictions': {'type': 'integer'},
+                    'hit_ratio': {'type': 'number'}
+                }
+            }
+        }
+    }
+})
+def get_membership_cache_metrics():
+    return jsonify(membership_cache.stats()), 200
+
+@chat_bp.route('/presence/heartbeat', methods=['POST'])
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'Report that a user is in a room (and whether they are typing)',
+    'description': f'Send every {int(PRESENCE_TTL // 2)}s or so while the room is open; users are shown '
+                   f'offline {int(PRESENCE_TTL)}s after their last heartbeat. Publishes presence_joined, '
+                   'presence_left and typing events on the room channel when the state changes.',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'room_id': {'type': 'string', 'example': 'open-web-development'},
+                    'user_id': {'type': 'string', 'example': 'userA'},
+                    'typing': {'type': 'boolean', 'default': False},
+                    'online': {'type': 'boolean', 'default': True,
+                               'description': 'false to leave the room immediately'}
+                },
+                'required': ['room_id', 'user_id']
+            }
+        }
+    ],
+    'responses': {
+        200: {'description': 'Heartbeat recorded'},
+        400: {'description': 'Missing required fields'},
+        403: {'description': 'User is not a participant'},
+        404: {'description': 'Room not found'}
+    }
+})
+def presence_heartbeat():
+    data = request.get_json(silent=True) or {}
+    room_id = data.get('room_id')
+    user_id = data.get('user_id')
+    if not room_id or not user_id:
+        return jsonify({"error": "Missing required fields"}), 400
+
+    membership = Chat.membership(room_id, user_id)
+    if not membership:
+        return jsonify({"error": "Room not found"}), 404
+    if not membership[1]:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    if data.get('online', True) is False:
+        if presence_store.leave(room_id, user_id):
+            outbox_dispatcher.publish_ephemeral(room_id, 'presence_left', {'user_id': user_id})
+        return jsonify({"status": "offline"}), 200
+
+    typing = bool(data.get('typing', False))
+    came_online, typing_changed = presence_store.heartbeat(room_id, user_id, typing)
+    if came_online:
+        outbox_dispatcher.publish_ephemeral(room_id, 'presence_joined', {'user_id': user_id})
+    if typing_changed:
+        outbox_dispatcher.publish_ephemeral(room_id, 'typing', {
+            'user_id': user_id,
+            'typing': typing,
+            'expires_in': PRESENCE_TYPING_TTL
+        })
+    return jsonify({"status": "online", "ttl": PRESENCE_TTL}), 200
+
+@chat_bp.route('/presence/<room_id>', methods=['GET'])
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'List users currently online in a room',
+    'parameters': [
+        {'name': 'room_id', 'in': 'path', 'type': 'string', 'required': True},
+        {'name': 'user_id', 'in': 'query', 'type': 'string', 'required': True,
+         'description': 'Requesting user; must be a participant'}
+    ],
+    'responses': {
+        200: {
+            'description': 'Online users, least recently active first',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'room_id': {'type': 'string'},
+                    'count': {'type': 'integer'},
+                    'online': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'user_id': {'type': 'string'},
+                                'typing': {'type': 'boolean'}
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        403: {'description': 'User is not a participant'},
+        404: {'description': 'Room not found'}
+    }
+})
+def get_presence(room_id):
+    membership = Chat.membership(room_id, request.args.get('user_id'))
+    if not membership:
+        return jsonify({"error": "Room not found"}), 404
+    if not membership[1]:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    online = presence_store.online(room_id)
+    return jsonify({
+        'room_id': room_id,
+        'count': len(online),
+        'online': [{'user_id': user_id, 'typing': typing} for user_id, typing in online]
+    }), 200
+
+@chat_bp.route('/presence/metrics', methods=['GET'])
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'Presence store metrics',
+    'responses': {
+        200: {'description': 'Backend name, tracked rooms and entries'}
+    }
+})
+def get_presence_metrics():
+    return jsonify({'backend': presence_store.name, **presence_store.stats()}), 200
+
+@chat_bp.route('/stream/<room_id>', methods=['GET'])
+@swag_from({
+    'tags': ['Chat'],
+    'summary': 'Subscribe to a chat room over Server-Sent Events',
+    'description': 'Only available when REALTIME_BACKEND=sse, which requires a single worker process. '
+                   'Emits the same events as the Pusher channel '
+                   '(new_message, ...), comment heartbeats while idle, and a final resync event if the '
+                   'client falls too far behind.',
+    'parameters': [
+        {
+            'name': 'room_id',
+            'in': 'path',
+            'type': 'string',
+            'required': True
+        },
+        {
+            'name': 'user_id',
+            'in': 'query',
+            'type': 'string',
+            'required': True,
+            'description': 'User ID for authorization'
+        }
+    ],
+    'produces': ['text/event-stream'],
+    'responses': {
+        200: {'description': 'Event stream'},
+        403: {'description': 'Unauthorized'},
+        404: {'description': 'Room not found or SSE disabled'},
+        503: {'description': 'Too many subscribers'}
+    }
+})
+def stream_room(room_id):
+    if not isinstance(realtime_backend, SSEBroker):
+        return jsonify({"error": "SSE streaming is not enabled"}), 404
+
+    user_id = request.args.get('user_id')
+    membership = Chat.membership(room_id, user_id)
+    if not membership:
+        return jsonify({"error": "Room not found"}), 404
+    if not membership[1]:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    subscription = realtime_backend.subscribe(room_id)
+    if subscription is None:
+        return jsonify({"error": "Too many subscribers"}), 503
+
+    return Response(
+        realtime_backend.stream(subscription),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
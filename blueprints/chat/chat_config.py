@@ -4,10 +4,74 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-pusher_client = pusher.Pusher(
-    app_id = os.getenv('PUSHER_APP_ID'),
-    key = os.getenv('PUSHER_KEY'),
-    secret = os.getenv('PUSHER_SECRET'),
-    cluster = os.getenv('PUSHER_CLUSTER'),
-    ssl=True
-)
\ No newline at end of file
+# Which realtime transport publishes chat events: 'pusher' or 'sse' (in-process broker,
+# single gunicorn worker only; multi-worker deployments must use pusher)
+REALTIME_BACKEND = os.getenv('REALTIME_BACKEND', 'pusher').lower()
+
+def create_pusher_client():
+    return pusher.Pusher(
+        app_id = os.getenv('PUSHER_APP_ID'),
+        key = os.getenv('PUSHER_KEY'),
+        secret = os.getenv('PUSHER_SECRET'),
+        cluster = os.getenv('PUSHER_CLUSTER'),
+        # Optional overrides, e.g. to point at a local fake Pusher server
+        host = os.getenv('PUSHER_HOST'),
+        port = int(os.getenv('PUSHER_PORT')) if os.getenv('PUSHER_PORT') else None,
+        ssl = os.getenv('PUSHER_SSL', 'true').lower() != 'false'
+    )
+
+# Server-Sent-Events broker tuning
+SSE_QUEUE_SIZE = int(os.getenv('SSE_QUEUE_SIZE', '100'))  # events buffered per subscriber
+SSE_MAX_SUBSCRIBERS = int(os.getenv('SSE_MAX_SUBSCRIBERS', '1000'))  # per process
+SSE_HEARTBEAT_INTERVAL = float(os.getenv('SSE_HEARTBEAT_INTERVAL', '15'))  # seconds
+
+# Per-process cache of chat membership used by the message hot paths
+MEMBERSHIP_CACHE_SIZE = int(os.getenv('MEMBERSHIP_CACHE_SIZE', '10000'))  # rooms
+MEMBERSHIP_CACHE_TTL = float(os.getenv('MEMBERSHIP_CACHE_TTL', '30'))  # seconds, bounds cross-worker staleness
+
+# How long /chat/send-batch remembers client_msg_ids for retries
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', '72'))
+
+# Message size and attachments
+MAX_MESSAGE_LENGTH = int(os.getenv('MAX_MESSAGE_LENGTH', '4000'))  # characters of text per message
+# Must be persistent storage shared by every worker (not a dyno's ephemeral disk); uploads are off while unset
+ATTACHMENT_DIR = os.getenv('ATTACHMENT_DIR')
+ATTACHMENT_MAX_SIZE = int(os.getenv('ATTACHMENT_MAX_SIZE', str(25 * 1024 * 1024)))  # bytes
+MAX_ATTACHMENTS_PER_MESSAGE = int(os.getenv('MAX_ATTACHMENTS_PER_MESSAGE', '10'))
+# Uploads no message refers to are deleted (with their blob, once unshared) after this long
+ATTACHMENT_GC_GRACE_HOURS = float(os.getenv('ATTACHMENT_GC_GRACE_HOURS', '24'))
+
+# /chat/message-changes and /chat/sync hold back changes and messages this recent, so a
+# transaction that commits late cannot land behind a cursor a client has already been given
+MESSAGE_CHANGES_SAFETY_WINDOW = float(os.getenv('MESSAGE_CHANGES_SAFETY_WINDOW', '5'))  # seconds
+
+# Message partitioning and cold archive
+MESSAGE_PARTITIONS_AHEAD = int(os.getenv('MESSAGE_PARTITIONS_AHEAD', '3'))  # months created in advance
+MESSAGE_ARCHIVE_AFTER_MONTHS = int(os.getenv('MESSAGE_ARCHIVE_AFTER_MONTHS', '6'))
+# Archiving is off unless this is set (to persistent storage) and message is partitioned. Archived
+# messages are only served by history paging; search, sync, edits and the change feed skip them
+MESSAGE_ARCHIVE_DIR = os.getenv('MESSAGE_ARCHIVE_DIR')
+MESSAGE_ARCHIVE_CACHE_SIZE = int(os.getenv('MESSAGE_ARCHIVE_CACHE_SIZE', '32'))  # decoded room-month files
+MESSAGE_ARCHIVE_CACHE_TTL = float(os.getenv('MESSAGE_ARCHIVE_CACHE_TTL', '600'))  # seconds
+
+# Per-room retention purge (Chat.retention_days / retention_max_messages)
+MESSAGE_RETENTION_INTERVAL_MINUTES = int(os.getenv('MESSAGE_RETENTION_INTERVAL_MINUTES', '15'))
+MESSAGE_RETENTION_BATCH_SIZE = int(os.getenv('MESSAGE_RETENTION_BATCH_SIZE', '1000'))  # rows per DELETE
+MESSAGE_RETENTION_BATCH_PAUSE = float(os.getenv('MESSAGE_RETENTION_BATCH_PAUSE', '0.05'))  # seconds between batches
+MESSAGE_RETENTION_MAX_RUN_SECONDS = float(os.getenv('MESSAGE_RETENTION_MAX_RUN_SECONDS', '300'))
+
+# Room presence and typing indicators: 'memory' (per process, so one worker only) or 'sqlite'
+# (shared by the workers on a host); unset picks memory for one worker and sqlite for several
+PRESENCE_BACKEND = os.getenv('PRESENCE_BACKEND', '').lower()
+PRESENCE_TTL = float(os.getenv('PRESENCE_TTL', '30'))  # seconds without a heartbeat before a user is offline
+PRESENCE_TYPING_TTL = float(os.getenv('PRESENCE_TYPING_TTL', '6'))  # seconds
+PRESENCE_MAX_ROOMS = int(os.getenv('PRESENCE_MAX_ROOMS', '10000'))
+PRESENCE_MAX_PER_ROOM = int(os.getenv('PRESENCE_MAX_PER_ROOM', '1000'))
+PRESENCE_SQLITE_PATH = os.getenv('PRESENCE_SQLITE_PATH', '/dev/shm/matchmycode-presence.db')
+
+# Outbox dispatcher tuning
+OUTBOX_BATCH_SIZE = 10  # Pusher accepts at most 10 events per trigger_batch call
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '1.0'))  # seconds
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_MAX_BACKOFF = int(os.getenv('OUTBOX_MAX_BACKOFF', '300'))  # seconds
+EPHEMERAL_QUEUE_SIZE = int(os.getenv('EPHEMERAL_QUEUE_SIZE', '10000'))  # presence/typing events awaiting dispatch
@@ -1,45 +1,422 @@
 from config import db
 from datetime import datetime, timedelta
-from sqlalchemy import func
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import event, func, select, literal, values, column, String
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR, aggregate_order_by, insert as pg_insert
+from cache import TTLCache
+from blueprints.chat.chat_config import MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_CACHE_TTL, IDEMPOTENCY_KEY_TTL_HOURS
 
 IST_OFFSET = timedelta(hours=5, minutes=30)
+SEARCH_CONFIG = 'english'  # Postgres text search configuration for message search
+
+# room_id -> (chat_id, frozenset of participant clerk ids)
+membership_cache = TTLCache(MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_CACHE_TTL)
+
+def invalidate_membership(room_id):
+    """Drop room_id from the membership cache, now and again once the session commits.
+
+    The second pass stops a concurrent request from re-caching the pre-commit
+    member list in between.
+    """
+    membership_cache.pop(room_id)
+    db.session.info.setdefault('stale_memberships', set()).add(room_id)
+
+@event.listens_for(db.session, 'after_commit')
+@event.listens_for(db.session, 'after_soft_rollback')
+def _drop_stale_memberships(session, *args):
+    for room_id in session.info.pop('stale_memberships', ()):
+        membership_cache.pop(room_id)
 
 class Chat(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     room_id = db.Column(db.String(255), unique=True)
     is_group = db.Column(db.Boolean, default=False)
     is_open_group = db.Column(db.Boolean, default=False)  # New field
+    # Legacy membership list, superseded by ChatParticipant; only read by backfill_chat_participants
     participants = db.Column(JSONB, nullable=False, default=list)
+    # Number of chat_participants rows, kept in step by add/remove_participant
+    participant_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=lambda: datetime.now() + IST_OFFSET)
     topic = db.Column(db.String(255))  # New field
     description = db.Column(db.Text)  # New field
     created_by = db.Column(db.String(255), db.ForeignKey('users.clerkId'))  # Admin creator
     project_id = db.Column(db.Integer, db.ForeignKey('projects.id'))
+    # Retention policy enforced by blueprints/chat/retention.py; NULL means keep forever
+    retention_days = db.Column(db.Integer)
+    retention_max_messages = db.Column(db.Integer)
+    retention_checked_at = db.Column(db.DateTime)  # Last completed purge; rooms are visited oldest first
 
     team_id = db.Column(db.Integer, db.ForeignKey('teams.id'), unique=True)
     team = db.relationship('Team', backref='chat', uselist=False)
 
-    def add_participant(self, user_id):
-        if not self.participants:
-            self.participants = []
-        
-        if user_id not in self.participants:
-            # Convert to Python list, modify, then convert back
-            participants_list = list(self.participants)
-            participants_list.append(user_id)
-            self.participants = participants_list
+    members = db.relationship('ChatParticipant', backref='chat', lazy='dynamic',
+                              cascade='all, delete-orphan', passive_deletes=True)
+
+    @property
+    def participant_ids(self):
+        return [member.clerk_id for member in self.members.order_by(ChatParticipant.joined_at, ChatParticipant.id)]
+
+    def add_participant(self, user_id, role='member'):
+        """Adds user_id to the chat; returns False if they were already a member."""
+        if self.id is None:
+            db.session.add(self)
+            db.session.flush()
+        inserted = pg_insert(ChatParticipant.__table__)\
+            .values(chat_id=self.id, clerk_id=user_id, role=role)\
+            .on_conflict_do_nothing(index_elements=['chat_id', 'clerk_id'])\
+            .returning(ChatParticipant.chat_id)\
+            .cte('inserted')
+        added = Chat._bump_participant_count(inserted, 1)
+        invalidate_membership(self.room_id)
+        if added:
+            db.session.expire(self, ['participant_count'])
+        return added
     
     def remove_participant(self, user_id):
-        if self.participants and user_id in self.participants:
-            participants_list = list(self.participants)
-            participants_list.remove(user_id)
-            self.participants = participants_list
+        """Removes user_id from the chat; returns False if they were not a member."""
+        removed = Chat.remove_member(self.id, self.room_id, user_id)
+        if removed:
+            db.session.expire(self, ['participant_count'])
+        return removed
 
+    @staticmethod
+    def remove_member(chat_id, room_id, user_id):
+        """remove_participant without loading the Chat row."""
+        deleted = db.delete(ChatParticipant.__table__)\
+            .where(ChatParticipant.chat_id == chat_id, ChatParticipant.clerk_id == user_id)\
+            .returning(ChatParticipant.chat_id)\
+            .cte('deleted')
+        removed = Chat._bump_participant_count(deleted, -1)
+        invalidate_membership(room_id)
+        return removed
 
-class Message(db.Model):
+    @staticmethod
+    def _bump_participant_count(changed, delta):
+        """Apply a membership insert/delete CTE and move participant_count in the same statement.
+
+        Returns True if the CTE touched a row. The counter update only locks the
+        chat row for the rest of the transaction; concurrent joins never lose
+        increments because UPDATE re-reads the latest row version.
+        """
+        row = db.session.execute(
+            db.update(Chat.__table__)
+            .where(Chat.id == changed.c.chat_id)
+            .values(participant_count=Chat.participant_count + delta)
+            .returning(Chat.participant_count)
+        ).first()
+        return row is not None
+
+    @staticmethod
+    def add_members(memberships, role='member'):
+        """Add many (room_id, user_id) pairs in one statement; returns how many were new.
+
+        Pairs whose room does not exist are skipped. participant_count of every
+        touched chat moves by its number of new rows in the same statement.
+        """
+        memberships = list(set(memberships))
+        if not memberships:
+            return 0
+        wanted = values(column('room_id', String), column('clerk_id', String), name='wanted')\
+            .data(memberships)
+        inserted = pg_insert(ChatParticipant.__table__)\
+            .from_select(
+                ['chat_id', 'clerk_id', 'role', 'joined_at'],
+                select(Chat.id, wanted.c.clerk_id, literal(role), literal(datetime.now() + IST_OFFSET))
+                .join(wanted, wanted.c.room_id == Chat.room_id)
+            )\
+            .on_conflict_do_nothing(index_elements=['chat_id', 'clerk_id'])\
+            .returning(ChatParticipant.chat_id)\
+            .cte('inserted')
+        added = select(inserted.c.chat_id, func.count().label('added'))\
+            .group_by(inserted.c.chat_id)\
+            .cte('added')
+        rows = db.session.execute(
+            db.update(Chat.__table__)
+            .where(Chat.id == added.c.chat_id)
+            .values(participant_count=Chat.participant_count + added.c.added)
+            .returning(added.c.added)
+        ).all()
+        for room_id in {room_id for room_id, _ in memberships}:
+            invalidate_membership(room_id)
+        return sum(row[0] for row in rows)
+
+    @staticmethod
+    def join(room_id, user_id, role='member'):
+        """Add user_id to room_id in a single statement.
+
+        Returns (room_id, topic, participant_count, participant ids, added),
+        or None if the room does not exist. Nothing is locked up front, so
+        concurrent joins of the same room only serialise on the counter update.
+        """
+        target = select(Chat.id, Chat.room_id, Chat.topic, Chat.participant_count)\
+            .where(Chat.room_id == room_id)\
+            .cte('target')
+        inserted = pg_insert(ChatParticipant.__table__)\
+            .from_select(
+                ['chat_id', 'clerk_id', 'role', 'joined_at'],
+                select(target.c.id, literal(user_id), literal(role), literal(datetime.now() + IST_OFFSET))
+            )\
+            .on_conflict_do_nothing(index_elements=['chat_id', 'clerk_id'])\
+            .returning(ChatParticipant.chat_id, ChatParticipant.clerk_id)\
+            .cte('inserted')
+        updated = db.update(Chat.__table__)\
+            .where(Chat.id == inserted.c.chat_id)\
+            .values(participant_count=Chat.participant_count + 1)\
+            .returning(Chat.id, Chat.participant_count)\
+            .cte('updated')
+        # Every CTE reads the same snapshot, so this list predates the insert
+        existing = select(func.array_agg(aggregate_order_by(
+                ChatParticipant.clerk_id, ChatParticipant.joined_at, ChatParticipant.id)))\
+            .where(ChatParticipant.chat_id == target.c.id)\
+            .scalar_subquery()
+        row = db.session.execute(
+            select(
+                target.c.room_id,
+                target.c.topic,
+                func.coalesce(updated.c.participant_count, target.c.participant_count),
+                existing,
+                inserted.c.clerk_id
+            )
+            .select_from(target)
+            .outerjoin(inserted, inserted.c.chat_id == target.c.id)
+            .outerjoin(updated, updated.c.id == target.c.id)
+        ).first()
+        if row is None:
+            return None
+        invalidate_membership(room_id)
+        participants = list(row[3] or [])
+        if row[4] is not None:
+            participants.append(row[4])
+        return row[0], row[1], row[2], participants, row[4] is not None
+
+    @staticmethod
+    def members_of(room_id):
+        """(chat_id, frozenset of participant ids) for room_id, or None if the room does not exist.
+
+        Served from membership_cache; a miss costs one query.
+        """
+        return Chat.members_of_many([room_id]).get(room_id)
+
+    @staticmethod
+    def members_of_many(room_ids):
+        """{room_id: (chat_id, frozenset of participant ids)} for the rooms that exist.
+
+        Rooms missing from membership_cache are loaded together in one query.
+        """
+        found = {}
+        missing = []
+        for room_id in set(room_ids):
+            entry = membership_cache.get(room_id)
+            if entry is None:
+                missing.append(room_id)
+            else:
+                found[room_id] = entry
+        if missing:
+            rows = db.session.query(Chat.room_id, Chat.id, func.array_agg(ChatParticipant.clerk_id))\
+                .outerjoin(ChatParticipant, ChatParticipant.chat_id == Chat.id)\
+                .filter(Chat.room_id.in_(missing))\
+                .group_by(Chat.id)\
+                .all()
+            for room_id, chat_id, members in rows:
+                entry = (chat_id, frozenset(member for member in members if member is not None))
+                membership_cache.set(room_id, entry)
+                found[room_id] = entry
+        return found
+
+    @staticmethod
+    def membership(room_id, user_id):
+        """(chat_id, is_member) for room_id, or None if the room does not exist."""
+        entry = Chat.members_of(room_id)
+        if entry is None:
+            return None
+        return entry[0], user_id in entry[1]
+
+
+@event.listens_for(Chat, 'after_delete')
+def _forget_deleted_chat(mapper, connection, target):
+    invalidate_membership(target.room_id)
+
+
+class ChatParticipant(db.Model):
+    __tablename__ = 'chat_participants'
+    id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat.id', ondelete='CASCADE'), nullable=False)
+    clerk_id = db.Column(db.String(255), nullable=False, index=True)
+    joined_at = db.Column(db.DateTime, default=lambda: datetime.now() + IST_OFFSET)
+    role = db.Column(db.String(20), nullable=False, default='member')  # 'owner' or 'member'
+
+    __table_args__ = (
+        db.UniqueConstraint('chat_id', 'clerk_id', name='unique_chat_participant'),
+    )
+
+
+class ChatReadCursor(db.Model):
+    """Highest message id a user has read in a chat; everything after it is unread."""
+    __tablename__ = 'chat_read_cursor'
+    id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat.id', ondelete='CASCADE'), nullable=False)
+    clerk_id = db.Column(db.String(255), nullable=False)
+    last_read_message_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('chat_id', 'clerk_id', name='unique_chat_read_cursor'),
+    )
+
+
+class RealtimeOutbox(db.Model):
+    """Realtime event written in the same transaction as the change it announces."""
+    __tablename__ = 'chat_outbox'
     id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(255), nullable=False)
+    event = db.Column(db.String(100), nullable=False)
+    payload = db.Column(JSONB, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    last_error = db.Column(db.Text)
+
+
+def backfill_chat_participants():
+    """Copy legacy Chat.participants JSONB lists into chat_participants.
+
+    Runs once at startup as a schema migration. Existing rows are kept as they
+    are (ON CONFLICT DO NOTHING), but the JSONB lists are no longer maintained:
+    running it again by hand re-adds anyone who has left a chat since.
+    Chat.participant_count is recomputed for every chat afterwards.
+    Returns the number of rows inserted.
+    """
+    inserted = copy_legacy_participants()
+    recount_chat_participants()
+    db.session.commit()
+    membership_cache.clear()
+    return inserted
+
+
+def copy_legacy_participants():
+    """Insert chat_participants rows for every legacy JSONB member; the caller commits.
+
+    Project owners and team leaders get the 'owner' role.
+    """
+    return db.session.execute(db.text("""
+        INSERT INTO chat_participants (chat_id, clerk_id, joined_at, role)
+        SELECT chat.id, member.clerk_id, chat.created_at,
+               CASE WHEN member.clerk_id IN (projects."clerkId", teams.leader_id)
+                    THEN 'owner' ELSE 'member' END
+        FROM chat
+        CROSS JOIN LATERAL jsonb_array_elements_text(chat.participants) AS member(clerk_id)
+        LEFT JOIN projects ON projects.chat_room_id = chat.room_id
+        LEFT JOIN teams ON teams.id = chat.team_id
+        WHERE jsonb_typeof(chat.participants) = 'array'
+        ON CONFLICT (chat_id, clerk_id) DO NOTHING
+    """)).rowcount
+
+
+def recount_chat_participants():
+    """Recompute Chat.participant_count from chat_participants; the caller commits."""
+    db.session.execute(db.text("""
+        UPDATE chat SET participant_count = counts.total
+        FROM (
+            SELECT chat.id, count(cp.id) AS total
+            FROM chat LEFT JOIN chat_participants cp ON cp.chat_id = chat.id
+            GROUP BY chat.id
+        ) AS counts
+        WHERE chat.id = counts.id AND chat.participant_count <> counts.total
+    """))
+
+
+class Message(db.Model):
+    # Range-partitioned by month on created_at (see blueprints/chat/archive.py),
+    # so created_at has to be part of the primary key
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     room_id = db.Column(db.String(255))
     sender_id = db.Column(db.String(255))
     content = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now() + IST_OFFSET)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, primary_key=True, default=lambda: datetime.now() + IST_OFFSET)
+    client_msg_id = db.Column(db.String(255))  # Sender-chosen id from /chat/send-batch
+    # [{id, name, size, content_type}] copied from ChatAttachment so history needs no join
+    attachments = db.Column(JSONB)
+    # Edits bump version; deletes leave a tombstone (content cleared, deleted_at set)
+    # so keyset cursors and realtime ordering never see a hole in the id sequence
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    edited_at = db.Column(db.DateTime)
+    deleted_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)  # Last edit or delete; feeds /chat/message-changes
+    # Maintained by Postgres; deferred so history queries never load it
+    search_vector = db.deferred(db.Column(
+        TSVECTOR,
+        db.Computed(f"to_tsvector('{SEARCH_CONFIG}', coalesce(content, ''))", persisted=True)
+    ))
+
+    __table_args__ = (
+        # Serves keyset pagination of a room's history on (created_at, id); tombstones are left out
+        db.Index('ix_message_room_created_id', 'room_id', 'created_at', 'id',
+                 postgresql_where=db.text('deleted_at IS NULL')),
+        # Serves "messages since id X" delta sync per room
+        db.Index('ix_message_room_id_id', 'room_id', 'id', postgresql_where=db.text('deleted_at IS NULL')),
+        # Serves the edit/delete feed; untouched messages are not indexed at all
+        db.Index('ix_message_room_updated', 'room_id', 'updated_at', 'id',
+                 postgresql_where=db.text('updated_at IS NOT NULL')),
+        db.Index('ix_message_search_vector', 'search_vector', postgresql_using='gin'),
+        # Lets the attachment garbage collector ask "does any message still refer to this upload?"
+        db.Index('ix_message_attachments', 'attachments', postgresql_using='gin',
+                 postgresql_ops={'attachments': 'jsonb_path_ops'}),
+        {'postgresql_partition_by': 'RANGE (created_at)'}
+    )
+
+
+class MessageArchive(db.Model):
+    """One room's messages for one month, compacted into a zstd JSONL file on disk."""
+    __tablename__ = 'message_archives'
+    id = db.Column(db.Integer, primary_key=True)
+    room_id = db.Column(db.String(255), nullable=False)
+    month = db.Column(db.Date, nullable=False)
+    path = db.Column(db.String(1024), nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    first_created_at = db.Column(db.DateTime, nullable=False)
+    first_message_id = db.Column(db.Integer, nullable=False)
+    last_created_at = db.Column(db.DateTime, nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('room_id', 'month', name='unique_message_archive'),
+    )
+
+
+class ChatAttachment(db.Model):
+    """A file uploaded to a room; the bytes live in the blob store under sha256."""
+    __tablename__ = 'chat_attachments'
+    id = db.Column(db.Integer, primary_key=True)
+    room_id = db.Column(db.String(255), nullable=False, index=True)
+    uploader_id = db.Column(db.String(255), nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    name = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    content_type = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_ref(self):
+        return {'id': self.id, 'name': self.name, 'size': self.size, 'content_type': self.content_type}
+
+
+class MessageIdempotencyKey(db.Model):
+    """A client_msg_id already used by a sender, so retried batch sends are not duplicated.
+
+    Lives outside message because a partitioned table cannot enforce a unique
+    key that does not include created_at.
+    """
+    __tablename__ = 'message_idempotency_keys'
+    sender_id = db.Column(db.String(255), primary_key=True)
+    client_msg_id = db.Column(db.String(255), primary_key=True)
+    message_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+def purge_idempotency_keys(older_than_hours=IDEMPOTENCY_KEY_TTL_HOURS):
+    """Forget client_msg_ids older than the retry window; returns how many were removed."""
+    result = db.session.execute(
+        db.delete(MessageIdempotencyKey.__table__)
+        .where(MessageIdempotencyKey.created_at < datetime.utcnow() - timedelta(hours=older_than_hours))
+    )
+    db.session.commit()
+    return result.rowcount
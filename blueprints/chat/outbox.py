@@ -0,0 +1,233 @@
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from config import db
+from blueprints.chat.models import RealtimeOutbox
+from blueprints.chat.realtime import realtime_backend
+from blueprints.chat.chat_config import (
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_MAX_BACKOFF,
+    EPHEMERAL_QUEUE_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(channel, event, payload):
+    """Stage a realtime event on the current session; it is published after commit."""
+    db.session.add(RealtimeOutbox(channel=channel, event=event, payload=payload))
+
+
+def enqueue_many(events):
+    """Stage (channel, event, payload) tuples with a single multi-row insert."""
+    if events:
+        db.session.execute(db.insert(RealtimeOutbox), [
+            {'channel': channel, 'event': event, 'payload': payload}
+            for channel, event, payload in events
+        ])
+
+
+class OutboxDispatcher:
+    """Background thread that drains chat_outbox into the realtime backend in batches.
+
+    Rows are claimed with FOR UPDATE SKIP LOCKED, so every gunicorn worker can
+    run its own dispatcher without double-sending. Failed batches are retried
+    with exponential backoff and dropped after OUTBOX_MAX_ATTEMPTS.
+
+    Ephemeral events (presence, typing) skip the table: they sit in a bounded
+    in-memory queue, go out on the same thread and are dropped on failure.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or realtime_backend
+        self.app = None
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._ephemeral = deque(maxlen=EPHEMERAL_QUEUE_SIZE)
+        self._stats = {
+            'dispatched': 0,
+            'batches': 0,
+            'failed_batches': 0,
+            'dropped': 0,
+            'last_batch_ms': None,
+            'last_lag_seconds': None,
+            'last_error': None,
+            'last_dispatch_at': None,
+            'ephemeral_sent': 0,
+            'ephemeral_dropped': 0
+        }
+
+    def init_app(self, app):
+        self.app = app
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='chat-outbox-dispatcher', daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        """Wake the dispatcher right away instead of waiting for the next poll."""
+        self._wakeup.set()
+
+    def publish_ephemeral(self, channel, event, payload):
+        """Queue a best-effort event that is not worth a database write."""
+        if len(self._ephemeral) == self._ephemeral.maxlen:
+            with self._lock:
+                self._stats['ephemeral_dropped'] += 1
+        self._ephemeral.append({'channel': channel, 'name': event, 'data': payload})
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            sent = 0
+            self.dispatch_ephemeral()
+            try:
+                with self.app.app_context():
+                    sent = self.dispatch_once()
+            except Exception:
+                logger.exception("Outbox dispatch failed")
+            # A full batch means there is probably more waiting
+            if sent < OUTBOX_BATCH_SIZE:
+                self._wakeup.wait(OUTBOX_POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def dispatch_once(self):
+        """Send one batch of due events; returns how many were delivered."""
+        now = datetime.utcnow()
+        events = RealtimeOutbox.query\
+            .filter(RealtimeOutbox.next_attempt_at <= now)\
+            .order_by(RealtimeOutbox.id)\
+            .limit(OUTBOX_BATCH_SIZE)\
+            .with_for_update(skip_locked=True)\
+            .all()
+        if not events:
+            db.session.commit()
+            return 0
+
+        started = time.monotonic()
+        try:
+            self.backend.trigger_batch([self._to_event(event) for event in events])
+        except ValueError:
+            # Pusher rejected an event client-side (e.g. payload over 10KB); such
+            # events can never succeed, so isolate them instead of retrying the batch
+            events = self._send_individually(events, now)
+        except Exception as e:
+            self._record_failure(events, now, e)
+            db.session.commit()
+            return 0
+
+        if not events:
+            db.session.commit()
+            return 0
+
+        lag = max((now - event.created_at).total_seconds() for event in events)
+        db.session.execute(
+            db.delete(RealtimeOutbox.__table__)
+            .where(RealtimeOutbox.id.in_([event.id for event in events]))
+        )
+        db.session.commit()
+
+        with self._lock:
+            self._stats['dispatched'] += len(events)
+            self._stats['batches'] += 1
+            self._stats['last_batch_ms'] = round((time.monotonic() - started) * 1000, 2)
+            self._stats['last_lag_seconds'] = round(lag, 3)
+            self._stats['last_dispatch_at'] = now.isoformat()
+        return len(events)
+
+    def dispatch_ephemeral(self):
+        """Send everything in the ephemeral queue; returns how many were delivered."""
+        sent = 0
+        while self._ephemeral:
+            batch = []
+            while self._ephemeral and len(batch) < OUTBOX_BATCH_SIZE:
+                batch.append(self._ephemeral.popleft())
+            try:
+                self.backend.trigger_batch(batch)
+            except Exception as e:
+                # Presence goes stale within seconds, so drop the backlog instead of retrying it
+                dropped = len(batch) + len(self._ephemeral)
+                self._ephemeral.clear()
+                logger.warning(f"Dropping {dropped} ephemeral realtime events: {e}")
+                with self._lock:
+                    self._stats['ephemeral_dropped'] += dropped
+                break
+            sent += len(batch)
+        if sent:
+            with self._lock:
+                self._stats['ephemeral_sent'] += sent
+        return sent
+
+    @staticmethod
+    def _to_event(event):
+        return {'channel': event.channel, 'name': event.event, 'data': event.payload}
+
+    def _send_individually(self, events, now):
+        """Deliver events one by one, dropping the ones Pusher refuses; returns the delivered ones.
+
+        Any other error stops the loop: that event and the rest are scheduled for
+        a retry, while the ones already delivered are still returned so they are
+        removed from the outbox instead of being sent again.
+        """
+        delivered = []
+        for position, event in enumerate(events):
+            try:
+                self.backend.trigger_batch([self._to_event(event)])
+            except ValueError as e:
+                logger.error(f"Dropping invalid realtime event {event.id} on {event.channel}: {e}")
+                db.session.delete(event)
+                with self._lock:
+                    self._stats['dropped'] += 1
+            except Exception as e:
+                self._record_failure(events[position:], now, e)
+                break
+            else:
+                delivered.append(event)
+        return delivered
+
+    def _record_failure(self, events, now, error):
+        logger.warning(f"Realtime batch of {len(events)} events failed: {error}")
+        dropped = 0
+        for event in events:
+            event.attempts += 1
+            event.last_error = str(error)[:1000]
+            if event.attempts >= OUTBOX_MAX_ATTEMPTS:
+                db.session.delete(event)
+                dropped += 1
+            else:
+                backoff = min(2 ** event.attempts, OUTBOX_MAX_BACKOFF)
+                event.next_attempt_at = now + timedelta(seconds=backoff)
+        if dropped:
+            logger.error(f"Dropped {dropped} realtime events after {OUTBOX_MAX_ATTEMPTS} attempts")
+        with self._lock:
+            self._stats['failed_batches'] += 1
+            self._stats['dropped'] += dropped
+            self._stats['last_error'] = str(error)[:1000]
+
+    def metrics(self):
+        """Dispatcher counters plus the current backlog and its age."""
+        pending, oldest = db.session.query(
+            db.func.count(RealtimeOutbox.id),
+            db.func.min(RealtimeOutbox.created_at)
+        ).one()
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = pending
+        stats['ephemeral_pending'] = len(self._ephemeral)
+        stats['oldest_pending_age_seconds'] = (
+            round((datetime.utcnow() - oldest).total_seconds(), 3) if oldest else 0
+        )
+        stats['running'] = bool(self._thread and self._thread.is_alive())
+        stats['backend'] = {'name': self.backend.name, **self.backend.stats()}
+        return stats
+
+
+outbox_dispatcher = OutboxDispatcher()
@@ -0,0 +1,331 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from blueprints.chat.chat_config import (
+    PRESENCE_BACKEND,
+    PRESENCE_TTL,
+    PRESENCE_TYPING_TTL,
+    PRESENCE_MAX_ROOMS,
+    PRESENCE_MAX_PER_ROOM,
+    PRESENCE_SQLITE_PATH
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceStore(ABC):
+    """Who is online (and typing) per room, kept alive by client heartbeats.
+
+    heartbeat() reports transitions as (came_online, typing_changed) so the
+    caller only publishes realtime events when something actually changed.
+    """
+    name = None
+
+    def __init__(self, ttl=PRESENCE_TTL, typing_ttl=PRESENCE_TYPING_TTL):
+        self.ttl = ttl
+        self.typing_ttl = typing_ttl
+
+    @abstractmethod
+    def heartbeat(self, room_id, user_id, typing=False):
+        """Record a heartbeat; returns (came_online, typing_changed)."""
+
+    @abstractmethod
+    def leave(self, room_id, user_id):
+        """Mark user_id offline right away; returns True if they were online."""
+
+    @abstractmethod
+    def online(self, room_id):
+        """[(user_id, typing)] for room_id, most recently active last."""
+
+    @abstractmethod
+    def sweep(self):
+        """Forget expired entries; returns [(room_id, user_id)] that went offline."""
+
+    def stats(self):
+        return {}
+
+
+class MemoryPresenceStore(PresenceStore):
+    """Per-process store: rooms map to OrderedDicts ordered by last heartbeat.
+
+    A heartbeat is a dict update plus move_to_end, and expired users are
+    always at the front, so pruning a room never scans live entries. Rooms and
+    users per room are capped; the least recently active are evicted first,
+    and evicted users are reported by the next sweep() (unless they have sent
+    a heartbeat since) so their presence_left is published like any other.
+    """
+    name = 'memory'
+
+    def __init__(self, max_rooms=PRESENCE_MAX_ROOMS, max_per_room=PRESENCE_MAX_PER_ROOM, **kwargs):
+        super().__init__(**kwargs)
+        self.max_rooms = max_rooms
+        self.max_per_room = max_per_room
+        self._rooms = OrderedDict()
+        self._lock = threading.Lock()
+        self._evicted = []  # (room_id, user_id) pushed out by the caps, drained by sweep()
+        self.evictions = 0
+
+    def heartbeat(self, room_id, user_id, typing=False):
+        now = time.monotonic()
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                room = self._rooms[room_id] = OrderedDict()
+                while len(self._rooms) > self.max_rooms:
+                    dropped_room_id, dropped = self._rooms.popitem(last=False)
+                    self._evict(dropped_room_id, dropped)
+            self._rooms.move_to_end(room_id)
+            previous = room.pop(user_id, None)
+            was_online = previous is not None and previous[0] > now
+            was_typing = was_online and previous[1] > now
+            room[user_id] = (now + self.ttl, now + self.typing_ttl if typing else 0)
+            while len(room) > self.max_per_room:
+                self._evict(room_id, [room.popitem(last=False)[0]])
+        return not was_online, was_typing != typing
+
+    def _evict(self, room_id, user_ids):
+        # Expired entries are reported too: sweep() would have reported them anyway
+        self._evicted.extend((room_id, user_id) for user_id in user_ids)
+        self.evictions += len(user_ids)
+
+    def leave(self, room_id, user_id):
+        with self._lock:
+            room = self._rooms.get(room_id)
+            entry = room.pop(user_id, None) if room else None
+            if room is not None and not room:
+                del self._rooms[room_id]
+        return entry is not None and entry[0] > time.monotonic()
+
+    def online(self, room_id):
+        now = time.monotonic()
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if not room:
+                return []
+            # Expired entries stay until sweep() so their presence_left still gets published
+            return [(user_id, typing_until > now)
+                    for user_id, (expires_at, typing_until) in room.items() if expires_at > now]
+
+    def sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            # Evicted users who came back since are online again, not gone
+            expired = [(room_id, user_id) for room_id, user_id in self._evicted
+                       if user_id not in self._rooms.get(room_id, ())]
+            self._evicted = []
+            for room_id in list(self._rooms):
+                room = self._rooms[room_id]
+                expired.extend((room_id, user_id) for user_id in self._prune(room, now))
+                if not room:
+                    del self._rooms[room_id]
+        return expired
+
+    @staticmethod
+    def _prune(room, now):
+        expired = []
+        while room:
+            user_id, (expires_at, _) = next(iter(room.items()))
+            if expires_at > now:
+                break
+            room.popitem(last=False)
+            expired.append(user_id)
+        return expired
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rooms': len(self._rooms),
+                'entries': sum(len(room) for room in self._rooms.values()),
+                'evictions': self.evictions
+            }
+
+
+class SQLitePresenceStore(PresenceStore):
+    """Presence shared by every worker on the host through a SQLite file.
+
+    Point PRESENCE_SQLITE_PATH at tmpfs (/dev/shm) so it never touches disk.
+    Each heartbeat is one short write transaction: an upsert on the
+    (room_id, user_id) primary key plus the room's last activity. The same
+    caps as the memory store apply; users pushed out by them are queued in
+    presence_evicted for the next sweep() of any worker.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path=PRESENCE_SQLITE_PATH, max_rooms=PRESENCE_MAX_ROOMS,
+                 max_per_room=PRESENCE_MAX_PER_ROOM, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.max_rooms = max_rooms
+        self.max_per_room = max_per_room
+        self.evictions = 0
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS presence (
+                    room_id TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    typing_until REAL NOT NULL,
+                    PRIMARY KEY (room_id, user_id)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS presence_expires_at ON presence (expires_at)")
+            # active is the room's latest heartbeat expiry; the least recently active room is evicted first
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS presence_rooms (
+                    room_id TEXT PRIMARY KEY,
+                    active REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS presence_rooms_active ON presence_rooms (active)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS presence_evicted (
+                    room_id TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    PRIMARY KEY (room_id, user_id)
+                ) WITHOUT ROWID
+            """)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def heartbeat(self, room_id, user_id, typing=False):
+        # time.time() rather than monotonic: the clock has to agree across processes
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            previous = conn.execute(
+                "SELECT expires_at, typing_until FROM presence WHERE room_id = ? AND user_id = ?",
+                (room_id, user_id)
+            ).fetchone()
+            conn.execute(
+                "INSERT INTO presence (room_id, user_id, expires_at, typing_until) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (room_id, user_id) DO UPDATE SET "
+                "expires_at = excluded.expires_at, typing_until = excluded.typing_until",
+                (room_id, user_id, now + self.ttl, now + self.typing_ttl if typing else 0)
+            )
+            new_room = conn.execute(
+                "INSERT INTO presence_rooms (room_id, active) VALUES (?, ?) ON CONFLICT (room_id) DO NOTHING",
+                (room_id, now + self.ttl)
+            ).rowcount == 1
+            if new_room:
+                self._cap_rooms(conn, room_id)
+            else:
+                conn.execute("UPDATE presence_rooms SET active = ? WHERE room_id = ?", (now + self.ttl, room_id))
+            if previous is None:
+                self._cap_room(conn, room_id, user_id)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        was_online = previous is not None and previous[0] > now
+        was_typing = was_online and previous[1] > now
+        return not was_online, was_typing != typing
+
+    def _cap_rooms(self, conn, room_id):
+        overflow = conn.execute("SELECT count(*) FROM presence_rooms").fetchone()[0] - self.max_rooms
+        if overflow <= 0:
+            return
+        dropped = conn.execute(
+            "SELECT room_id FROM presence_rooms WHERE room_id != ? ORDER BY active LIMIT ?", (room_id, overflow)
+        ).fetchall()
+        for dropped_room_id, in dropped:
+            conn.execute("DELETE FROM presence_rooms WHERE room_id = ?", (dropped_room_id,))
+            self._evict(conn, dropped_room_id, conn.execute(
+                "DELETE FROM presence WHERE room_id = ? RETURNING user_id", (dropped_room_id,)
+            ).fetchall())
+
+    def _cap_room(self, conn, room_id, user_id):
+        overflow = conn.execute("SELECT count(*) FROM presence WHERE room_id = ?",
+                                (room_id,)).fetchone()[0] - self.max_per_room
+        if overflow <= 0:
+            return
+        self._evict(conn, room_id, conn.execute(
+            "DELETE FROM presence WHERE room_id = ? AND user_id IN ("
+            "SELECT user_id FROM presence WHERE room_id = ? AND user_id != ? ORDER BY expires_at LIMIT ?"
+            ") RETURNING user_id",
+            (room_id, room_id, user_id, overflow)
+        ).fetchall())
+
+    def _evict(self, conn, room_id, user_ids):
+        # Expired entries are reported too: sweep() would have reported them anyway
+        conn.executemany(
+            "INSERT INTO presence_evicted (room_id, user_id) VALUES (?, ?) ON CONFLICT DO NOTHING",
+            [(room_id, user_id) for user_id, in user_ids]
+        )
+        self.evictions += len(user_ids)
+
+    def leave(self, room_id, user_id):
+        row = self._connection().execute(
+            "DELETE FROM presence WHERE room_id = ? AND user_id = ? RETURNING expires_at",
+            (room_id, user_id)
+        ).fetchone()
+        return row is not None and row[0] > time.time()
+
+    def online(self, room_id):
+        now = time.time()
+        rows = self._connection().execute(
+            "SELECT user_id, typing_until FROM presence WHERE room_id = ? AND expires_at > ? "
+            "ORDER BY expires_at",
+            (room_id, now)
+        ).fetchall()
+        return [(user_id, typing_until > now) for user_id, typing_until in rows]
+
+    def sweep(self):
+        # Deleting with RETURNING hands each expired or evicted user to exactly one worker
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Evicted users who came back since are online again, not gone
+            gone = conn.execute(
+                "SELECT room_id, user_id FROM presence_evicted AS e WHERE NOT EXISTS ("
+                "SELECT 1 FROM presence AS p WHERE p.room_id = e.room_id AND p.user_id = e.user_id)"
+            ).fetchall()
+            conn.execute("DELETE FROM presence_evicted")
+            gone += conn.execute(
+                "DELETE FROM presence WHERE expires_at <= ? RETURNING room_id, user_id", (now,)
+            ).fetchall()
+            conn.execute("DELETE FROM presence_rooms WHERE active <= ?", (now,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return gone
+
+    def stats(self):
+        rooms, entries = self._connection().execute(
+            "SELECT count(DISTINCT room_id), count(*) FROM presence WHERE expires_at > ?",
+            (time.time(),)
+        ).fetchone()
+        return {'rooms': rooms, 'entries': entries, 'evictions': self.evictions, 'path': self.path}
+
+
+def create_presence_store(name):
+    # Heroku sets WEB_CONCURRENCY to the gunicorn worker count
+    workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+    if not name:
+        name = 'sqlite' if workers > 1 else 'memory'
+    if name == 'memory':
+        if workers > 1:
+            raise ValueError(f"PRESENCE_BACKEND=memory keeps presence per worker, so users would flap "
+                             f"online/offline; run one worker or use sqlite (WEB_CONCURRENCY={workers})")
+        return MemoryPresenceStore()
+    if name == 'sqlite':
+        return SQLitePresenceStore()
+    raise ValueError(f"Unknown PRESENCE_BACKEND: {name}")
+
+
+presence_store = create_presence_store(PRESENCE_BACKEND)
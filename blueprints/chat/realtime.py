@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import queue
+import threading
+from abc import ABC, abstractmethod
+from blueprints.chat.chat_config import (
+    REALTIME_BACKEND,
+    create_pusher_client,
+    SSE_QUEUE_SIZE,
+    SSE_MAX_SUBSCRIBERS,
+    SSE_HEARTBEAT_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RealtimeBackend(ABC):
+    """Transport used to push chat events to connected clients.
+
+    Events are dicts of {'channel', 'name', 'data'}; the channel is the room_id.
+    """
+    name = None
+
+    @abstractmethod
+    def trigger_batch(self, events):
+        """Deliver events; raises ValueError for events that can never be delivered."""
+
+    def trigger(self, channel, name, data):
+        self.trigger_batch([{'channel': channel, 'name': name, 'data': data}])
+
+    def stats(self):
+        return {}
+
+
+class PusherBackend(RealtimeBackend):
+    name = 'pusher'
+
+    def __init__(self, client):
+        self.client = client
+
+    def trigger_batch(self, events):
+        self.client.trigger_batch(events)
+
+
+class SSESubscription:
+    def __init__(self, room_id, queue_size):
+        self.room_id = room_id
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.closed = False
+
+
+class SSEBroker(RealtimeBackend):
+    """In-process Server-Sent-Events broker with one bounded queue per subscriber.
+
+    A subscriber whose queue fills up is disconnected with a 'resync' event
+    rather than slowing down publishers; the client reconnects and catches up
+    through /chat/sync. Subscribers only see events published by the same
+    process, so this backend needs a single worker (gunicorn --threads for
+    concurrency); create_backend() refuses it when WEB_CONCURRENCY > 1.
+    """
+    name = 'sse'
+
+    def __init__(self, queue_size=SSE_QUEUE_SIZE, max_subscribers=SSE_MAX_SUBSCRIBERS,
+                 heartbeat_interval=SSE_HEARTBEAT_INTERVAL):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.heartbeat_interval = heartbeat_interval
+        self._rooms = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, room_id):
+        """Register a subscriber for room_id; returns None when the broker is full."""
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            subscription = SSESubscription(room_id, self.queue_size)
+            self._rooms.setdefault(room_id, set()).add(subscription)
+            self._count += 1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._rooms.get(subscription.room_id)
+            if subscribers and subscription in subscribers:
+                subscribers.discard(subscription)
+                self._count -= 1
+                if not subscribers:
+                    del self._rooms[subscription.room_id]
+        subscription.closed = True
+
+    def trigger_batch(self, events):
+        for event in events:
+            frame = self._format(event['name'], event['data'])
+            with self._lock:
+                subscribers = list(self._rooms.get(event['channel'], ()))
+            for subscription in subscribers:
+                try:
+                    subscription.queue.put_nowait(frame)
+                except queue.Full:
+                    logger.info(f"Disconnecting slow SSE subscriber on {subscription.room_id}")
+                    self.unsubscribe(subscription)
+
+    def stream(self, subscription):
+        """Generator of SSE frames for a subscription, with heartbeats while idle."""
+        try:
+            yield 'retry: 3000\n\n'
+            while not subscription.closed:
+                try:
+                    yield subscription.queue.get(timeout=self.heartbeat_interval)
+                except queue.Empty:
+                    yield ': heartbeat\n\n'
+            # Dropped for falling behind; tell the client to resync
+            yield self._format('resync', {'room_id': subscription.room_id})
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self):
+        with self._lock:
+            return {'rooms': len(self._rooms), 'subscribers': self._count}
+
+    @staticmethod
+    def _format(name, data):
+        if not isinstance(data, str):
+            data = json.dumps(data)
+        return f"event: {name}\ndata: {data}\n\n"
+
+
+def create_backend(name):
+    if name == 'pusher':
+        return PusherBackend(create_pusher_client())
+    if name == 'sse':
+        # Heroku sets WEB_CONCURRENCY to the gunicorn worker count
+        workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+        if workers > 1:
+            raise ValueError(f"REALTIME_BACKEND=sse only reaches subscribers of the worker that publishes; "
+                             f"run one worker or use pusher (WEB_CONCURRENCY={workers})")
+        return SSEBroker()
+    raise ValueError(f"Unknown REALTIME_BACKEND: {name}")
+
+
+realtime_backend = create_backend(REALTIME_BACKEND)
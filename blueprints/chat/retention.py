@@ -0,0 +1,256 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import or_, tuple_
+from config import db
+from blueprints.chat.models import Chat, ChatAttachment, Message, MessageArchive, IST_OFFSET
+from blueprints.chat.blobs import blob_store
+from blueprints.chat.chat_config import (
+    ATTACHMENT_GC_GRACE_HOURS,
+    MESSAGE_RETENTION_BATCH_SIZE,
+    MESSAGE_RETENTION_BATCH_PAUSE,
+    MESSAGE_RETENTION_MAX_RUN_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+RECENT_RUNS = 20  # runs kept for the metrics endpoint
+RETENTION_LOCK_KEY = 741202  # pg_try_advisory_lock key; one purger across all workers
+
+# Oldest rows of one room first, via the partial (room_id, created_at, id) index
+_DELETE_LIVE = db.text("""
+    DELETE FROM message WHERE (id, created_at) IN (
+        SELECT id, created_at FROM message
+        WHERE room_id = :room_id AND deleted_at IS NULL AND (created_at, id) < (:created_at, :id)
+        ORDER BY created_at, id
+        LIMIT :batch
+    )
+""")
+# Tombstones are outside that index; every tombstone has updated_at set, so the
+# partial (room_id, updated_at, id) index narrows the scan to the room's changed rows
+_DELETE_TOMBSTONES = db.text("""
+    DELETE FROM message WHERE (id, created_at) IN (
+        SELECT id, created_at FROM message
+        WHERE room_id = :room_id AND updated_at IS NOT NULL AND deleted_at IS NOT NULL
+          AND (created_at, id) < (:created_at, :id)
+        LIMIT :batch
+    )
+""")
+
+# Uploads no message refers to any more, live or archived. An archive of the
+# room that reaches past the upload keeps it, since archive files are not
+# searched; archives are IST and uploads UTC, which only errs towards keeping.
+_DELETE_ORPHAN_ATTACHMENTS = db.text("""
+    DELETE FROM chat_attachments a
+    WHERE a.id = ANY(:ids)
+      AND NOT EXISTS (
+          SELECT 1 FROM message m
+          WHERE m.room_id = a.room_id
+            AND m.attachments @> jsonb_build_array(jsonb_build_object('id', a.id))
+      )
+      AND NOT EXISTS (
+          SELECT 1 FROM message_archives ma
+          WHERE ma.room_id = a.room_id AND ma.last_created_at >= a.created_at
+      )
+    RETURNING a.sha256
+""")
+
+
+class RetentionPurger:
+    """Deletes messages that fall outside their room's retention policy.
+
+    Every DELETE touches at most batch_size rows and commits on its own, with a
+    short pause in between, so no run holds row locks for long or produces WAL
+    faster than replicas and vacuum can keep up. Rooms are visited in order of
+    Chat.retention_checked_at, which is only stamped once a room is fully
+    purged: a run that hits max_run_seconds stops, and the next run resumes
+    with the rooms it did not reach.
+
+    Each run then walks chat_attachments in id order, a batch at a time,
+    deleting uploads older than ATTACHMENT_GC_GRACE_HOURS that no message
+    refers to (whether purged, deleted or never sent), and removes their
+    blob once no other upload shares it.
+
+    Every worker schedules the purge, so a run holds an advisory lock and
+    a worker that cannot take it skips its turn.
+    """
+
+    def __init__(self, batch_size=MESSAGE_RETENTION_BATCH_SIZE, pause=MESSAGE_RETENTION_BATCH_PAUSE,
+                 max_run_seconds=MESSAGE_RETENTION_MAX_RUN_SECONDS):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.max_run_seconds = max_run_seconds
+        self._lock = threading.Lock()
+        self._runs = deque(maxlen=RECENT_RUNS)
+        self.total_runs = 0
+        self.total_messages = 0
+        self.total_archives = 0
+        self.total_attachments = 0
+        self.total_blobs = 0
+        self.skipped_runs = 0
+        self._attachment_cursor = 0  # last chat_attachments.id checked; 0 starts a new pass
+
+    def run(self):
+        """One purge pass; returns the run's stats, or None if another worker is running one."""
+        # Session-level lock on a connection of its own, since the run commits as it goes
+        with db.engine.connect() as lock_connection:
+            if not lock_connection.execute(db.text("SELECT pg_try_advisory_lock(:key)"),
+                                           {'key': RETENTION_LOCK_KEY}).scalar():
+                with self._lock:
+                    self.skipped_runs += 1
+                return None
+            try:
+                return self._run()
+            finally:
+                lock_connection.execute(db.text("SELECT pg_advisory_unlock(:key)"), {'key': RETENTION_LOCK_KEY})
+                lock_connection.commit()
+
+    def _run(self):
+        started = time.monotonic()
+        deadline = started + self.max_run_seconds
+        stats = {
+            'started_at': datetime.utcnow().isoformat(),
+            'rooms': 0,
+            'messages': 0,
+            'archives': 0,
+            'attachments': 0,
+            'blobs': 0,
+            'batches': 0,
+            'completed': True
+        }
+        rooms = db.session.query(Chat.id, Chat.room_id, Chat.retention_days, Chat.retention_max_messages)\
+            .filter(or_(Chat.retention_days.isnot(None), Chat.retention_max_messages.isnot(None)))\
+            .order_by(Chat.retention_checked_at.asc().nullsfirst(), Chat.id.asc())\
+            .all()
+        db.session.commit()
+
+        for room in rooms:
+            if time.monotonic() >= deadline:
+                stats['completed'] = False
+                break
+            bound = self._bound(room)
+            if bound and not self._purge_room(room.room_id, bound, deadline, stats):
+                stats['completed'] = False
+                break
+            db.session.query(Chat).filter(Chat.id == room.id)\
+                .update({'retention_checked_at': datetime.now() + IST_OFFSET}, synchronize_session=False)
+            db.session.commit()
+            stats['rooms'] += 1
+        if stats['completed'] and blob_store.configured:
+            stats['completed'] = self._collect_attachments(deadline, stats)
+
+        stats['duration_seconds'] = round(time.monotonic() - started, 3)
+        with self._lock:
+            self._runs.append(stats)
+            self.total_runs += 1
+            self.total_messages += stats['messages']
+            self.total_archives += stats['archives']
+            self.total_attachments += stats['attachments']
+            self.total_blobs += stats['blobs']
+        return stats
+
+    @staticmethod
+    def _bound(room):
+        """(created_at, id) position; everything strictly older is past retention."""
+        bounds = []
+        if room.retention_days:
+            cutoff = datetime.now() + IST_OFFSET - timedelta(days=room.retention_days)
+            bounds.append((cutoff, 0))
+        if room.retention_max_messages:
+            # Index-only walk down the newest retention_max_messages entries
+            oldest_kept = db.session.query(Message.created_at, Message.id)\
+                .filter(Message.room_id == room.room_id, Message.deleted_at.is_(None))\
+                .order_by(Message.created_at.desc(), Message.id.desc())\
+                .offset(room.retention_max_messages - 1)\
+                .limit(1)\
+                .first()
+            if oldest_kept:
+                bounds.append((oldest_kept.created_at, oldest_kept.id))
+        return max(bounds) if bounds else None
+
+    def _purge_room(self, room_id, bound, deadline, stats):
+        """Delete room_id's rows before bound; False if the deadline cut it short."""
+        params = {'room_id': room_id, 'created_at': bound[0], 'id': bound[1], 'batch': self.batch_size}
+        for statement in (_DELETE_LIVE, _DELETE_TOMBSTONES):
+            while True:
+                deleted = db.session.execute(statement, params).rowcount
+                db.session.commit()
+                stats['batches'] += 1
+                stats['messages'] += deleted
+                if deleted < self.batch_size:
+                    break
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(self.pause)
+        stats['archives'] += self._purge_archives(room_id, bound)
+        return True
+
+    @staticmethod
+    def _purge_archives(room_id, bound):
+        """Drop archive files whose newest message is past retention.
+
+        A file that straddles the bound is kept until all of it has expired.
+        """
+        archives = MessageArchive.query.filter(
+            MessageArchive.room_id == room_id,
+            tuple_(MessageArchive.last_created_at, MessageArchive.last_message_id) < bound
+        ).all()
+        if not archives:
+            return 0
+        paths = [archive.path for archive in archives]
+        for archive in archives:
+            db.session.delete(archive)
+        db.session.commit()
+        # Files go after the rows so readers never find a row without its file
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return len(archives)
+
+    def _collect_attachments(self, deadline, stats):
+        """Delete orphaned uploads and their blobs; False if the deadline cut it short."""
+        grace = timedelta(hours=ATTACHMENT_GC_GRACE_HOURS)
+        cutoff = datetime.utcnow() - grace
+        while True:
+            ids = [attachment_id for attachment_id, in db.session.query(ChatAttachment.id)
+                   .filter(ChatAttachment.id > self._attachment_cursor, ChatAttachment.created_at < cutoff)
+                   .order_by(ChatAttachment.id.asc())
+                   .limit(self.batch_size)]
+            deleted = db.session.execute(_DELETE_ORPHAN_ATTACHMENTS, {'ids': ids}).scalars().all() if ids else []
+            db.session.commit()
+            stats['batches'] += 1
+            stats['attachments'] += len(deleted)
+            # Rows go before blobs so no remaining row ever points at a missing file
+            for digest in set(deleted):
+                shared = db.session.query(ChatAttachment.id).filter(ChatAttachment.sha256 == digest).exists()
+                stats['blobs'] += blob_store.delete(digest, grace.total_seconds(),
+                                                    lambda: db.session.query(shared).scalar())
+            db.session.commit()
+            if len(ids) < self.batch_size:
+                self._attachment_cursor = 0
+                return True
+            self._attachment_cursor = ids[-1]
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.pause)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'runs': self.total_runs,
+                'skipped_runs': self.skipped_runs,
+                'purged_messages': self.total_messages,
+                'purged_archives': self.total_archives,
+                'purged_attachments': self.total_attachments,
+                'purged_blobs': self.total_blobs,
+                'batch_size': self.batch_size,
+                'recent_runs': list(self._runs)
+            }
+
+
+retention_purger = RetentionPurger()
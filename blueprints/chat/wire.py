@@ -0,0 +1,79 @@
+import gzip
+import json
+from flask import Response, request
+
+try:
+    import msgpack
+except ImportError:  # optional: clients fall back to JSON
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # optional: gzip is always available
+    brotli = None
+
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack')
+COMPRESS_MIN_SIZE = 1024  # bytes; smaller bodies are not worth the CPU
+
+
+def columnar_messages(rows):
+    """Messages as parallel arrays plus a sender table instead of one dict per message.
+
+    rows are (Message, sender_name) pairs; senders[sender_index[i]] is the
+    sender of message i.
+    """
+    senders = []
+    sender_positions = {}
+    columns = {'id': [], 'sender_index': [], 'content': [], 'timestamp': [], 'version': [],
+               'attachments': [], 'edited_at': []}
+    for message, sender_name in rows:
+        position = sender_positions.get(message.sender_id)
+        if position is None:
+            position = sender_positions[message.sender_id] = len(senders)
+            senders.append({'id': message.sender_id, 'name': sender_name})
+        columns['id'].append(message.id)
+        columns['sender_index'].append(position)
+        columns['content'].append(message.content)
+        columns['timestamp'].append(message.created_at.isoformat())
+        # Always sent: edits and deletes are conditional on the version the client holds
+        columns['version'].append(message.version or 1)
+        columns['attachments'].append(message.attachments or None)
+        columns['edited_at'].append(message.edited_at.isoformat() if message.edited_at else None)
+    for sparse in ('attachments', 'edited_at'):
+        if not any(columns[sparse]):
+            # Most pages have no attachments or edits; skip a column of nulls
+            del columns[sparse]
+    return {'senders': senders, 'columns': columns}
+
+
+def _preferred(options):
+    """First of options the client accepts in Accept-Encoding, in our order of preference."""
+    for option in options:
+        if request.accept_encodings[option]:
+            return option
+    return None
+
+
+def payload_response(payload, status=200):
+    """Encode payload as MessagePack or JSON per Accept, compressed per Accept-Encoding."""
+    mimetype = request.accept_mimetypes.best_match(('application/json',) + MSGPACK_TYPES, 'application/json')
+    if mimetype in MSGPACK_TYPES and msgpack is not None:
+        body = msgpack.packb(payload, use_bin_type=True)
+        mimetype = 'application/msgpack'
+    else:
+        body = json.dumps(payload, separators=(',', ':')).encode()
+        mimetype = 'application/json'
+
+    response = Response(status=status, mimetype=mimetype)
+    encoding = None
+    if len(body) >= COMPRESS_MIN_SIZE:
+        encoding = _preferred(('br', 'gzip') if brotli is not None else ('gzip',))
+    if encoding == 'br':
+        body = brotli.compress(body, quality=5)
+    elif encoding == 'gzip':
+        body = gzip.compress(body, compresslevel=5)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    response.set_data(body)
+    return response
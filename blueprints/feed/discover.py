@@ -0,0 +1,285 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from config import db
+from cache import TTLCache
+from blueprints.projects.models import Project
+from blueprints.user.models import UserDetails
+from blueprints.hackathon.models import Hackathon
+from blueprints.follow.models import Follow
+
+logger = logging.getLogger(__name__)
+
+DISCOVER_TOP_K = int(os.getenv('DISCOVER_TOP_K', '500'))  # ranked items cached per viewer
+DISCOVER_CACHE_SIZE = int(os.getenv('DISCOVER_CACHE_SIZE', '5000'))  # viewers
+DISCOVER_CACHE_TTL = float(os.getenv('DISCOVER_CACHE_TTL', '300'))  # seconds
+DISCOVER_INDEX_REFRESH_MINUTES = int(os.getenv('DISCOVER_INDEX_REFRESH_MINUTES', '10'))
+# Refreshes are skipped while the catalogue is unchanged, but never for longer than this
+# (hackathons drop out by end date without any row changing)
+DISCOVER_INDEX_MAX_AGE_MINUTES = int(os.getenv('DISCOVER_INDEX_MAX_AGE_MINUTES', '60'))
+DISCOVER_RECENCY_HALF_LIFE_DAYS = float(os.getenv('DISCOVER_RECENCY_HALF_LIFE_DAYS', '14'))
+DISCOVER_MAX_SECOND_DEGREE = 5000  # friends-of-friends considered for proximity
+
+# Score = skill overlap (cosine, 0..1) + follow proximity (0..1) + recency (0..1), weighted
+SKILL_WEIGHT = float(os.getenv('DISCOVER_SKILL_WEIGHT', '0.6'))
+FOLLOW_WEIGHT = float(os.getenv('DISCOVER_FOLLOW_WEIGHT', '0.25'))
+RECENCY_WEIGHT = float(os.getenv('DISCOVER_RECENCY_WEIGHT', '0.15'))
+
+ITEM_TYPES = ('project', 'person', 'hackathon')
+
+
+def _terms(*lists):
+    """Normalised skill/tag terms from JSONB lists (or plain strings)."""
+    terms = set()
+    for values in lists:
+        if isinstance(values, str):
+            values = [values]
+        for value in values or ():
+            if isinstance(value, str) and value.strip():
+                terms.add(value.strip().lower())
+    return terms
+
+
+class DiscoverIndex:
+    """Immutable snapshot of every discoverable item as NumPy arrays.
+
+    Skill/tag terms are stored as a sparse CSR matrix (indptr, indices, data)
+    of idf weights with L2-normalised rows, so scoring a viewer against the
+    whole catalogue is one gather plus one bincount over the non-zeros.
+    """
+
+    def __init__(self, items, now):
+        # items: [(type, id, owner clerkId, timestamp, terms)]
+        self.built_at = now
+        self.types = np.array([ITEM_TYPES.index(item[0]) for item in items], dtype=np.int8)
+        self.ids = [item[1] for item in items]
+        owners = {}
+        self.owner_index = np.array([owners.setdefault(item[2], len(owners)) for item in items], dtype=np.int32)
+        self.owners = owners
+
+        timestamps = np.array([item[3].timestamp() if item[3] else 0.0 for item in items], dtype=np.float64)
+        # Projects and people decay with age; hackathons score higher the sooner they start
+        age_days = np.abs(now.timestamp() - timestamps) / 86400
+        self.recency = np.power(0.5, age_days / DISCOVER_RECENCY_HALF_LIFE_DAYS)
+
+        vocabulary = {}
+        rows = [[vocabulary.setdefault(term, len(vocabulary)) for term in item[4]] for item in items]
+        self.vocabulary = vocabulary
+        document_frequency = np.zeros(len(vocabulary), dtype=np.float64)
+        for row in rows:
+            document_frequency[row] += 1
+        self.idf = np.log((1 + len(items)) / (1 + document_frequency)) + 1
+
+        self.indptr = np.zeros(len(items) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(row) for row in rows])
+        self.indices = np.fromiter((term for row in rows for term in row), dtype=np.int32,
+                                   count=int(self.indptr[-1]))
+        self.entry_rows = np.repeat(np.arange(len(items), dtype=np.int32), np.diff(self.indptr))
+        weights = self.idf[self.indices]
+        norms = np.sqrt(np.bincount(self.entry_rows, weights=weights * weights, minlength=len(items)))
+        self.data = weights / np.where(norms > 0, norms, 1)[self.entry_rows]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def skill_scores(self, terms):
+        """Cosine similarity of every item to a viewer's term set."""
+        viewer = np.zeros(len(self.vocabulary), dtype=np.float64)
+        columns = [self.vocabulary[term] for term in terms if term in self.vocabulary]
+        if not columns:
+            return np.zeros(len(self))
+        viewer[columns] = self.idf[columns]
+        viewer /= np.linalg.norm(viewer)
+        return np.bincount(self.entry_rows, weights=self.data * viewer[self.indices], minlength=len(self))
+
+    def rank(self, viewer_id, terms, followed, second_degree, types, k):
+        """Top-k [(type, id, score)] for a viewer, best first."""
+        proximity = np.zeros(len(self.owners), dtype=np.float64)
+        proximity[[self.owners[owner] for owner in second_degree if owner in self.owners]] = 0.5
+        followed_owners = [self.owners[owner] for owner in followed if owner in self.owners]
+        proximity[followed_owners] = 1.0
+
+        scores = SKILL_WEIGHT * self.skill_scores(terms) \
+            + FOLLOW_WEIGHT * proximity[self.owner_index] \
+            + RECENCY_WEIGHT * self.recency
+
+        excluded = np.zeros(len(self.owners), dtype=bool)
+        if viewer_id in self.owners:
+            excluded[self.owners[viewer_id]] = True
+        hidden = excluded[self.owner_index]
+        # People the viewer already follows are not a discovery
+        followed_mask = np.zeros(len(self.owners), dtype=bool)
+        followed_mask[followed_owners] = True
+        hidden |= followed_mask[self.owner_index] & (self.types == ITEM_TYPES.index('person'))
+        if types != ITEM_TYPES:
+            hidden |= ~np.isin(self.types, [ITEM_TYPES.index(item_type) for item_type in types])
+        scores[hidden] = -np.inf
+
+        candidates = int(np.count_nonzero(~hidden))
+        k = min(k, candidates)
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(ITEM_TYPES[self.types[i]], self.ids[i], round(float(scores[i]), 4)) for i in top]
+
+
+def catalogue_fingerprint():
+    """Row counts and newest update times of everything the index is built from."""
+    fingerprint = (
+        db.session.query(db.func.count(Project.id), db.func.max(Project.updatedAt))
+        .filter(Project.project_status == 'open').one(),
+        db.session.query(db.func.count(UserDetails.id), db.func.max(UserDetails.updatedAt)).one(),
+        db.session.query(db.func.count(Hackathon.id), db.func.max(Hackathon.updated_at))
+        .filter(Hackathon.status.in_(['approved', 'live'])).one()
+    )
+    db.session.commit()
+    return tuple(tuple(row) for row in fingerprint)
+
+
+def build_discover_index():
+    """Load every discoverable project, person and hackathon into a DiscoverIndex."""
+    now = datetime.utcnow()
+    items = [
+        ('project', project_id, owner, created_at, _terms(tags, skills))
+        for project_id, owner, created_at, tags, skills in db.session.query(
+            Project.id, Project.clerkId, Project.createdAt, Project.tags, Project.skills_required
+        ).filter(Project.project_status == 'open')
+    ]
+    items += [
+        ('person', clerk_id, clerk_id, updated_at, _terms(skills, tags))
+        for clerk_id, updated_at, skills, tags in db.session.query(
+            UserDetails.clerkId, UserDetails.updatedAt, UserDetails.skills, UserDetails.tags
+        )
+    ]
+    items += [
+        ('hackathon', hackathon_id, organiser, start_date, _terms(tags, themes, category))
+        for hackathon_id, organiser, start_date, tags, themes, category in db.session.query(
+            Hackathon.id, Hackathon.organiser_clerkId, Hackathon.start_date, Hackathon.tags,
+            Hackathon.themes, Hackathon.category
+        ).filter(Hackathon.status.in_(['approved', 'live']), Hackathon.end_date >= now)
+    ]
+    db.session.commit()
+    return DiscoverIndex(items, now)
+
+
+class DiscoverService:
+    """Per-process discover index plus a cache of each viewer's ranked top-K.
+
+    The first index is built by a background thread at startup, and requests
+    get None until it is ready rather than waiting for it. A scheduler job
+    rebuilds the index when the catalogue has changed; a rebuild swaps in a
+    new snapshot but leaves cached rankings alone, so a viewer keeps paging
+    through the same ranking until it expires. Pages are sliced out of the
+    cached ranking, so paging costs no scoring at all.
+    """
+
+    def __init__(self, top_k=DISCOVER_TOP_K):
+        self.top_k = top_k
+        self.index = None
+        self.fingerprint = None
+        self.rankings = TTLCache(DISCOVER_CACHE_SIZE, DISCOVER_CACHE_TTL)
+        self._build_lock = threading.Lock()
+        self._thread = None
+        self.last_build_ms = None
+        self.skipped_refreshes = 0
+
+    def init_app(self, app):
+        """Build the first index in the background."""
+        def build():
+            with app.app_context():
+                try:
+                    self.refresh()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Initial discover index build failed; the scheduler will retry")
+
+        self._thread = threading.Thread(target=build, name='discover-index', daemon=True)
+        self._thread.start()
+
+    @property
+    def ready(self):
+        return self.index is not None
+
+    def refresh(self):
+        """Rebuild the index unless the catalogue is unchanged; returns the new index or None."""
+        with self._build_lock:
+            fingerprint = catalogue_fingerprint()
+            index = self.index
+            if index is not None and fingerprint == self.fingerprint \
+                    and datetime.utcnow() - index.built_at < timedelta(minutes=DISCOVER_INDEX_MAX_AGE_MINUTES):
+                self.skipped_refreshes += 1
+                return None
+            started = time.perf_counter()
+            self.index = build_discover_index()
+            self.fingerprint = fingerprint
+            self.last_build_ms = round((time.perf_counter() - started) * 1000, 1)
+            return self.index
+
+    def ranking(self, viewer_id, types=ITEM_TYPES):
+        """Cached top-K [(type, id, score)] for viewer_id, or None while no index is built yet."""
+        index = self.index
+        if index is None:
+            return None
+        return self.rankings.get_or_load((viewer_id, types), lambda: self._rank(index, viewer_id, types))
+
+    def _rank(self, index, viewer_id, types):
+        profile = db.session.query(UserDetails.skills, UserDetails.tags)\
+            .filter(UserDetails.clerkId == viewer_id).first()
+        terms = _terms(*profile) if profile else set()
+        followed = {followed_id for followed_id, in db.session.query(Follow.followed_id)
+                    .filter(Follow.follower_id == viewer_id)}
+        second_degree = set()
+        if followed:
+            second_degree = {followed_id for followed_id, in db.session.query(Follow.followed_id)
+                             .filter(Follow.follower_id.in_(followed), Follow.followed_id != viewer_id)
+                             .distinct()
+                             .limit(DISCOVER_MAX_SECOND_DEGREE)}
+        return index.rank(viewer_id, terms, followed, second_degree - followed, types, self.top_k)
+
+    def stats(self):
+        index = self.index
+        return {
+            'ready': index is not None,
+            'items': len(index) if index else 0,
+            'terms': len(index.vocabulary) if index else 0,
+            'built_at': index.built_at.isoformat() if index else None,
+            'last_build_ms': self.last_build_ms,
+            'skipped_refreshes': self.skipped_refreshes,
+            'rankings': self.rankings.stats()
+        }
+
+
+def load_discover_items(ranked):
+    """Serialise a page of ranked (type, id, score) entries with one query per type."""
+    wanted = {item_type: [item_id for entry_type, item_id, _ in ranked if entry_type == item_type]
+              for item_type in ITEM_TYPES}
+    found = {}
+    if wanted['project']:
+        found.update((('project', project.id), project.to_dict())
+                     for project in Project.query.options(db.selectinload(Project.chat))
+                     .filter(Project.id.in_(wanted['project'])))
+    if wanted['person']:
+        found.update((('person', person.clerkId), {
+            'clerkId': person.clerkId,
+            'name': person.name,
+            'role': person.role,
+            'bio': person.bio,
+            'city': person.city,
+            'country': person.country,
+            'skills': person.skills,
+            'tags': person.tags,
+            'verified': person.verified
+        }) for person in UserDetails.query.filter(UserDetails.clerkId.in_(wanted['person'])))
+    if wanted['hackathon']:
+        found.update((('hackathon', hackathon.id), hackathon.to_dict())
+                     for hackathon in Hackathon.query.filter(Hackathon.id.in_(wanted['hackathon'])))
+    # Items deleted since the index was built are skipped
+    return [{'type': item_type, 'score': score, 'item': found[(item_type, item_id)]}
+            for item_type, item_id, score in ranked if (item_type, item_id) in found]
+
+
+discover_service = DiscoverService()
@@ -3,10 +3,93 @@ from config import db
 from blueprints.projects.models import Project
 from blueprints.auth.models import User
 from flasgger import swag_from
-from blueprints.feed.models import FeedRequestProject, FeedRequestPerson
+from collections import Counter
+from sqlalchemy import and_, select, union_all, literal, tuple_, any_, exists
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from blueprints.feed.models import FeedRequestProject, FeedRequestPerson, FeedRequestCount
+from blueprints.chat.models import Chat
+from blueprints.feed.discover import discover_service, load_discover_items, ITEM_TYPES
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, parse_limit, encode_source_cursor, decode_source_cursor
 
 feed_bp = Blueprint('feed_bp', __name__)
 
+REQUEST_STATUSES = ('pending', 'approved', 'rejected')
+MAX_BULK_UPDATE = 1000  # request ids per /bulk_update_requests call
+# request_type -> model; equal created_at values are ordered by request_type descending
+REQUEST_SOURCES = {'project': FeedRequestProject, 'person': FeedRequestPerson}
+
+
+def _after_cursor(model, source, cursor):
+    """Rows of model that sort after cursor in (created_at, request_type, id) descending order."""
+    created_at, cursor_source, row_id = cursor
+    if source > cursor_source:
+        return model.created_at < created_at
+    if source < cursor_source:
+        return model.created_at <= created_at
+    return tuple_(model.created_at, model.id) < (created_at, row_id)
+
+
+def _request_page(user_column, clerk_id):
+    """One keyset page of a user's feed requests across both request tables.
+
+    Every (table, status) pair is a UNION ALL branch that reads at most
+    limit + 1 rows from its (user, status, created_at, id) index range, so only
+    the branch heads are sorted, never the user's whole history.
+    Returns (payload, None) or (None, error response).
+    """
+    status = request.args.get('status')
+    if status and status not in REQUEST_STATUSES:
+        return None, (jsonify({"message": "Invalid status"}), 400)
+    limit = parse_limit(request.args.get('limit', type=int))
+    before = request.args.get('before')
+    try:
+        cursor = decode_source_cursor(before) if before else None
+    except ValueError as e:
+        return None, (jsonify({"message": str(e)}), 400)
+
+    branches = []
+    for source, model in REQUEST_SOURCES.items():
+        project_id = model.project_id if source == 'project' else db.cast(db.null(), db.Integer)
+        for branch_status in ([status] if status else REQUEST_STATUSES):
+            conditions = [getattr(model, user_column) == clerk_id, model.status == branch_status]
+            if cursor:
+                conditions.append(_after_cursor(model, source, cursor))
+            branches.append(
+                select(model.id, literal(source).label('request_type'), project_id.label('project_id'),
+                       model.clerkid_sender, model.clerkid_receiver, model.message, model.created_at,
+                       model.status)
+                .where(and_(*conditions))
+                .order_by(model.created_at.desc(), model.id.desc())
+                .limit(limit + 1)
+            )
+    inbox = union_all(*branches).subquery()
+    rows = db.session.execute(
+        select(inbox)
+        .order_by(inbox.c.created_at.desc(), inbox.c.request_type.desc(), inbox.c.id.desc())
+        .limit(limit + 1)
+    ).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_source_cursor(last.created_at, last.request_type, last.id)
+    return {
+        'requests': [{
+            'id': row.id,
+            'request_type': row.request_type,
+            'project_id': row.project_id,
+            'clerkid_sender': row.clerkid_sender,
+            'clerkid_receiver': row.clerkid_receiver,
+            'message': row.message,
+            'created_at': row.created_at,
+            'status': row.status
+        } for row in rows],
+        'next_cursor': next_cursor,
+        'has_more': has_more
+    }, None
+
 # Route to send a feed request
 @swag_from({
     'tags': ['Feed Requests'],
@@ -38,6 +121,9 @@ feed_bp = Blueprint('feed_bp', __name__)
         },
         '404': {
             'description': 'User or Project not found'
+        },
+        '409': {
+            'description': 'The sender already has a pending request of this kind to the receiver'
         }
     }
 })
@@ -49,35 +135,45 @@ def send_request():
     receiver_clerkId = data.get('receiver_clerkId')
     message = data.get('message', '')
 
-    sender = User.query.filter_by(clerkId=sender_clerkId).first()
-    receiver = User.query.filter_by(clerkId=receiver_clerkId).first()
+    model = REQUEST_SOURCES.get(request_type)
+    if not model:
+        return jsonify({"message": "Invalid request_type"}), 400
+    project_id = data.get('project_id')
+    if request_type == 'project' and not project_id:
+        return jsonify({"message": "project_id is required for project requests"}), 400
 
-    if not sender or not receiver:
+    # Sender, receiver and project validated in one round trip
+    sender_exists, receiver_exists, project_exists = db.session.execute(select(
+        exists().where(User.clerkId == sender_clerkId),
+        exists().where(User.clerkId == receiver_clerkId),
+        exists().where(Project.id == project_id) if request_type == 'project' else literal(True)
+    )).one()
+    if not sender_exists or not receiver_exists:
         return jsonify({"message": "Sender or receiver not found"}), 404
+    if not project_exists:
+        return jsonify({"message": "Project not found"}), 404
 
+    values = {
+        'clerkid_sender': sender_clerkId,
+        'clerkid_receiver': receiver_clerkId,
+        'message': message
+    }
+    conflict_columns = ['clerkid_sender', 'clerkid_receiver']
     if request_type == 'project':
-        project_id = data.get('project_id')
-        if not project_id:
-            return jsonify({"message": "project_id is required for project requests"}), 400
-        project = Project.query.get(project_id)
-        if not project:
-            return jsonify({"message": "Project not found"}), 404
-        feed_request = FeedRequestProject(
-            project_id=project_id,
-            clerkid_sender=sender_clerkId,
-            clerkid_receiver=receiver_clerkId,
-            message=message
-        )
-    elif request_type == 'person':
-        feed_request = FeedRequestPerson(
-            clerkid_sender=sender_clerkId,
-            clerkid_receiver=receiver_clerkId,
-            message=message
-        )
-    else:
-        return jsonify({"message": "Invalid request_type"}), 400
+        values['project_id'] = project_id
+        conflict_columns.insert(0, 'project_id')
+    # The partial unique index on pending requests turns repeats into a no-op
+    inserted = db.session.execute(
+        pg_insert(model.__table__)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=conflict_columns, index_where=db.text("status = 'pending'"))
+        .returning(model.__table__.c.id)
+    ).first()
+    if inserted is None:
+        db.session.rollback()
+        return jsonify({"message": "A pending request already exists"}), 409
 
-    db.session.add(feed_request)
+    FeedRequestCount.adjust(receiver_clerkId, request_type, 'pending', 1)
     db.session.commit()
     return jsonify({"message": "Feed request sent successfully"}), 201
 
@@ -91,27 +187,59 @@ def send_request():
             'in': 'path',
             'required': True,
             'type': 'string'
+        },
+        {
+            'name': 'status',
+            'in': 'query',
+            'required': False,
+            'type': 'string',
+            'enum': ['pending', 'approved', 'rejected']
+        },
+        {
+            'name': 'before',
+            'in': 'query',
+            'required': False,
+            'type': 'string',
+            'description': 'next_cursor from the previous page'
+        },
+        {
+            'name': 'limit',
+            'in': 'query',
+            'required': False,
+            'type': 'integer',
+            'description': f'Page size (default {DEFAULT_PAGE_SIZE}, max {MAX_PAGE_SIZE})'
         }
     ],
     'responses': {
         '200': {
-            'description': 'List of feed requests',
+            'description': 'Page of project and person requests, newest first',
             'schema': {
-                'type': 'array',
-                'items': {
-                    'type': 'object',
-                    'properties': {
-                        'id': {'type': 'integer'},
-                        'project_id': {'type': 'integer'},
-                        'clerkid_sender': {'type': 'string'},
-                        'clerkid_receiver': {'type': 'string'},
-                        'message': {'type': 'string'},
-                        'created_at': {'type': 'string'},
-                        'status': {'type': 'string'}
-                    }
+                'type': 'object',
+                'properties': {
+                    'requests': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'id': {'type': 'integer'},
+                                'request_type': {'type': 'string', 'enum': ['project', 'person']},
+                                'project_id': {'type': 'integer'},
+                                'clerkid_sender': {'type': 'string'},
+                                'clerkid_receiver': {'type': 'string'},
+                                'message': {'type': 'string'},
+                                'created_at': {'type': 'string'},
+                                'status': {'type': 'string'}
+                            }
+                        }
+                    },
+                    'next_cursor': {'type': 'string'},
+                    'has_more': {'type': 'boolean'}
                 }
             }
         },
+        '400': {
+            'description': 'Invalid status or cursor'
+        },
         '404': {
             'description': 'Receiver not found'
         }
@@ -123,11 +251,10 @@ def get_requests(receiver_clerkId):
     if not receiver:
         return jsonify({"message": "Receiver not found"}), 404
 
-    project_requests = FeedRequestProject.query.filter_by(clerkid_receiver=receiver_clerkId).all()
-    person_requests = FeedRequestPerson.query.filter_by(clerkid_receiver=receiver_clerkId).all()
-
-    requests = [req.to_dict() for req in project_requests] + [req.to_dict() for req in person_requests]
-    return jsonify(requests), 200
+    page, error = _request_page('clerkid_receiver', receiver_clerkId)
+    if error:
+        return error
+    return jsonify(page), 200
 
 # Route to get feed requests by sender's clerkId
 @swag_from({
@@ -139,27 +266,59 @@ def get_requests(receiver_clerkId):
             'in': 'path',
             'required': True,
             'type': 'string'
+        },
+        {
+            'name': 'status',
+            'in': 'query',
+            'required': False,
+            'type': 'string',
+            'enum': ['pending', 'approved', 'rejected']
+        },
+        {
+            'name': 'before',
+            'in': 'query',
+            'required': False,
+            'type': 'string',
+            'description': 'next_cursor from the previous page'
+        },
+        {
+            'name': 'limit',
+            'in': 'query',
+            'required': False,
+            'type': 'integer',
+            'description': f'Page size (default {DEFAULT_PAGE_SIZE}, max {MAX_PAGE_SIZE})'
         }
     ],
     'responses': {
         '200': {
-            'description': 'List of feed requests',
+            'description': 'Page of project and person requests, newest first',
             'schema': {
-                'type': 'array',
-                'items': {
-                    'type': 'object',
-                    'properties': {
-                        'id': {'type': 'integer'},
-                        'project_id': {'type': 'integer'},
-                        'clerkid_sender': {'type': 'string'},
-                        'clerkid_receiver': {'type': 'string'},
-                        'message': {'type': 'string'},
-                        'created_at': {'type': 'string'},
-                        'status': {'type': 'string'}
-                    }
+                'type': 'object',
+                'properties': {
+                    'requests': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'id': {'type': 'integer'},
+                                'request_type': {'type': 'string', 'enum': ['project', 'person']},
+                                'project_id': {'type': 'integer'},
+                                'clerkid_sender': {'type': 'string'},
+                                'clerkid_receiver': {'type': 'string'},
+                                'message': {'type': 'string'},
+                                'created_at': {'type': 'string'},
+                                'status': {'type': 'string'}
+                            }
+                        }
+                    },
+                    'next_cursor': {'type': 'string'},
+                    'has_more': {'type': 'boolean'}
                 }
             }
         },
+        '400': {
+            'description': 'Invalid status or cursor'
+        },
         '404': {
             'description': 'Sender not found'
         }
@@ -171,11 +330,10 @@ def get_requests_by_sender(sender_clerkId):
     if not sender:
         return jsonify({"message": "Sender not found"}), 404
 
-    project_requests = FeedRequestProject.query.filter_by(clerkid_sender=sender_clerkId).all()
-    person_requests = FeedRequestPerson.query.filter_by(clerkid_sender=sender_clerkId).all()
-
-    requests = [req.to_dict() for req in project_requests] + [req.to_dict() for req in person_requests]
-    return jsonify(requests), 200
+    page, error = _request_page('clerkid_sender', sender_clerkId)
+    if error:
+        return error
+    return jsonify(page), 200
 
 # Route to approve or reject a feed request
 @swag_from({
@@ -223,17 +381,305 @@ def update_request(request_id):
     if status not in ['approved', 'rejected']:
         return jsonify({"message": "Invalid status"}), 400
 
-    if request_type == 'project':
-        feed_request = FeedRequestProject.query.get(request_id)
-    elif request_type == 'person':
-        feed_request = FeedRequestPerson.query.get(request_id)
-    else:
+    model = REQUEST_SOURCES.get(request_type)
+    if not model:
         return jsonify({"message": "Invalid request_type"}), 400
 
+    # Row lock so concurrent updates cannot both move the counter from the same old status
+    feed_request = db.session.get(model, request_id, with_for_update=True)
     if not feed_request:
         return jsonify({"message": "Feed request not found"}), 404
 
-    feed_request.status = status
+    if feed_request.status != status:
+        FeedRequestCount.adjust(feed_request.clerkid_receiver, request_type, feed_request.status, -1)
+        FeedRequestCount.adjust(feed_request.clerkid_receiver, request_type, status, 1)
+        feed_request.status = status
     db.session.commit()
     return jsonify({"message": "Feed request status updated successfully"}), 200
 
+# Route to approve or reject many feed requests at once
+@swag_from({
+    'tags': ['Feed Requests'],
+    'summary': 'Approve or reject many feed requests of one receiver',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'receiver_clerkId': {'type': 'string'},
+                    'status': {'type': 'string', 'enum': ['approved', 'rejected']},
+                    'project_ids': {'type': 'array', 'items': {'type': 'integer'}},
+                    'person_ids': {'type': 'array', 'items': {'type': 'integer'}},
+                    'add_to_chat': {
+                        'type': 'boolean',
+                        'default': False,
+                        'description': 'Add approved project applicants to the project chat'
+                    }
+                },
+                'required': ['receiver_clerkId', 'status']
+            }
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Ids that changed status; ids not received by receiver_clerkId, missing '
+                           'or already in the target status are listed under unchanged',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'updated': {
+                        'type': 'object',
+                        'properties': {
+                            'project': {'type': 'array', 'items': {'type': 'integer'}},
+                            'person': {'type': 'array', 'items': {'type': 'integer'}}
+                        }
+                    },
+                    'unchanged': {
+                        'type': 'object',
+                        'properties': {
+                            'project': {'type': 'array', 'items': {'type': 'integer'}},
+                            'person': {'type': 'array', 'items': {'type': 'integer'}}
+                        }
+                    },
+                    'added_to_chat': {'type': 'integer'}
+                }
+            }
+        },
+        '400': {
+            'description': 'Invalid status or id lists'
+        }
+    }
+})
+@feed_bp.route('/bulk_update_requests', methods=['PUT'])
+def bulk_update_requests():
+    data = request.get_json()
+    receiver_clerkId = data.get('receiver_clerkId')
+    status = data.get('status')
+
+    if status not in ['approved', 'rejected']:
+        return jsonify({"message": "Invalid status"}), 400
+    ids = {}
+    for request_type in REQUEST_SOURCES:
+        requested = data.get(f'{request_type}_ids') or []
+        if not isinstance(requested, list) or not all(
+                isinstance(request_id, int) and not isinstance(request_id, bool) for request_id in requested):
+            return jsonify({"message": f"{request_type}_ids must be a list of integers"}), 400
+        ids[request_type] = sorted(set(requested))
+    if not receiver_clerkId or sum(len(requested) for requested in ids.values()) > MAX_BULK_UPDATE:
+        return jsonify({"message": f"receiver_clerkId and at most {MAX_BULK_UPDATE} ids are required"}), 400
+
+    updated = {}
+    approved_applicants = []
+    for request_type, model in REQUEST_SOURCES.items():
+        updated[request_type] = []
+        if not ids[request_type]:
+            continue
+        table = model.__table__
+        # Lock the matching rows and remember their old status for the counters
+        requested = db.bindparam(f'{request_type}_ids', ids[request_type], type_=ARRAY(db.Integer))
+        old = select(table.c.id, table.c.status)\
+            .where(table.c.id == any_(requested),
+                   table.c.clerkid_receiver == receiver_clerkId,
+                   table.c.status != status)\
+            .with_for_update()\
+            .subquery('old')
+        returning = [table.c.id, old.c.status, table.c.clerkid_sender]
+        if request_type == 'project':
+            returning.append(table.c.project_id)
+        rows = db.session.execute(
+            db.update(table)
+            .where(table.c.id == old.c.id)
+            .values(status=status)
+            .returning(*returning)
+        ).all()
+        for old_status, count in Counter(row[1] for row in rows).items():
+            FeedRequestCount.adjust(receiver_clerkId, request_type, old_status, -count)
+        if rows:
+            FeedRequestCount.adjust(receiver_clerkId, request_type, status, len(rows))
+        updated[request_type] = sorted(row[0] for row in rows)
+        if request_type == 'project':
+            approved_applicants = [(row[3], row[2]) for row in rows]
+
+    added_to_chat = 0
+    if status == 'approved' and data.get('add_to_chat') and approved_applicants:
+        # Only chats of projects the receiver owns
+        rooms = dict(db.session.query(Project.id, Project.chat_room_id).filter(
+            Project.id.in_({project_id for project_id, _ in approved_applicants}),
+            Project.clerkId == receiver_clerkId,
+            Project.chat_room_id.isnot(None)
+        ))
+        added_to_chat = Chat.add_members([
+            (rooms[project_id], applicant) for project_id, applicant in approved_applicants
+            if project_id in rooms
+        ])
+    db.session.commit()
+
+    return jsonify({
+        'updated': updated,
+        'unchanged': {
+            request_type: sorted(set(ids[request_type]) - set(updated[request_type]))
+            for request_type in REQUEST_SOURCES
+        },
+        'added_to_chat': added_to_chat
+    }), 200
+
+# Route to get the request badge counts for a receiver
+@swag_from({
+    'tags': ['Feed Requests'],
+    'summary': 'Count the feed requests a receiver has, by type and status',
+    'parameters': [
+        {
+            'name': 'receiver_clerkId',
+            'in': 'path',
+            'required': True,
+            'type': 'string'
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Counts per request type and status',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'project': {
+                        'type': 'object',
+                        'properties': {status: {'type': 'integer'} for status in REQUEST_STATUSES}
+                    },
+                    'person': {
+                        'type': 'object',
+                        'properties': {status: {'type': 'integer'} for status in REQUEST_STATUSES}
+                    },
+                    'total_pending': {'type': 'integer'}
+                }
+            }
+        }
+    }
+})
+@feed_bp.route('/request_counts/<string:receiver_clerkId>', methods=['GET'])
+def get_request_counts(receiver_clerkId):
+    counts = {source: {status: 0 for status in REQUEST_STATUSES} for source in REQUEST_SOURCES}
+    # At most len(REQUEST_SOURCES) * len(REQUEST_STATUSES) rows off the primary key
+    for request_type, status, count in db.session.query(
+            FeedRequestCount.request_type, FeedRequestCount.status, FeedRequestCount.count
+    ).filter(FeedRequestCount.clerkid_receiver == receiver_clerkId):
+        counts.setdefault(request_type, {})[status] = count
+    counts['total_pending'] = sum(counts[source].get('pending', 0) for source in REQUEST_SOURCES)
+    return jsonify(counts), 200
+
+# Route to get the ranked discover feed for a viewer
+@swag_from({
+    'tags': ['Discover'],
+    'summary': 'Ranked projects, people and upcoming hackathons for a viewer',
+    'description': 'Items are scored by skill/tag overlap with the viewer\'s profile, follow graph '
+                   'proximity of their owner and recency. The viewer\'s top results are cached for a '
+                   'few minutes, so paging through them is cheap and stable: index refreshes only '
+                   'affect rankings computed after them.',
+    'parameters': [
+        {
+            'name': 'clerkId',
+            'in': 'path',
+            'required': True,
+            'type': 'string'
+        },
+        {
+            'name': 'types',
+            'in': 'query',
+            'required': False,
+            'type': 'string',
+            'description': 'Comma-separated subset of project, person, hackathon (default all)'
+        },
+        {
+            'name': 'limit',
+            'in': 'query',
+            'required': False,
+            'type': 'integer',
+            'description': f'Page size (default {DEFAULT_PAGE_SIZE}, max {MAX_PAGE_SIZE})'
+        },
+        {
+            'name': 'offset',
+            'in': 'query',
+            'required': False,
+            'type': 'integer',
+            'default': 0
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Page of ranked items, best first',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'items': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'type': {'type': 'string', 'enum': list(ITEM_TYPES)},
+                                'score': {'type': 'number'},
+                                'item': {'type': 'object'}
+                            }
+                        }
+                    },
+                    'next_offset': {'type': 'integer'}
+                }
+            }
+        },
+        '400': {
+            'description': 'Invalid types'
+        },
+        '503': {
+            'description': 'The index is still being built after a restart; retry after Retry-After seconds'
+        }
+    }
+})
+@feed_bp.route('/discover/<string:clerkId>', methods=['GET'])
+def discover(clerkId):
+    types = request.args.get('types')
+    if types:
+        requested = {item_type.strip() for item_type in types.split(',') if item_type.strip()}
+        if not requested or not requested <= set(ITEM_TYPES):
+            return jsonify({"message": f"types must be a subset of {', '.join(ITEM_TYPES)}"}), 400
+        types = tuple(item_type for item_type in ITEM_TYPES if item_type in requested)
+    else:
+        types = ITEM_TYPES
+    limit = parse_limit(request.args.get('limit', type=int))
+    offset = max(request.args.get('offset', 0, type=int), 0)
+
+    ranking = discover_service.ranking(clerkId, types)
+    if ranking is None:
+        response = jsonify({"message": "Discover feed is starting up, try again shortly"})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    page = ranking[offset:offset + limit]
+    return jsonify({
+        'items': load_discover_items(page),
+        'next_offset': offset + limit if offset + limit < len(ranking) else None
+    }), 200
+
+@swag_from({
+    'tags': ['Discover'],
+    'summary': 'Discover index and ranking cache metrics for this worker',
+    'responses': {
+        '200': {
+            'description': 'Index size, last build time and ranking cache counters',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'ready': {'type': 'boolean'},
+                    'items': {'type': 'integer'},
+                    'terms': {'type': 'integer'},
+                    'built_at': {'type': 'string'},
+                    'last_build_ms': {'type': 'number'},
+                    'skipped_refreshes': {'type': 'integer'},
+                    'rankings': {'type': 'object'}
+                }
+            }
+        }
+    }
+})
+@feed_bp.route('/discover_metrics', methods=['GET'])
+def discover_metrics():
+    return jsonify(discover_service.stats()), 200
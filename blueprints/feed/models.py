@@ -1,4 +1,5 @@
 from config import db
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 class FeedRequestProject(db.Model):
     __tablename__ = 'feed_requests_projects'
@@ -10,6 +11,15 @@ class FeedRequestProject(db.Model):
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
     status = db.Column(db.String(20), nullable=False, default='pending')
 
+    __table_args__ = (
+        # One index range per (user, status) serves a keyset page of the inbox / outbox
+        db.Index('ix_feed_requests_projects_receiver_status_created', 'clerkid_receiver', 'status', 'created_at', 'id'),
+        db.Index('ix_feed_requests_projects_sender_status_created', 'clerkid_sender', 'status', 'created_at', 'id'),
+        # At most one pending request per applicant and project; answered ones may repeat
+        db.Index('uq_feed_requests_projects_pending', 'project_id', 'clerkid_sender', 'clerkid_receiver',
+                 unique=True, postgresql_where=db.text("status = 'pending'")),
+    )
+
     project = db.relationship('Project', backref='feed_requests_projects')
     sender = db.relationship('User', foreign_keys=[clerkid_sender])
     receiver = db.relationship('User', foreign_keys=[clerkid_receiver])
@@ -34,6 +44,13 @@ class FeedRequestPerson(db.Model):
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
     status = db.Column(db.String(20), nullable=False, default='pending')
 
+    __table_args__ = (
+        db.Index('ix_feed_requests_people_receiver_status_created', 'clerkid_receiver', 'status', 'created_at', 'id'),
+        db.Index('ix_feed_requests_people_sender_status_created', 'clerkid_sender', 'status', 'created_at', 'id'),
+        db.Index('uq_feed_requests_people_pending', 'clerkid_sender', 'clerkid_receiver',
+                 unique=True, postgresql_where=db.text("status = 'pending'")),
+    )
+
     sender = db.relationship('User', foreign_keys=[clerkid_sender])
     receiver = db.relationship('User', foreign_keys=[clerkid_receiver])
 
@@ -48,3 +65,56 @@ class FeedRequestPerson(db.Model):
         }
 
 
+class FeedRequestCount(db.Model):
+    """Requests received per (receiver, request_type, status), for the inbox badge.
+
+    Kept in step by send_request and update_request in the same transaction as
+    the request row; rebuild_feed_request_counts() recomputes it from scratch.
+    """
+    __tablename__ = 'feed_request_counts'
+    clerkid_receiver = db.Column(db.String(255), db.ForeignKey('users.clerkId'), primary_key=True)
+    request_type = db.Column(db.String(20), primary_key=True)  # 'project' or 'person'
+    status = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def adjust(clerkid_receiver, request_type, status, delta):
+        """Atomically add delta to one counter, creating it on first use."""
+        stmt = pg_insert(FeedRequestCount.__table__).values(
+            clerkid_receiver=clerkid_receiver,
+            request_type=request_type,
+            status=status,
+            count=delta
+        )
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['clerkid_receiver', 'request_type', 'status'],
+            set_={'count': FeedRequestCount.__table__.c.count + stmt.excluded.count}
+        ))
+
+
+def rebuild_feed_request_counts():
+    """Recompute feed_request_counts from the request tables; returns the number of counters."""
+    counters = recount_feed_requests()
+    db.session.commit()
+    return counters
+
+
+def recount_feed_requests():
+    """Replace every counter with a fresh count; the caller commits.
+
+    SHARE ROW EXCLUSIVE waits for in-flight request writes (which adjust the
+    counters in the same transaction) and holds new ones off until commit, so
+    no adjustment is lost or counted twice; it also serialises rebuilds.
+    """
+    db.session.execute(db.text(
+        "LOCK TABLE feed_requests_projects, feed_requests_people IN SHARE ROW EXCLUSIVE MODE"
+    ))
+    db.session.execute(db.text("DELETE FROM feed_request_counts"))
+    return db.session.execute(db.text("""
+        INSERT INTO feed_request_counts (clerkid_receiver, request_type, status, count)
+        SELECT clerkid_receiver, 'project', status, count(*) FROM feed_requests_projects
+        GROUP BY clerkid_receiver, status
+        UNION ALL
+        SELECT clerkid_receiver, 'person', status, count(*) FROM feed_requests_people
+        GROUP BY clerkid_receiver, status
+    """)).rowcount
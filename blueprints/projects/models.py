@@ -1,7 +1,7 @@
 from config import db
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy import event
-from blueprints.chat.models import Chat
+from blueprints.chat.models import Chat, ChatParticipant, invalidate_membership
 
 class Project(db.Model):
     __tablename__ = 'projects'
@@ -91,11 +91,19 @@ def create_chat_room(mapper, connection, target):
     )
     
     # Create the chat room using raw SQL to avoid session conflicts
-    connection.execute(
+    chat_id = connection.execute(
         db.insert(Chat.__table__).values(
             room_id=chat_room_id,
             is_group=True,
-            participants=[target.clerkId],
+            participant_count=1,
             created_at=db.func.current_timestamp()
+        ).returning(Chat.__table__.c.id)
+    ).scalar_one()
+    connection.execute(
+        db.insert(ChatParticipant.__table__).values(
+            chat_id=chat_id,
+            clerk_id=target.clerkId,
+            role='owner'
         )
-    )
\ No newline at end of file
+    )
+    invalidate_membership(chat_room_id)
\ No newline at end of file
@@ -4,7 +4,7 @@ import random
 import string
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy import event
-from blueprints.chat.models import Chat
+from blueprints.chat.models import Chat, ChatParticipant, invalidate_membership
 
 class Team(db.Model):
     __tablename__ = 'teams'
@@ -84,18 +84,33 @@ class Team(db.Model):
 @event.listens_for(Team, 'after_insert')
 def create_team_chat(mapper, connection, target):
     chat_room_id = f"team-{target.id}"
+    # One participant row per member, in first-seen order, and a count that matches them
+    members = list(dict.fromkeys(target.members or []))
     connection.execute(
         db.update(Team)
         .where(Team.id == target.id)
         .values(chat_room_id=chat_room_id)
     )
-    connection.execute(
+    chat_id = connection.execute(
         db.insert(Chat.__table__).values(
             room_id=chat_room_id,
             is_group=True,
-            participants=target.members,
+            participant_count=len(members),
             created_at=db.func.current_timestamp(),
             team_id=target.id  # Link the chat to the team
+        ).returning(Chat.__table__.c.id)
+    ).scalar_one()
+    if members:
+        connection.execute(
+            db.insert(ChatParticipant.__table__),
+            [
+                {
+                    'chat_id': chat_id,
+                    'clerk_id': member,
+                    'role': 'owner' if member == target.leader_id else 'member'
+                }
+                for member in members
+            ]
         )
-    )
+    invalidate_membership(chat_room_id)
 
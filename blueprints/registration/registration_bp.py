@@ -135,9 +135,8 @@ def join_team():
 
         # Add user to the associated group chat (use chat_room_id)
         chat = Chat.query.filter_by(room_id=team.chat_room_id).first()
-        if chat and user.clerkId not in chat.participants:
-            chat.participants.append(user.clerkId)
-            flag_modified(chat, 'participants')
+        if chat:
+            chat.add_participant(user.clerkId)
 
         db.session.commit()
         return jsonify({'message': 'Joined team successfully', 'team': team.to_dict()}), 200
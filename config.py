@@ -1,5 +1,6 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
 import os
 from flasgger import Swagger
@@ -18,3 +19,9 @@ def configure_app(app: Flask):  # configures entire flask app
     
     db.init_app(app)  # link db instance to app instance
 
+    # Reverse proxies in front of the app; their X-Forwarded-For sets request.remote_addr. Defaults
+    # to the Heroku router; set 0 only when clients connect directly, or they can spoof their address
+    proxy_hops = int(os.getenv('TRUSTED_PROXY_HOPS', '1'))
+    if proxy_hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops)
+
@@ -0,0 +1,157 @@
+"""Idempotent schema upgrades for databases created before a model change.
+
+db.create_all() only creates missing tables; it never adds columns or
+indexes to tables that already exist. Each step below brings an existing
+table up to the current models and is a no-op on a fresh database.
+upgrade_schema() runs at startup right after create_all(), applies the steps
+not yet recorded in schema_migrations, in order, and holds an advisory lock
+so that only one gunicorn worker migrates while the others wait.
+"""
+import logging
+from config import db
+from blueprints.chat.models import SEARCH_CONFIG, copy_legacy_participants, recount_chat_participants
+from blueprints.feed.models import recount_feed_requests
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_LOCK_KEY = 741200  # pg_advisory_xact_lock key shared by every worker
+
+# (name, step) in the order they are applied; names are recorded once applied
+MIGRATIONS = []
+
+
+def migration(name):
+    def register(step):
+        MIGRATIONS.append((name, step))
+        return step
+    return register
+
+
+def _execute(*statements):
+    for statement in statements:
+        db.session.execute(db.text(statement))
+
+
+@migration('message_client_msg_id')
+def _message_client_msg_id():
+    _execute("ALTER TABLE message ADD COLUMN IF NOT EXISTS client_msg_id VARCHAR(255)")
+
+
+@migration('message_search_vector')
+def _message_search_vector():
+    # Adding a stored generated column rewrites the table once to fill it in
+    _execute(
+        f"""ALTER TABLE message ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+            GENERATED ALWAYS AS (to_tsvector('{SEARCH_CONFIG}', coalesce(content, ''))) STORED""",
+        "CREATE INDEX IF NOT EXISTS ix_message_search_vector ON message USING gin (search_vector)"
+    )
+
+
+@migration('chat_participant_count')
+def _chat_participant_count():
+    _execute("ALTER TABLE chat ADD COLUMN IF NOT EXISTS participant_count INTEGER NOT NULL DEFAULT 0")
+    recount_chat_participants()
+
+
+@migration('chat_participants_backfill')
+def _chat_participants_backfill():
+    # Once only: the legacy lists are frozen, so a rerun would re-add members who left
+    copy_legacy_participants()
+    recount_chat_participants()
+
+
+@migration('message_attachments')
+def _message_attachments():
+    _execute(
+        "ALTER TABLE message ADD COLUMN IF NOT EXISTS attachments JSONB",
+        "CREATE INDEX IF NOT EXISTS ix_message_attachments ON message USING gin (attachments jsonb_path_ops)"
+    )
+
+
+def _index_definition(name):
+    return db.session.execute(db.text("SELECT indexdef FROM pg_indexes WHERE indexname = :name"),
+                              {'name': name}).scalar()
+
+
+@migration('message_edits')
+def _message_edits():
+    _execute(
+        "ALTER TABLE message ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE message ADD COLUMN IF NOT EXISTS edited_at TIMESTAMP WITHOUT TIME ZONE",
+        "ALTER TABLE message ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITHOUT TIME ZONE",
+        "ALTER TABLE message ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITHOUT TIME ZONE"
+    )
+    # The history indexes leave tombstones out; databases from before edits have them unfiltered
+    for name, columns in (('ix_message_room_created_id', 'room_id, created_at, id'),
+                          ('ix_message_room_id_id', 'room_id, id')):
+        definition = _index_definition(name)
+        if definition and ' WHERE ' not in definition:
+            _execute(f"DROP INDEX {name}")
+        _execute(f"CREATE INDEX IF NOT EXISTS {name} ON message ({columns}) WHERE deleted_at IS NULL")
+    _execute("CREATE INDEX IF NOT EXISTS ix_message_room_updated ON message (room_id, updated_at, id) "
+             "WHERE updated_at IS NOT NULL")
+
+
+@migration('chat_retention')
+def _chat_retention():
+    _execute(
+        "ALTER TABLE chat ADD COLUMN IF NOT EXISTS retention_days INTEGER",
+        "ALTER TABLE chat ADD COLUMN IF NOT EXISTS retention_max_messages INTEGER",
+        "ALTER TABLE chat ADD COLUMN IF NOT EXISTS retention_checked_at TIMESTAMP WITHOUT TIME ZONE"
+    )
+
+
+@migration('feed_request_indexes')
+def _feed_request_indexes():
+    for table in ('feed_requests_projects', 'feed_requests_people'):
+        for role in ('receiver', 'sender'):
+            _execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_{role}_status_created "
+                     f"ON {table} (clerkid_{role}, status, created_at, id)")
+
+
+@migration('feed_request_counts_backfill')
+def _feed_request_counts_backfill():
+    # The counter table starts out empty next to requests that already exist
+    if db.session.execute(db.text("SELECT NOT EXISTS (SELECT 1 FROM feed_request_counts)")).scalar():
+        recount_feed_requests()
+
+
+@migration('feed_request_pending_unique')
+def _feed_request_pending_unique():
+    # Keep the oldest of any duplicate pending requests, then enforce one per key
+    deleted = 0
+    for table, key in (('feed_requests_projects', 'project_id, clerkid_sender, clerkid_receiver'),
+                       ('feed_requests_people', 'clerkid_sender, clerkid_receiver')):
+        deleted += db.session.execute(db.text(f"""
+            DELETE FROM {table} WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, row_number() OVER (PARTITION BY {key} ORDER BY id) AS position
+                    FROM {table} WHERE status = 'pending'
+                ) AS pending
+                WHERE position > 1
+            )
+        """)).rowcount
+        _execute(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{table}_pending ON {table} ({key}) "
+                 "WHERE status = 'pending'")
+    if deleted:
+        logger.info(f"Deleted {deleted} duplicate pending feed requests")
+        recount_feed_requests()
+
+
+def upgrade_schema():
+    """Apply pending MIGRATIONS in one transaction; returns the names applied."""
+    db.session.execute(db.text("SELECT pg_advisory_xact_lock(:key)"), {'key': MIGRATION_LOCK_KEY})
+    db.session.execute(db.text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name VARCHAR(255) PRIMARY KEY,
+            applied_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """))
+    applied = set(db.session.execute(db.text("SELECT name FROM schema_migrations")).scalars())
+    pending = [(name, step) for name, step in MIGRATIONS if name not in applied]
+    for name, step in pending:
+        logger.info(f"Applying schema migration {name}")
+        step()
+        db.session.execute(db.text("INSERT INTO schema_migrations (name) VALUES (:name)"), {'name': name})
+    db.session.commit()
+    return [name for name, _ in pending]
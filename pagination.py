@@ -0,0 +1,44 @@
+import base64
+from datetime import datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Clamp a requested page size into [1, maximum], falling back to default."""
+    if value is None:
+        return default
+    return max(1, min(value, maximum))
+
+
+def encode_cursor(created_at, row_id):
+    """Opaque keyset cursor for a (created_at, id) position."""
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for malformed cursors."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.fromisoformat(created_at), int(row_id)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+def encode_source_cursor(created_at, source, row_id):
+    """Keyset cursor for a UNION of tables whose ids overlap: (created_at, source, id)."""
+    raw = f"{created_at.isoformat()}|{source}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_source_cursor(cursor):
+    """Inverse of encode_source_cursor; raises ValueError for malformed cursors."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, source, row_id = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.fromisoformat(created_at), source, int(row_id)
+    except ValueError:
+        raise ValueError("Invalid cursor")
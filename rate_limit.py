@@ -0,0 +1,297 @@
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import request, jsonify
+from flasgger import swag_from
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() != 'false'
+# 'memory' keeps buckets per process (each gunicorn worker enforces its own limit);
+# 'sqlite' shares them between the workers on a host through a file on tmpfs
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory').lower()
+RATE_LIMIT_SQLITE_PATH = os.getenv('RATE_LIMIT_SQLITE_PATH', '/dev/shm/matchmycode-ratelimit.db')
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000'))  # buckets kept by the memory store
+
+
+def body_field(name):
+    """Bucket key taken from a JSON body field."""
+    return lambda: (request.get_json(silent=True) or {}).get(name)
+
+
+def client_address():
+    """The caller's address, or None while the peer is a proxy that ProxyFix does not trust.
+
+    Never the raw X-Forwarded-For, which clients can set to dodge their bucket;
+    behind TRUSTED_PROXY_HOPS proxies, ProxyFix has already put the real peer in
+    remote_addr. A forwarded request that ProxyFix did not see comes from a proxy
+    whose address every user shares, so it has no per-address bucket at all.
+    """
+    if 'X-Forwarded-For' in request.headers and 'werkzeug.proxy_fix.orig' not in request.environ:
+        return None
+    return request.remote_addr or 'unknown'
+
+
+class Limit:
+    """Token bucket: `rate` requests per `per` seconds, bursting up to `burst`.
+
+    key() names the bucket (falls back to the client address when it returns
+    nothing) and cost() how many tokens the request takes.
+    """
+
+    def __init__(self, scope, rate, per, burst=None, key=client_address, cost=None):
+        self.scope = scope
+        self.refill_rate = rate / per
+        self.burst = burst or rate
+        self.key = key
+        self.cost = cost or (lambda: 1)
+
+
+# Keyed by endpoint name ('<blueprint>.<view function>'). Body-field keys can be
+# spoofed by naming someone else, so every endpoint also has a per-address limit.
+RATE_LIMITS = {
+    'chat_bp.send_message': [
+        Limit('client', 20, 1, burst=40),
+        Limit('user', 5, 1, burst=10, key=body_field('sender_id')),
+        Limit('room', 20, 1, burst=40, key=body_field('room_id'))
+    ],
+    'chat_bp.send_message_batch': [
+        Limit('client', 500, 1, burst=1000,
+              cost=lambda: len((request.get_json(silent=True) or {}).get('messages') or []) or 1)
+    ],
+    'chat_bp.presence_heartbeat': [
+        Limit('client', 10, 1, burst=20),
+        Limit('user', 2, 1, burst=5, key=body_field('user_id'))
+    ],
+    'feed_bp.send_request': [
+        Limit('client', 30, 60),
+        Limit('user', 10, 60, key=body_field('sender_clerkId'))
+    ],
+    'follow_bp.follow_user': [
+        Limit('client', 60, 60),
+        Limit('user', 30, 60, key=body_field('follower_clerk_id'))
+    ]
+}
+
+
+def _refill(tokens, updated, now, refill_rate, burst):
+    return min(burst, tokens + max(now - updated, 0) * refill_rate)
+
+
+class MemoryBucketStore:
+    name = 'memory'
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take_all(self, requests):
+        """Spend tokens from every (key, refill_rate, burst, cost) bucket, or from none.
+
+        Returns the seconds each bucket needs before it can pay; all zeros
+        means the tokens were taken.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens = []
+            for key, refill_rate, burst, cost in requests:
+                current, updated = self._buckets.pop(key, (burst, now))
+                tokens.append(_refill(current, updated, now, refill_rate, burst))
+            waits = [max(cost - available, 0) / refill_rate
+                     for available, (_, refill_rate, _, cost) in zip(tokens, requests)]
+            paid = not any(waits)
+            for available, (key, _, _, cost) in zip(tokens, requests):
+                self._buckets[key] = (available - cost if paid else available, now)
+            # Dropping the least recently used bucket only ever refills it early
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return waits
+
+    def stats(self):
+        with self._lock:
+            return {'buckets': len(self._buckets)}
+
+
+class SQLiteBucketStore:
+    """Buckets shared by every worker on the host; one short write transaction per check."""
+    name = 'sqlite'
+    PURGE_EVERY = 1000  # checks between deletions of idle buckets
+    IDLE_SECONDS = 3600
+
+    def __init__(self, path=RATE_LIMIT_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._checks = 0
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def take_all(self, requests):
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            tokens = []
+            for key, refill_rate, burst, cost in requests:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                current, updated = row if row else (burst, now)
+                tokens.append(_refill(current, updated, now, refill_rate, burst))
+            waits = [max(cost - available, 0) / refill_rate
+                     for available, (_, refill_rate, _, cost) in zip(tokens, requests)]
+            paid = not any(waits)
+            conn.executemany(
+                "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                [(key, available - cost if paid else available, now)
+                 for available, (key, _, _, cost) in zip(tokens, requests)]
+            )
+            self._checks += 1
+            if self._checks % self.PURGE_EVERY == 0:
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - self.IDLE_SECONDS,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return waits
+
+    def stats(self):
+        count, = self._connection().execute("SELECT count(*) FROM buckets").fetchone()
+        return {'buckets': count, 'path': self.path}
+
+
+def create_bucket_store(name):
+    if name == 'memory':
+        return MemoryBucketStore()
+    if name == 'sqlite':
+        return SQLiteBucketStore()
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {name}")
+
+
+class RateLimiter:
+    """before_request hook enforcing RATE_LIMITS; over-limit requests get a 429 with Retry-After.
+
+    A request pays every limit of its endpoint or none of them, so being
+    refused by one bucket never drains the others. A request costing more
+    than a bucket can ever hold is refused with a 400 instead of a 429 it
+    could never recover from.
+    """
+
+    def __init__(self, limits=None, store=None, enabled=RATE_LIMIT_ENABLED):
+        self.limits = RATE_LIMITS if limits is None else limits
+        self.store = store
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._warned_proxy = False
+
+    def init_app(self, app):
+        if self.store is None:
+            self.store = create_bucket_store(RATE_LIMIT_BACKEND)
+        app.before_request(self.check)
+        app.add_url_rule('/rate-limit/metrics', 'rate_limit_metrics', self.metrics_view, methods=['GET'])
+
+    def check(self):
+        limits = self.limits.get(request.endpoint) if self.enabled else None
+        if not limits:
+            return None
+        buckets = []
+        enforced = []
+        for limit in limits:
+            cost = limit.cost()
+            if cost > limit.burst:
+                self._count(request.endpoint, 'rejected')
+                return jsonify({"error": f"Request costs {cost} rate limit tokens; "
+                                         f"at most {limit.burst:g} are allowed at once",
+                                "scope": limit.scope}), 400
+            key = limit.key() or client_address()
+            if key is None:
+                self._warn_untrusted_proxy()
+                continue
+            buckets.append((f"{request.endpoint}:{limit.scope}:{key}", limit.refill_rate, limit.burst, cost))
+            enforced.append(limit)
+        if not buckets:
+            self._count(request.endpoint, 'allowed')
+            return None
+        try:
+            waits = self.store.take_all(buckets)
+        except Exception:
+            # A broken limiter store should not take the API down with it
+            logger.exception("Rate limit check failed")
+            return None
+        wait = max(waits)
+        if wait:
+            self._count(request.endpoint, 'limited')
+            response = jsonify({
+                "error": "Rate limit exceeded",
+                "scope": enforced[waits.index(wait)].scope,
+                "retry_after": round(wait, 3)
+            })
+            response.status_code = 429
+            response.headers['Retry-After'] = str(math.ceil(wait))
+            return response
+        self._count(request.endpoint, 'allowed')
+        return None
+
+    def _warn_untrusted_proxy(self):
+        if not self._warned_proxy:
+            self._warned_proxy = True
+            logger.warning("Requests arrive through a proxy that TRUSTED_PROXY_HOPS does not cover, "
+                           "so per-address rate limits are not enforced")
+
+    def _count(self, endpoint, outcome):
+        with self._lock:
+            counters = self._counters.setdefault(endpoint, {'allowed': 0, 'limited': 0, 'rejected': 0})
+            counters[outcome] += 1
+
+    def metrics(self):
+        with self._lock:
+            endpoints = {endpoint: dict(counters) for endpoint, counters in self._counters.items()}
+        return {
+            'enabled': self.enabled,
+            'backend': self.store.name if self.store else None,
+            'store': self.store.stats() if self.store else {},
+            'endpoints': endpoints
+        }
+
+    @swag_from({
+        'tags': ['Monitoring'],
+        'summary': 'Rate limiter counters for this worker',
+        'responses': {
+            200: {
+                'description': 'Allowed/limited/rejected counts per endpoint and bucket store size',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'enabled': {'type': 'boolean'},
+                        'backend': {'type': 'string'},
+                        'store': {'type': 'object'},
+                        'endpoints': {'type': 'object'}
+                    }
+                }
+            }
+        }
+    })
+    def metrics_view(self):
+        return jsonify(self.metrics()), 200
+
+
+rate_limiter = RateLimiter()
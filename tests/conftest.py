@@ -0,0 +1,74 @@
+"""Fixtures for the behaviour tests, which run against a real Postgres database.
+
+Point TEST_DATABASE_URL at a disposable database (every table is truncated
+before each test that uses it); without it the database tests are skipped.
+"""
+import os
+import pytest
+
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+# Set before anything reads chat_config / rate_limit / config at import time
+if TEST_DATABASE_URL:
+    os.environ['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URL
+os.environ['RATE_LIMIT_ENABLED'] = 'false'
+os.environ['REALTIME_BACKEND'] = 'sse'
+os.environ.pop('WEB_CONCURRENCY', None)
+os.environ['ATTACHMENT_DIR'] = ''
+os.environ['MESSAGE_ARCHIVE_DIR'] = ''
+# Sync and the change feed serve rows as soon as they commit
+os.environ['MESSAGE_CHANGES_SAFETY_WINDOW'] = '0'
+
+
+@pytest.fixture(scope='session')
+def app():
+    if not TEST_DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL is not set')
+    import app as app_module
+    # Tests drive the background jobs by hand
+    app_module.scheduler.shutdown(wait=False)
+    app_module.outbox_dispatcher.stop()
+    app_module.outbox_dispatcher._thread.join()
+    app_module.discover_service._thread.join()
+    return app_module.app
+
+
+@pytest.fixture
+def db(app):
+    """Empty database inside an app context."""
+    from config import db
+    from blueprints.chat.models import membership_cache
+    from blueprints.feed.discover import discover_service
+    with app.app_context():
+        tables = ', '.join(table.name for table in db.metadata.sorted_tables)
+        db.session.execute(db.text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+        db.session.commit()
+        membership_cache.clear()
+        discover_service.index = None
+        discover_service.fingerprint = None
+        discover_service.rankings.clear()
+        yield db
+        db.session.rollback()
+
+
+@pytest.fixture
+def client(app, db):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_users(db):
+    from blueprints.auth.models import User
+
+    def make_users(*clerk_ids):
+        for clerk_id in clerk_ids:
+            db.session.add(User(clerk_id, clerk_id.upper(), f'{clerk_id}@example.com', None, 'user'))
+        db.session.commit()
+    return make_users
+
+
+@pytest.fixture
+def room(client, make_users):
+    """A direct-message room between users 'a' and 'b'."""
+    make_users('a', 'b')
+    return client.post('/chat/create-dm', json={'user1': 'a', 'user2': 'b'}).json['room_id']
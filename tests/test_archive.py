@@ -0,0 +1,66 @@
+"""Monthly message partitions, and converting a message table from before partitioning."""
+import logging
+from datetime import datetime, timedelta
+
+LEGACY_MESSAGE_TABLE = """
+    CREATE TABLE message (
+        id SERIAL PRIMARY KEY,
+        room_id VARCHAR(255),
+        sender_id VARCHAR(255),
+        content TEXT,
+        created_at TIMESTAMP WITHOUT TIME ZONE
+    )
+"""
+
+
+def test_ensure_message_partitions_creates_months_and_default(db):
+    from blueprints.chat.archive import ensure_message_partitions, _partitions, _current_month
+    db.session.execute(db.text("DROP TABLE message_default"))
+    db.session.commit()
+    assert ensure_message_partitions() == ['message_default']
+    months, has_default = _partitions()
+    assert _current_month() in months and has_default
+    assert ensure_message_partitions() == []
+
+
+def test_ensure_message_partitions_skips_while_another_worker_holds_the_lock(db):
+    from blueprints.chat.archive import ensure_message_partitions, ARCHIVE_LOCK_KEY
+    db.session.execute(db.text("DROP TABLE message_default"))
+    db.session.commit()
+    with db.engine.connect() as other_worker:
+        other_worker.execute(db.text("SELECT pg_advisory_lock(:key)"), {'key': ARCHIVE_LOCK_KEY})
+        assert ensure_message_partitions() == []
+        other_worker.execute(db.text("SELECT pg_advisory_unlock(:key)"), {'key': ARCHIVE_LOCK_KEY})
+        other_worker.commit()
+    assert ensure_message_partitions() == ['message_default']
+
+
+def test_legacy_message_table_is_converted_once(client, db, room, caplog):
+    from blueprints.chat.archive import ensure_message_partitions, partition_message_table, is_partitioned
+    db.session.execute(db.text("DROP TABLE message"))
+    db.session.execute(db.text(LEGACY_MESSAGE_TABLE))
+    now = datetime.now() + timedelta(hours=5, minutes=30)
+    for content, created_at in (('old', now - timedelta(days=100)), ('new', now), ('undated', None)):
+        db.session.execute(db.text(
+            "INSERT INTO message (room_id, sender_id, content, created_at) VALUES (:room, 'a', :content, :at)"
+        ), {'room': room, 'content': content, 'at': created_at})
+    db.session.commit()
+
+    with caplog.at_level(logging.WARNING):
+        assert ensure_message_partitions() == []
+    assert 'flask partition-messages' in caplog.text
+
+    assert partition_message_table() == 3
+    assert is_partitioned()
+    assert partition_message_table() is None
+    placement = dict(db.session.execute(db.text("SELECT content, tableoid::regclass::text FROM message")).all())
+    assert placement['old'] == placement['undated'] == 'message_default'
+    assert placement['new'].startswith('message_y')
+
+    # The id sequence carries on, and history, search and edits work on the new table
+    assert client.post('/chat/send', json={'room_id': room, 'sender_id': 'a', 'content': 'converted'}).status_code == 200
+    assert db.session.execute(db.text("SELECT id FROM message WHERE content = 'converted'")).scalar() == 4
+    history = client.get(f'/chat/get-messages/{room}?user_id=a').json['messages']
+    assert [m['content'] for m in history][-2:] == ['new', 'converted']
+    found = client.get(f'/chat/search?user_id=a&q=converted&room_id={room}').json
+    assert [m['id'] for m in found['results']] == [4]
@@ -0,0 +1,68 @@
+"""Attachment upload, download and sending attachments with a message."""
+import io
+
+import pytest
+
+
+@pytest.fixture
+def blobs(monkeypatch, tmp_path):
+    from blueprints.chat.chat_bp import blob_store
+    monkeypatch.setattr(blob_store, 'root', str(tmp_path))
+    return tmp_path
+
+
+def upload(client, room_id, user_id, content=b'png bytes', name='pic.png', content_type='image/png'):
+    return client.post('/chat/attachments', data={
+        'room_id': room_id, 'user_id': user_id, 'file': (io.BytesIO(content), name, content_type)
+    }, content_type='multipart/form-data')
+
+
+def test_upload_needs_configured_storage(client, room):
+    response = upload(client, room, 'a')
+    assert response.status_code == 503
+
+
+def test_upload_send_and_download(client, room, blobs):
+    first = upload(client, room, 'a')
+    again = upload(client, room, 'b', name='copy.png')
+    assert first.status_code == again.status_code == 201
+    # Identical content is stored once
+    assert first.json['sha256'] == again.json['sha256']
+    assert sum(1 for path in blobs.rglob('*') if path.is_file()) == 1
+
+    assert client.post('/chat/send', json={
+        'room_id': room, 'sender_id': 'a', 'attachment_ids': [first.json['id']]
+    }).status_code == 200
+    message = client.get(f'/chat/get-messages/{room}?user_id=b').json['messages'][-1]
+    assert [a['id'] for a in message['attachments']] == [first.json['id']]
+
+    download = client.get(f"/chat/attachments/{first.json['id']}?user_id=b")
+    assert download.status_code == 200 and download.data == b'png bytes'
+    assert download.headers['ETag'] == f'"{first.json["sha256"]}"'
+    download.close()
+    ranged = client.get(f"/chat/attachments/{first.json['id']}?user_id=b", headers={'Range': 'bytes=0-2'})
+    assert ranged.status_code == 206 and ranged.data == b'png'
+    ranged.close()
+
+
+def test_attachments_are_limited_to_room_members_and_the_uploader(client, make_users, room, blobs, monkeypatch):
+    from blueprints.chat import chat_bp
+    make_users('c')
+    assert upload(client, room, 'c').status_code == 403
+
+    attachment_id = upload(client, room, 'a').json['id']
+    assert client.get(f'/chat/attachments/{attachment_id}?user_id=c').status_code == 403
+    assert client.get('/chat/attachments/999?user_id=a').status_code == 404
+    # Only the uploader can send it, and only with ids that exist
+    assert client.post('/chat/send', json={
+        'room_id': room, 'sender_id': 'b', 'attachment_ids': [attachment_id]
+    }).status_code == 400
+    assert client.post('/chat/send', json={
+        'room_id': room, 'sender_id': 'a', 'attachment_ids': [attachment_id, 999]
+    }).status_code == 400
+    assert client.post('/chat/send', json={
+        'room_id': room, 'sender_id': 'a', 'attachment_ids': ['1']
+    }).status_code == 400
+
+    monkeypatch.setattr(chat_bp, 'ATTACHMENT_MAX_SIZE', 4)
+    assert upload(client, room, 'a', content=b'too large').status_code == 413
@@ -0,0 +1,38 @@
+"""Keyset-paginated chat history."""
+from datetime import datetime
+import pytest
+from pagination import encode_cursor, decode_cursor
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2026, 1, 2, 3, 4, 5, 678)
+    assert decode_cursor(encode_cursor(created_at, 42)) == (created_at, 42)
+    with pytest.raises(ValueError):
+        decode_cursor('not-a-cursor')
+
+
+def _send(client, room, *contents):
+    for content in contents:
+        assert client.post('/chat/send', json={'room_id': room, 'sender_id': 'a', 'content': content}).status_code == 200
+
+
+def test_get_messages_pages_backwards_and_forwards(client, room):
+    _send(client, room, *[f'm{i}' for i in range(7)])
+
+    seen, cursor = [], None
+    while True:
+        page = client.get(f'/chat/get-messages/{room}?user_id=a&limit=3'
+                          + (f'&before={cursor}' if cursor else '')).json
+        seen = [m['content'] for m in page['messages']] + seen
+        cursor = page['next_cursor']
+        if not page['has_more']:
+            break
+    assert seen == [f'm{i}' for i in range(7)]
+
+    newest = client.get(f'/chat/get-messages/{room}?user_id=a&limit=1').json
+    _send(client, room, 'm7', 'm8')
+    page = client.get(f'/chat/get-messages/{room}?user_id=a&limit=5&after={newest["latest_cursor"]}').json
+    assert [m['content'] for m in page['messages']] == ['m7', 'm8']
+    assert page['has_more'] is False
+
+    assert client.get(f'/chat/get-messages/{room}?user_id=a&before=zzz').status_code == 400
@@ -0,0 +1,45 @@
+"""Full-text message search."""
+
+
+def send(client, room_id, sender_id, content):
+    assert client.post('/chat/send', json={'room_id': room_id, 'sender_id': sender_id, 'content': content}).status_code == 200
+
+
+def test_search_ranks_pages_and_highlights(client, db, make_users):
+    make_users('a', 'b', 'c')
+    ab = client.post('/chat/create-dm', json={'user1': 'a', 'user2': 'b'}).json['room_id']
+    send(client, ab, 'a', 'We are deploying the <script>flask</script> servers tonight')
+    send(client, ab, 'b', 'deploy deploy deployment plan')
+    send(client, ab, 'b', 'unrelated')
+
+    first = client.get('/chat/search?user_id=a&q=deploy&limit=1').json
+    assert [m['id'] for m in first['results']] == [2]
+    assert first['results'][0]['sender_name'] == 'B'
+    assert '<mark>deploy</mark>' in first['results'][0]['snippet']
+    assert first['next_offset'] == 1
+
+    second = client.get(f'/chat/search?user_id=a&q=deploy&limit=1&offset={first["next_offset"]}').json
+    assert [m['id'] for m in second['results']] == [1]
+    assert second['next_offset'] is None
+    # Message text is escaped before the highlight markup is added
+    assert '<script>' not in second['results'][0]['snippet']
+    assert '&lt;script&gt;' in second['results'][0]['snippet']
+
+
+def test_search_only_covers_the_users_rooms(client, db, make_users):
+    make_users('a', 'b', 'c')
+    ab = client.post('/chat/create-dm', json={'user1': 'a', 'user2': 'b'}).json['room_id']
+    bc = client.post('/chat/create-dm', json={'user1': 'b', 'user2': 'c'}).json['room_id']
+    send(client, ab, 'a', 'deploy plan')
+    send(client, bc, 'c', 'secret deploy plan')
+
+    assert [m['room_id'] for m in client.get('/chat/search?user_id=a&q=deploy').json['results']] == [ab]
+    assert {m['room_id'] for m in client.get('/chat/search?user_id=b&q=deploy').json['results']} == {ab, bc}
+    assert [m['room_id'] for m in client.get(f'/chat/search?user_id=b&q=deploy&room_id={bc}').json['results']] == [bc]
+    assert client.get(f'/chat/search?user_id=a&q=deploy&room_id={bc}').json['results'] == []
+
+
+def test_search_requires_a_query(client, db, make_users):
+    make_users('a')
+    assert client.get('/chat/search?user_id=a').status_code == 400
+    assert client.get('/chat/search?user_id=a&q=%20').status_code == 400
@@ -0,0 +1,38 @@
+"""Incremental sync across rooms from per-room high-water marks."""
+
+
+def test_sync_caps_each_room_and_skips_messages_without_a_sender(client, db, room):
+    from blueprints.chat.models import Message
+    for i in range(6):
+        # Senders whose user row is gone are left out of the page, not counted in it
+        db.session.add(Message(room_id=room, sender_id='ghost' if i in (1, 2) else 'a', content=f'm{i}'))
+    db.session.commit()
+
+    first = client.post('/chat/sync', json={'user_id': 'a', 'rooms': {room: 0}, 'limit': 2}).json['rooms'][room]
+    assert [m['content'] for m in first['messages']] == ['m0', 'm3']
+    assert first['has_more'] is True
+
+    second = client.post('/chat/sync', json={'user_id': 'a', 'rooms': {room: first['last_id']},
+                                             'limit': 2}).json['rooms'][room]
+    assert [m['content'] for m in second['messages']] == ['m4', 'm5']
+    assert second['has_more'] is False
+
+
+def test_sync_reports_rooms_the_user_is_not_in(client, make_users, room):
+    make_users('c')
+    other = client.post('/chat/create-dm', json={'user1': 'b', 'user2': 'c'}).json['room_id']
+    response = client.post('/chat/sync', json={'user_id': 'a', 'rooms': {room: 0, other: 0}}).json
+    assert list(response['rooms']) == [room]
+    assert response['forbidden'] == [other]
+
+
+def test_sync_holds_back_messages_inside_the_safety_window(client, room, monkeypatch):
+    from blueprints.chat import chat_bp
+    client.post('/chat/send', json={'room_id': room, 'sender_id': 'a', 'content': 'fresh'})
+    monkeypatch.setattr(chat_bp, 'MESSAGE_CHANGES_SAFETY_WINDOW', 60)
+    held = client.post('/chat/sync', json={'user_id': 'a', 'rooms': {room: 0}}).json['rooms'][room]
+    assert (held['messages'], held['last_id'], held['has_more']) == ([], 0, False)
+
+    monkeypatch.setattr(chat_bp, 'MESSAGE_CHANGES_SAFETY_WINDOW', 0)
+    synced = client.post('/chat/sync', json={'user_id': 'a', 'rooms': {room: 0}}).json['rooms'][room]
+    assert [m['content'] for m in synced['messages']] == ['fresh']
@@ -0,0 +1,90 @@
+"""Discover feed ranking: skill overlap, follow proximity, recency and exclusions."""
+from datetime import datetime, timedelta
+from blueprints.feed.discover import DiscoverIndex, ITEM_TYPES
+
+NOW = datetime(2026, 6, 1)
+
+
+def _index():
+    return DiscoverIndex([
+        ('project', 1, 'stranger', NOW, {'python', 'flask'}),
+        ('project', 2, 'stranger', NOW, {'java'}),
+        ('project', 3, 'viewer', NOW, {'python', 'flask'}),
+        ('person', 'friend', 'friend', NOW, {'go'}),
+        ('person', 'fof', 'fof', NOW, {'go'}),
+        ('hackathon', 10, 'organiser', NOW + timedelta(days=1), {'python'}),
+        ('project', 4, 'stranger', NOW - timedelta(days=365), {'python', 'flask'}),
+    ], NOW)
+
+
+def _ids(ranked):
+    return [(item_type, item_id) for item_type, item_id, _ in ranked]
+
+
+def test_rank_orders_by_skill_overlap_then_recency():
+    ranked = _index().rank('viewer', {'python', 'flask'}, set(), set(), ITEM_TYPES, 10)
+    ids = _ids(ranked)
+    assert ids[0] == ('project', 1)
+    # Same skills, a year older
+    assert ids.index(('project', 1)) < ids.index(('project', 4))
+    assert ids.index(('project', 4)) < ids.index(('project', 2))
+    scores = [score for _, _, score in ranked]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_rank_excludes_own_items_and_followed_people():
+    ids = _ids(_index().rank('viewer', {'python'}, {'friend'}, {'fof'}, ITEM_TYPES, 10))
+    assert ('project', 3) not in ids
+    assert ('person', 'friend') not in ids
+    assert ('person', 'fof') in ids
+
+
+def test_rank_boosts_followed_owners_over_second_degree():
+    index = DiscoverIndex([
+        ('project', 1, 'followed', NOW, set()),
+        ('project', 2, 'second', NOW, set()),
+        ('project', 3, 'stranger', NOW, set()),
+    ], NOW)
+    assert _ids(index.rank('viewer', set(), {'followed'}, {'second'}, ITEM_TYPES, 10)) == \
+        [('project', 1), ('project', 2), ('project', 3)]
+
+
+def test_rank_filters_types_and_caps_k():
+    index = _index()
+    assert {item_type for item_type, _, _ in index.rank('viewer', set(), set(), set(), ('hackathon',), 10)} \
+        == {'hackathon'}
+    assert len(index.rank('viewer', set(), set(), set(), ITEM_TYPES, 2)) == 2
+    assert DiscoverIndex([], NOW).rank('viewer', {'python'}, set(), set(), ITEM_TYPES, 10) == []
+
+
+def test_discover_endpoint_pages_the_cached_ranking(client, db, make_users):
+    from blueprints.feed.discover import discover_service
+    from blueprints.follow.models import Follow
+    from blueprints.projects.models import Project
+    from blueprints.user.models import UserDetails
+    make_users('viewer', 'friend', 'owner')
+    for clerk_id, skills in (('viewer', ['Python']), ('friend', ['python'])):
+        db.session.add(UserDetails(clerk_id, clerk_id, f'{clerk_id}@example.com', None, 'user',
+                                   None, None, [], skills, None, None, None))
+    db.session.add(Follow(follower_id='viewer', followed_id='friend'))
+    db.session.add(Project(clerkId='owner', name='match', title='t', short_description='s',
+                           big_description='b', skills_required=['python']))
+    db.session.add(Project(clerkId='owner', name='other', title='t', short_description='s',
+                           big_description='b', skills_required=['cobol']))
+    db.session.commit()
+
+    # No index yet: ask the client to come back
+    response = client.get('/feed/discover/viewer')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+
+    assert discover_service.refresh() is not None
+    assert discover_service.refresh() is None  # catalogue unchanged
+
+    first = client.get('/feed/discover/viewer?limit=1').json
+    assert [(item['type'], item['item']['name']) for item in first['items']] == [('project', 'match')]
+    second = client.get(f'/feed/discover/viewer?limit=1&offset={first["next_offset"]}').json
+    assert [(item['type'], item['item']['name']) for item in second['items']] == [('project', 'other')]
+    assert second['next_offset'] is None  # the followed person and the viewer are left out
+
+    assert client.get('/feed/discover/viewer?types=bogus').status_code == 400
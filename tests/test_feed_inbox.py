@@ -0,0 +1,39 @@
+"""Keyset-paginated feed request inbox over both request tables."""
+from datetime import datetime, timedelta
+from pagination import encode_source_cursor, decode_source_cursor
+
+
+def test_source_cursor_round_trip():
+    created_at = datetime(2026, 1, 2, 3, 4, 5, 678)
+    assert decode_source_cursor(encode_source_cursor(created_at, 'person', 7)) == (created_at, 'person', 7)
+
+
+def test_feed_inbox_pages_through_both_request_types_once(client, db, make_users):
+    from blueprints.projects.models import Project
+    from blueprints.feed.models import FeedRequestPerson, FeedRequestProject
+    make_users('a', 'b', 'c')
+    project = Project(clerkId='a', name='p', title='t', short_description='s', big_description='b')
+    db.session.add(project)
+    db.session.commit()
+    # Ties on created_at across both tables, whose ids overlap
+    start = datetime(2026, 1, 1)
+    for i in range(7):
+        db.session.add(FeedRequestPerson(clerkid_sender='b' if i % 2 else 'c', clerkid_receiver='a',
+                                         status='pending' if i < 2 else 'approved',
+                                         created_at=start + timedelta(minutes=i // 2)))
+        db.session.add(FeedRequestProject(project_id=project.id, clerkid_sender='b', clerkid_receiver='a',
+                                          status='pending' if i == 0 else 'approved',
+                                          created_at=start + timedelta(minutes=i // 2)))
+    db.session.commit()
+
+    seen, cursor = [], None
+    while True:
+        page = client.get('/feed/get_requests/a?status=approved&limit=3'
+                          + (f'&before={cursor}' if cursor else '')).json
+        seen += [(item['request_type'], item['id']) for item in page['requests']]
+        cursor = page['next_cursor']
+        if not page['has_more']:
+            break
+    assert len(seen) == len(set(seen)) == 11
+
+    assert client.get('/feed/get_requests/a?before=zz').status_code == 400
@@ -0,0 +1,82 @@
+"""One pending feed request per sender, receiver (and project), kept in step with the badge counters."""
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+
+@pytest.fixture
+def project_id(db, make_users):
+    from blueprints.projects.models import Project
+    make_users('a', 'b')
+    project = Project(clerkId='a', name='p', title='t', short_description='s', big_description='b')
+    db.session.add(project)
+    db.session.commit()
+    return project.id
+
+
+def _send(client, **fields):
+    return client.post('/feed/send_request', json={'sender_clerkId': 'b', 'receiver_clerkId': 'a', **fields})
+
+
+def test_duplicate_pending_requests_are_refused(client, project_id):
+    assert [_send(client, request_type='person').status_code for _ in range(3)] == [201, 409, 409]
+    assert [_send(client, request_type='project', project_id=project_id).status_code
+            for _ in range(2)] == [201, 409]
+    assert client.get('/feed/request_counts/a').json['total_pending'] == 2
+
+
+def test_answered_request_can_be_sent_again(client, project_id):
+    _send(client, request_type='person')
+    assert client.put('/feed/update_request/1', json={'request_type': 'person', 'status': 'rejected'}).status_code == 200
+    assert _send(client, request_type='person').status_code == 201
+    counts = client.get('/feed/request_counts/a').json['person']
+    assert (counts['pending'], counts['rejected']) == (1, 1)
+
+
+def test_unique_index_holds_without_the_endpoint(db, project_id):
+    from blueprints.feed.models import FeedRequestPerson
+    db.session.add(FeedRequestPerson(clerkid_sender='b', clerkid_receiver='a'))
+    db.session.commit()
+    db.session.add(FeedRequestPerson(clerkid_sender='b', clerkid_receiver='a'))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+    db.session.add(FeedRequestPerson(clerkid_sender='b', clerkid_receiver='a', status='approved'))
+    db.session.commit()
+
+
+def test_bulk_update_approves_and_adds_applicants_to_the_project_chat(client, db, make_users, project_id):
+    from blueprints.chat.models import Chat
+    from blueprints.projects.models import Project
+    make_users('c', 'd', 'z')
+    for sender in 'bcd':
+        _send(client, sender_clerkId=sender, request_type='project', project_id=project_id)
+    # Addressed to someone else, so outside this receiver's bulk update
+    _send(client, receiver_clerkId='z', request_type='project', project_id=project_id)
+    _send(client, request_type='person')
+
+    response = client.put('/feed/bulk_update_requests', json={
+        'receiver_clerkId': 'a', 'status': 'approved',
+        'project_ids': [1, 2, 4, 99], 'person_ids': [1], 'add_to_chat': True
+    }).json
+    assert response == {
+        'updated': {'person': [1], 'project': [1, 2]},
+        'unchanged': {'person': [], 'project': [4, 99]},
+        'added_to_chat': 2
+    }
+    room = db.session.get(Project, project_id).chat_room_id
+    assert Chat.members_of(room)[1] == frozenset({'a', 'b', 'c'})
+    counts = client.get('/feed/request_counts/a').json
+    assert counts['project'] == {'approved': 2, 'pending': 1, 'rejected': 0}
+    assert counts['person']['approved'] == 1 and counts['total_pending'] == 1
+
+
+def test_bulk_update_leaves_answered_requests_and_rejects_bad_ids(client, project_id):
+    _send(client, request_type='project', project_id=project_id)
+    body = {'receiver_clerkId': 'a', 'status': 'approved', 'project_ids': [1]}
+    assert client.put('/feed/bulk_update_requests', json=body).json['updated']['project'] == [1]
+    again = client.put('/feed/bulk_update_requests', json=body).json
+    assert again['updated']['project'] == [] and again['unchanged']['project'] == [1]
+    assert client.get('/feed/request_counts/a').json['project']['approved'] == 1
+
+    for bad in ({'project_ids': ['x']}, {'project_ids': [True]}, {'status': 'maybe'}, {'receiver_clerkId': None}):
+        assert client.put('/feed/bulk_update_requests', json={**body, **bad}).status_code == 400
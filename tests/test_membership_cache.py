@@ -0,0 +1,44 @@
+"""Room membership checks served from the in-process cache, and invalidated when members change."""
+from sqlalchemy import event
+
+
+def test_repeat_sends_reuse_the_cached_membership(client, db, room):
+    from blueprints.chat.models import membership_cache
+    statements = []
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        client.post('/chat/send', json={'room_id': room, 'sender_id': 'a', 'content': 'warm'})
+        statements.clear()
+        hits = membership_cache.hits
+        assert client.post('/chat/send', json={'room_id': room, 'sender_id': 'b', 'content': 'cached'}).status_code == 200
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    assert membership_cache.hits == hits + 1
+    assert not any('chat_participant' in statement for statement in statements)
+
+
+def test_join_and_leave_take_effect_immediately(client, db, make_users):
+    from blueprints.chat.models import Chat
+    make_users('c')
+    db.session.add(Chat(room_id='open-x', is_group=True, is_open_group=True, topic='x'))
+    db.session.commit()
+
+    def send():
+        return client.post('/chat/send', json={'room_id': 'open-x', 'sender_id': 'c', 'content': 'hi'}).status_code
+
+    assert send() == 403
+    assert client.post('/chat/join-open-group', json={'user_id': 'c', 'topic_slug': 'x'}).status_code == 200
+    assert send() == 200
+    assert client.post('/chat/leave-open-group', json={'user_id': 'c', 'topic_slug': 'x'}).status_code == 200
+    assert send() == 403
+    assert client.post('/chat/leave-open-group', json={'user_id': 'c', 'topic_slug': 'nope'}).status_code == 404
+
+
+def test_cache_metrics(client, room):
+    client.post('/chat/send', json={'room_id': room, 'sender_id': 'a', 'content': 'one'})
+    client.post('/chat/send', json={'room_id': room, 'sender_id': 'a', 'content': 'two'})
+    metrics = client.get('/chat/membership-cache/metrics').json
+    assert metrics['hits'] >= 1 and metrics['size'] >= 1
+    assert 0 < metrics['hit_ratio'] <= 1
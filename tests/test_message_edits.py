@@ -0,0 +1,77 @@
+"""Message edits, soft deletes and the change feed, and tombstones elsewhere in chat."""
+from datetime import datetime, timedelta
+
+
+def _send(client, room, sender, *contents):
+    for content in contents:
+        client.post('/chat/send', json={'room_id': room, 'sender_id': sender, 'content': content})
+    return [m['id'] for m in client.get(f'/chat/get-messages/{room}?user_id=a').json['messages']]
+
+
+def test_edit_bumps_the_version_and_refuses_stale_writers(client, room):
+    message_id, = _send(client, room, 'a', 'hello')
+    edited = client.patch(f'/chat/messages/{message_id}', json={'user_id': 'a', 'content': 'hi', 'version': 1})
+    assert edited.status_code == 200
+    assert (edited.json['content'], edited.json['version'], edited.json['deleted']) == ('hi', 2, False)
+
+    stale = client.patch(f'/chat/messages/{message_id}', json={'user_id': 'a', 'content': 'hey', 'version': 1})
+    assert (stale.status_code, stale.json['version']) == (409, 2)
+    assert client.patch(f'/chat/messages/{message_id}',
+                        json={'user_id': 'b', 'content': 'mine now'}).status_code == 403
+    assert client.patch(f'/chat/messages/{message_id}',
+                        json={'user_id': 'a', 'content': 'x', 'version': True}).status_code == 400
+    assert client.patch('/chat/messages/999', json={'user_id': 'a', 'content': 'x'}).status_code == 404
+
+    history = client.get(f'/chat/get-messages/{room}?user_id=a').json['messages']
+    assert [(m['content'], m['version']) for m in history] == [('hi', 2)]
+
+
+def test_delete_leaves_a_tombstone_that_history_skips(client, room):
+    kept, deleted = _send(client, room, 'a', 'keep', 'drop')
+    assert client.delete(f'/chat/messages/{deleted}?user_id=a&version=2').status_code == 409
+    response = client.delete(f'/chat/messages/{deleted}?user_id=a&version=1')
+    assert (response.status_code, response.json['deleted'], response.json['content']) == (200, True, None)
+    assert client.delete(f'/chat/messages/{deleted}?user_id=a').status_code == 410
+    assert client.patch(f'/chat/messages/{deleted}', json={'user_id': 'a', 'content': 'back'}).status_code == 410
+
+    history = client.get(f'/chat/get-messages/{room}?user_id=a').json['messages']
+    assert [m['id'] for m in history] == [kept]
+
+
+def test_change_feed_pages_edits_and_deletes_in_order(client, room):
+    first, second, untouched = _send(client, room, 'a', 'one', 'two', 'three')
+    client.patch(f'/chat/messages/{second}', json={'user_id': 'a', 'content': 'TWO'})
+    client.delete(f'/chat/messages/{first}?user_id=a')
+
+    page = client.get(f'/chat/message-changes/{room}?user_id=a&limit=1').json
+    assert [(c['id'], c['content'], c['deleted']) for c in page['changes']] == [(second, 'TWO', False)]
+    assert page['has_more'] is True
+    page = client.get(f'/chat/message-changes/{room}?user_id=a&since={page["next_cursor"]}').json
+    assert [(c['id'], c['deleted']) for c in page['changes']] == [(first, True)]
+    assert page['has_more'] is False
+
+    # Nothing new: the cursor stays put
+    again = client.get(f'/chat/message-changes/{room}?user_id=a&since={page["next_cursor"]}').json
+    assert (again['changes'], again['next_cursor']) == ([], page['next_cursor'])
+    assert client.get(f'/chat/message-changes/{room}?user_id=c').status_code == 403
+
+
+def test_mark_read_skips_a_deleted_tail(client, room):
+    kept, deleted = _send(client, room, 'b', 'seen', 'gone')
+    client.delete(f'/chat/messages/{deleted}?user_id=b')
+    response = client.post('/chat/read', json={'room_id': room, 'user_id': 'a'}).json
+    assert response['last_read_message_id'] == kept
+
+
+def test_open_group_activity_ignores_deleted_messages(client, db, make_users):
+    from blueprints.chat.models import Chat, Message
+    make_users('a')
+    started = datetime(2026, 1, 1)
+    db.session.add(Chat(room_id='open-rust', is_group=True, is_open_group=True, topic='Rust', created_at=started))
+    db.session.add(Message(room_id='open-rust', sender_id='a', content='live', created_at=started + timedelta(days=1)))
+    db.session.add(Message(room_id='open-rust', sender_id='a', content=None, created_at=started + timedelta(days=2),
+                           deleted_at=started + timedelta(days=3), updated_at=started + timedelta(days=3)))
+    db.session.commit()
+
+    group, = client.get('/auth/open-groups?sort=activity').json['groups']
+    assert group['last_activity_at'] == (started + timedelta(days=1)).isoformat()
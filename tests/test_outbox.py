@@ -0,0 +1,76 @@
+"""Delivery of chat_outbox rows through a realtime backend."""
+import pytest
+from blueprints.chat.realtime import RealtimeBackend
+
+
+class RecordingBackend(RealtimeBackend):
+    """Accepts single events only; batches raise ValueError like an oversized Pusher batch."""
+    name = 'recording'
+
+    def __init__(self, fail_on_call=None, reject=()):
+        self.sent = []
+        self.calls = 0
+        self.fail_on_call = fail_on_call
+        self.reject = set(reject)
+
+    def trigger_batch(self, events):
+        self.calls += 1
+        if self.calls == self.fail_on_call:
+            raise ConnectionError('backend down')
+        if len(events) > 1:
+            raise ValueError('batch too large')
+        if events[0]['data']['n'] in self.reject:
+            raise ValueError('payload too large')
+        self.sent.append(events[0]['data']['n'])
+
+
+@pytest.fixture
+def queued(db):
+    from blueprints.chat import outbox
+    for n in range(5):
+        outbox.enqueue('room', 'new_message', {'n': n})
+    db.session.commit()
+
+
+def _remaining():
+    from blueprints.chat.models import RealtimeOutbox
+    return [(event.payload['n'], event.attempts) for event in RealtimeOutbox.query.order_by(RealtimeOutbox.id)]
+
+
+def test_delivers_a_batch_and_empties_the_outbox(db, queued):
+    from blueprints.chat.outbox import OutboxDispatcher
+
+    class BatchBackend(RecordingBackend):
+        def trigger_batch(self, events):
+            self.sent += [event['data']['n'] for event in events]
+
+    backend = BatchBackend()
+    assert OutboxDispatcher(backend=backend).dispatch_once() == 5
+    assert backend.sent == [0, 1, 2, 3, 4]
+    assert _remaining() == []
+
+
+def test_transport_error_mid_resend_keeps_delivered_events_out_of_the_retry(db, queued):
+    from blueprints.chat.outbox import OutboxDispatcher
+    # Call 1 is the whole batch; calls 2-3 deliver events 0 and 1; call 4 fails on event 2
+    backend = RecordingBackend(fail_on_call=4)
+    assert OutboxDispatcher(backend=backend).dispatch_once() == 2
+    assert backend.sent == [0, 1]
+    assert _remaining() == [(2, 1), (3, 1), (4, 1)]
+
+
+def test_undeliverable_events_are_dropped_alone(db, queued):
+    from blueprints.chat.outbox import OutboxDispatcher
+    backend = RecordingBackend(reject={1, 3})
+    assert OutboxDispatcher(backend=backend).dispatch_once() == 3
+    assert backend.sent == [0, 2, 4]
+    assert _remaining() == []
+
+
+def test_failed_batch_is_retried_later(db, queued):
+    from blueprints.chat.outbox import OutboxDispatcher
+    dispatcher = OutboxDispatcher(backend=RecordingBackend(fail_on_call=1))
+    assert dispatcher.dispatch_once() == 0
+    assert _remaining() == [(n, 1) for n in range(5)]
+    # Backed off, so nothing is due yet
+    assert dispatcher.dispatch_once() == 0
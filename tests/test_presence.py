@@ -0,0 +1,67 @@
+"""Room presence stores: transitions, expiry and the room / per-room caps."""
+import time
+import pytest
+from blueprints.chat import presence
+from blueprints.chat.presence import MemoryPresenceStore, SQLitePresenceStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_store(request, tmp_path):
+    def make_store(**kwargs):
+        if request.param == 'memory':
+            return MemoryPresenceStore(**kwargs)
+        return SQLitePresenceStore(path=str(tmp_path / 'presence.db'), **kwargs)
+    return make_store
+
+
+def test_heartbeat_reports_transitions(make_store):
+    store = make_store()
+    assert store.heartbeat('r', 'a') == (True, False)
+    assert store.heartbeat('r', 'a', typing=True) == (False, True)
+    assert store.heartbeat('r', 'a', typing=True) == (False, False)
+    assert store.online('r') == [('a', True)]
+    assert store.leave('r', 'a') is True
+    assert store.leave('r', 'a') is False
+    assert store.online('r') == []
+
+
+def test_sweep_reports_expired_users_once(make_store):
+    store = make_store(ttl=0.05)
+    store.heartbeat('r', 'a')
+    time.sleep(0.1)
+    assert store.online('r') == []
+    assert store.sweep() == [('r', 'a')]
+    assert store.sweep() == []
+
+
+def test_per_room_cap_evicts_least_recently_active(make_store):
+    store = make_store(max_per_room=2)
+    for user_id in ('a', 'b', 'c'):
+        store.heartbeat('r', user_id)
+    assert [user_id for user_id, _ in store.online('r')] == ['b', 'c']
+    assert store.sweep() == [('r', 'a')]
+    assert store.stats()['evictions'] == 1
+
+
+def test_room_cap_evicts_least_recently_active_room(make_store):
+    store = make_store(max_rooms=2)
+    store.heartbeat('r1', 'a')
+    store.heartbeat('r2', 'b')
+    store.heartbeat('r1', 'a')
+    store.heartbeat('r3', 'c')
+    assert store.online('r2') == []
+    assert [user_id for user_id, _ in store.online('r1')] == ['a']
+    # A user who came back after being evicted is not announced as gone
+    store.heartbeat('r4', 'd')
+    store.heartbeat('r1', 'a')
+    assert sorted(store.sweep()) == [('r2', 'b'), ('r3', 'c')]
+
+
+def test_memory_store_is_refused_with_several_workers(monkeypatch):
+    monkeypatch.setenv('WEB_CONCURRENCY', '3')
+    with pytest.raises(ValueError):
+        presence.create_presence_store('memory')
+    monkeypatch.setattr(presence, 'SQLitePresenceStore', lambda: 'shared')
+    assert presence.create_presence_store('') == 'shared'
+    monkeypatch.setenv('WEB_CONCURRENCY', '1')
+    assert isinstance(presence.create_presence_store(''), MemoryPresenceStore)
@@ -0,0 +1,83 @@
+"""Token buckets: all-or-nothing spending and the 400 for requests that can never fit."""
+import pytest
+from flask import Flask, request
+from rate_limit import Limit, MemoryBucketStore, RateLimiter, SQLiteBucketStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBucketStore()
+    return SQLiteBucketStore(str(tmp_path / 'buckets.db'))
+
+
+def test_take_all_spends_every_bucket_or_none(store):
+    # Refill is 1 token/second, so nothing refills noticeably during the test
+    roomy, tight = ('roomy', 1, 3, 1), ('tight', 1, 1, 1)
+    assert store.take_all([roomy, tight]) == [0, 0]
+    waits = store.take_all([roomy, tight])
+    assert waits[0] == 0 and waits[1] > 0
+    # The refused request did not drain the bucket that could have paid
+    assert store.take_all([roomy]) == [0]
+    assert store.take_all([roomy]) == [0]
+    assert store.take_all([roomy])[0] > 0
+
+
+def test_max_keys_evicts_least_recently_used():
+    store = MemoryBucketStore(max_keys=2)
+    for key in ('a', 'b', 'c'):
+        store.take_all([(key, 1, 1, 1)])
+    assert store.stats() == {'buckets': 2}
+    # 'a' was evicted and comes back full
+    assert store.take_all([('a', 1, 1, 1)]) == [0]
+
+
+@pytest.fixture
+def limited_client():
+    app = Flask(__name__)
+    limiter = RateLimiter(limits={
+        'upload': [
+            Limit('client', 1, 60, burst=2),
+            Limit('size', 10, 60, cost=lambda: int(request.args.get('cost', 1)))
+        ]
+    }, store=MemoryBucketStore(), enabled=True)
+    limiter.init_app(app)
+    app.add_url_rule('/upload', 'upload', lambda: 'ok', methods=['POST'])
+    return app.test_client(), limiter
+
+
+def test_limiter_returns_429_with_retry_after(limited_client):
+    client, limiter = limited_client
+    assert [client.post('/upload').status_code for _ in range(2)] == [200, 200]
+    response = client.post('/upload')
+    assert response.status_code == 429
+    assert response.json['scope'] == 'client'
+    assert int(response.headers['Retry-After']) >= 1
+    assert limiter.metrics()['endpoints']['upload']['limited'] == 1
+
+
+def test_limiter_rejects_cost_over_burst_without_spending(limited_client):
+    client, limiter = limited_client
+    response = client.post('/upload?cost=11')
+    assert response.status_code == 400
+    assert response.json['scope'] == 'size'
+    # Nothing was taken from the client bucket
+    assert [client.post('/upload?cost=5').status_code for _ in range(2)] == [200, 200]
+    assert limiter.metrics()['endpoints']['upload']['rejected'] == 1
+
+
+def test_per_address_limits_skip_requests_from_an_untrusted_proxy(limited_client):
+    client, limiter = limited_client
+    forwarded = {'X-Forwarded-For': '203.0.113.7'}
+    # Without ProxyFix the peer is the proxy itself, shared by every user
+    assert [client.post('/upload', headers=forwarded).status_code for _ in range(4)] == [200] * 4
+
+
+def test_per_address_limits_use_the_forwarded_address_behind_proxy_fix(limited_client):
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    client, limiter = limited_client
+    client.application.wsgi_app = ProxyFix(client.application.wsgi_app, x_for=1)
+    first = {'X-Forwarded-For': '203.0.113.7'}
+    second = {'X-Forwarded-For': '203.0.113.8'}
+    assert [client.post('/upload', headers=first).status_code for _ in range(3)] == [200, 200, 429]
+    assert client.post('/upload', headers=second).status_code == 200
@@ -0,0 +1,59 @@
+"""Per-room retention settings and the scheduled purge."""
+import pytest
+
+ROOM = 'open-rust'
+
+
+@pytest.fixture
+def open_group(client, db, make_users):
+    make_users('a', 'b')
+    db.session.execute(db.text("UPDATE users SET role = 'admin' WHERE \"clerkId\" = 'a'"))
+    db.session.commit()
+    assert client.post('/auth/create-open-group', json={'clerkId': 'a', 'topic': 'Rust'}).status_code == 201
+    assert client.post('/chat/join-open-group', json={'user_id': 'a', 'topic_slug': 'rust'}).status_code == 200
+    client.post('/chat/send-batch', json={
+        'messages': [{'room_id': ROOM, 'sender_id': 'a', 'content': f'm{i}'} for i in range(10)]
+    })
+    return ROOM
+
+
+def message_ids(db):
+    return db.session.execute(db.text("SELECT id FROM message ORDER BY id")).scalars().all()
+
+
+def test_retention_settings_are_validated(client, open_group):
+    assert client.put(f'/chat/retention/{open_group}', json={'user_id': 'b', 'max_messages': 5}).status_code == 403
+    assert client.put(f'/chat/retention/{open_group}', json={'user_id': 'a', 'max_messages': 0}).status_code == 400
+    assert client.put(f'/chat/retention/{open_group}', json={'user_id': 'a', 'max_messages': 5}).status_code == 200
+
+
+def test_purge_keeps_the_newest_messages(client, db, open_group):
+    from blueprints.chat.retention import RetentionPurger
+    client.put(f'/chat/retention/{open_group}', json={'user_id': 'a', 'max_messages': 4})
+    stats = RetentionPurger(batch_size=3, pause=0).run()
+    assert stats['messages'] == 6 and stats['completed']
+    assert message_ids(db) == [7, 8, 9, 10]
+    assert RetentionPurger(batch_size=3, pause=0).run()['messages'] == 0
+
+
+def test_purge_by_age(client, db, open_group):
+    from blueprints.chat.retention import RetentionPurger
+    db.session.execute(db.text("UPDATE message SET created_at = created_at - interval '40 days' WHERE id <= 8"))
+    db.session.commit()
+    client.put(f'/chat/retention/{open_group}', json={'user_id': 'a', 'max_age_days': 30})
+    assert RetentionPurger(pause=0).run()['messages'] == 8
+    assert message_ids(db) == [9, 10]
+
+
+def test_purge_skips_while_another_worker_holds_the_lock(client, db, open_group):
+    from blueprints.chat.retention import RetentionPurger, RETENTION_LOCK_KEY
+    client.put(f'/chat/retention/{open_group}', json={'user_id': 'a', 'max_messages': 4})
+    purger = RetentionPurger(pause=0)
+    with db.engine.connect() as other_worker:
+        other_worker.execute(db.text("SELECT pg_advisory_lock(:key)"), {'key': RETENTION_LOCK_KEY})
+        assert purger.run() is None
+        other_worker.execute(db.text("SELECT pg_advisory_unlock(:key)"), {'key': RETENTION_LOCK_KEY})
+        other_worker.commit()
+    assert len(message_ids(db)) == 10
+    assert purger.metrics()['skipped_runs'] == 1
+    assert purger.run()['messages'] == 6
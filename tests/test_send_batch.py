@@ -0,0 +1,50 @@
+"""Batched sends, with client_msg_id making retries safe."""
+
+
+def contents(client, room):
+    return [m['content'] for m in client.get(f'/chat/get-messages/{room}?user_id=a').json['messages']]
+
+
+def test_batch_reports_each_message(client, make_users, room):
+    make_users('c')
+    results = client.post('/chat/send-batch', json={'messages': [
+        {'room_id': room, 'sender_id': 'a', 'content': 'one'},
+        {'room_id': room, 'sender_id': 'c', 'content': 'outsider'},
+        {'room_id': 'nope', 'sender_id': 'a', 'content': 'lost'},
+        {'room_id': room, 'sender_id': 'b', 'content': 'two'}
+    ]}).json['results']
+    assert [r['status'] for r in results] == ['sent', 'unauthorized', 'not_found', 'sent']
+    assert [r['id'] for r in results if r['status'] == 'sent'] == [1, 2]
+    assert contents(client, room) == ['one', 'two']
+
+
+def test_retried_batch_is_stored_once(client, db, room):
+    from blueprints.chat.models import purge_idempotency_keys
+    batch = {'messages': [
+        {'room_id': room, 'sender_id': 'a', 'content': 'one', 'client_msg_id': 'k1'},
+        # The key is scoped per sender
+        {'room_id': room, 'sender_id': 'b', 'content': 'two', 'client_msg_id': 'k1'},
+        {'room_id': room, 'sender_id': 'a', 'content': 'repeat', 'client_msg_id': 'k1'},
+        {'room_id': room, 'sender_id': 'a', 'content': 'unkeyed'}
+    ]}
+    first = client.post('/chat/send-batch', json=batch).json['results']
+    assert [(r['status'], r['id']) for r in first] == [('sent', 1), ('sent', 2), ('duplicate', 1), ('sent', 3)]
+
+    retry = client.post('/chat/send-batch', json=batch).json['results']
+    assert [(r['status'], r['id']) for r in retry[:3]] == [('duplicate', 1), ('duplicate', 2), ('duplicate', 1)]
+    assert retry[3]['status'] == 'sent'
+    assert contents(client, room) == ['one', 'two', 'unkeyed', 'unkeyed']
+
+    # Once the keys expire the same id is accepted again
+    assert purge_idempotency_keys(0) == 2
+    again = client.post('/chat/send-batch', json={'messages': batch['messages'][:1]}).json['results']
+    assert again[0]['status'] == 'sent'
+
+
+def test_invalid_batches_are_refused(client, room):
+    assert client.post('/chat/send-batch', json={}).status_code == 400
+    assert client.post('/chat/send-batch', json={'messages': [{'room_id': room}]}).status_code == 400
+    assert client.post('/chat/send-batch', json={'messages': [
+        {'room_id': room, 'sender_id': 'a', 'content': 'x', 'client_msg_id': 7}
+    ]}).status_code == 400
+    assert contents(client, room) == []
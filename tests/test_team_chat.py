@@ -0,0 +1,41 @@
+"""Team chats are created with the team, one participant row per member."""
+from datetime import datetime, timedelta
+
+
+def _hackathon(db):
+    from blueprints.hackathon.models import Hackathon
+    now = datetime.utcnow()
+    hackathon = Hackathon(organiser_clerkId='o', title='H', description='d', start_date=now + timedelta(days=3),
+                          end_date=now + timedelta(days=5), mode='online', max_team_size=4,
+                          registration_deadline=now + timedelta(days=2), status='approved', tags=[])
+    db.session.add(hackathon)
+    db.session.commit()
+    return hackathon.id
+
+
+def test_team_chat_gets_every_member(db, make_users):
+    from blueprints.chat.models import Chat, ChatParticipant
+    from blueprints.registration.models import Team
+    make_users('o', 'lead', 'x')
+    team = Team(hackathon_id=_hackathon(db), leader_id='lead', team_name='t', max_members=4, members=['x'])
+    db.session.add(team)
+    db.session.commit()
+
+    chat = Chat.query.filter_by(room_id=f'team-{team.id}').one()
+    roles = {participant.clerk_id: participant.role
+             for participant in ChatParticipant.query.filter_by(chat_id=chat.id)}
+    assert roles == {'lead': 'owner', 'x': 'member'}
+    assert chat.participant_count == 2
+
+
+def test_duplicate_members_are_added_once(db, make_users):
+    from blueprints.chat.models import Chat, ChatParticipant
+    from blueprints.registration.models import Team
+    make_users('o', 'lead', 'x')
+    team = Team(hackathon_id=_hackathon(db), leader_id='lead', team_name='t', max_members=4,
+                members=['x', 'lead', 'x'])
+    db.session.add(team)
+    db.session.commit()
+
+    chat = Chat.query.filter_by(room_id=f'team-{team.id}').one()
+    assert chat.participant_count == ChatParticipant.query.filter_by(chat_id=chat.id).count() == 2
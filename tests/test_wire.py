@@ -0,0 +1,43 @@
+"""History pages in the columnar layout, MessagePack and compressed encodings."""
+import gzip
+import json
+import pytest
+
+
+def _send(client, room, *contents):
+    for content in contents:
+        client.post('/chat/send', json={'room_id': room, 'sender_id': 'a', 'content': content})
+
+
+def test_columnar_page_matches_rows_and_carries_versions(client, room):
+    _send(client, room, 'one', 'two')
+    first = client.get(f'/chat/get-messages/{room}?user_id=a').json['messages'][0]
+    assert client.patch(f"/chat/messages/{first['id']}",
+                        json={'user_id': 'a', 'content': 'one!', 'version': 1}).status_code == 200
+
+    rows = client.get(f'/chat/get-messages/{room}?user_id=a').json['messages']
+    page = client.get(f'/chat/get-messages/{room}?user_id=a&format=columnar').json['messages']
+    columns = page['columns']
+    assert page['senders'] == [{'id': 'a', 'name': 'A'}]
+    assert columns['id'] == [row['id'] for row in rows]
+    assert columns['content'] == ['one!', 'two']
+    assert columns['version'] == [row['version'] for row in rows] == [2, 1]
+    assert columns['edited_at'][1] is None and columns['edited_at'][0]
+    # No message has attachments, so the column is left out
+    assert 'attachments' not in columns
+
+    assert client.get(f'/chat/get-messages/{room}?user_id=a&format=bogus').status_code == 400
+
+
+def test_msgpack_and_gzip_encodings(client, room):
+    msgpack = pytest.importorskip('msgpack')
+    _send(client, room, *[f'message {i} ' * 20 for i in range(20)])
+    expected = client.get(f'/chat/get-messages/{room}?user_id=a').json
+
+    packed = client.get(f'/chat/get-messages/{room}?user_id=a', headers={'Accept': 'application/msgpack'})
+    assert packed.mimetype == 'application/msgpack'
+    assert msgpack.unpackb(packed.data, raw=False) == expected
+
+    compressed = client.get(f'/chat/get-messages/{room}?user_id=a', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(compressed.data)) == expected